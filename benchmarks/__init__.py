@@ -0,0 +1,7 @@
+"""
+Performance benchmarks for the thesaurus loaders and app.
+
+    python -m benchmarks.generate --concepts 10000 -o thesaurus.nt
+    python -m benchmarks.run --concepts 10000 -o results.json
+    python -m benchmarks.compare before.json after.json
+"""
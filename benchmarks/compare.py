@@ -0,0 +1,57 @@
+"""
+Compare two benchmark result files.
+
+    python -m benchmarks.compare before.json after.json
+
+Prints the change in median time of every benchmark found in both
+files and exits non-zero when one got slower by more than the
+threshold.
+"""
+import argparse
+import json
+import sys
+
+
+def compare(before, after, threshold=0.2, min_delta=0.5):
+    """
+    (name, old median, new median, ratio, regressed) for every
+    benchmark in both result sets; a benchmark regressed when its median
+    grew by more than @threshold and by more than @min_delta ms
+    """
+    rows = []
+    for name in sorted(set(before['results']) & set(after['results'])):
+        old = before['results'][name]['median']
+        new = after['results'][name]['median']
+        ratio = new / old if old else float('inf')
+        regressed = ratio > 1 + threshold and new - old > min_delta
+        rows.append((name, old, new, ratio, regressed))
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare two benchmark result files')
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("-t", "--threshold", dest="threshold", type=float, default=0.2,
+                        help="relative slowdown of the median counted as a regression")
+    parser.add_argument("-m", "--min-delta", dest="min_delta", type=float, default=0.5,
+                        help="ignore slowdowns smaller than this many milliseconds")
+    args = parser.parse_args()
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    for report in (before, after):
+        print("{}: {} ({} concepts)".format(report.get('commit'), report.get('date'), report.get('concepts')))
+    if before.get('concepts') != after.get('concepts'):
+        print("warning: the runs used different thesaurus sizes")
+
+    rows = compare(before, after, args.threshold, args.min_delta)
+    for name, old, new, ratio, regressed in rows:
+        print("{:32} {:10.2f} ms -> {:10.2f} ms  {:6.2f}x{}".format(
+            name, old, new, ratio, '  REGRESSION' if regressed else ''))
+    regressions = [row for row in rows if row[4]]
+    if regressions:
+        print("{} regression(s)".format(len(regressions)))
+        sys.exit(1)
@@ -0,0 +1,177 @@
+"""
+Generator for synthetic, UNBIS/EuroVoc-shaped thesauri.
+
+The output is N-Triples (which create_db.py reads as Turtle), written
+one statement at a time so any size can be generated in constant
+memory.  The same seed always gives the same thesaurus.
+"""
+import argparse
+import json
+import random
+import sys
+
+BASE = 'http://metadata.un.org/thesaurus#'
+RDF_TYPE = 'http://www.w3.org/1999/02/22-rdf-syntax-ns#type'
+SKOS = 'http://www.w3.org/2004/02/skos/core#'
+DCTERMS = 'http://purl.org/dc/terms/'
+EU = 'http://eurovoc.europa.eu/schema#'
+
+LANGUAGES = ['ar', 'zh', 'en', 'fr', 'ru', 'es']
+
+# syllables used to make up words in each language
+SYLLABLES = {
+    'en': ['de', 'mo', 'cra', 'cy', 'el', 'ec', 'tion', 'tra', 'de', 'ri', 'ghts', 'hu', 'man',
+           'se', 'cu', 'ri', 'ty', 'dev', 'el', 'op', 'ment', 'wa', 'ter', 'land', 'po', 'li'],
+    'fr': ['dé', 'mo', 'cra', 'tie', 'é', 'lec', 'tion', 'droit', 'hu', 'main', 'sé', 'cu',
+           'ri', 'té', 'dé', 've', 'lop', 'pe', 'ment', 'eau', 'ter', 're', 'po', 'li', 'ti', 'que'],
+    'es': ['de', 'mo', 'cra', 'cia', 'e', 'lec', 'ción', 'de', 're', 'cho', 'hu', 'ma', 'no',
+           'se', 'gu', 'ri', 'dad', 'de', 'sa', 'rro', 'llo', 'a', 'gua', 'ña', 'po', 'lí'],
+    'ru': ['де', 'мо', 'кра', 'тия', 'вы', 'бо', 'ры', 'пра', 'ва', 'че', 'ло', 'век', 'бе',
+           'зо', 'пас', 'ность', 'раз', 'ви', 'тие', 'во', 'да', 'зем', 'ля', 'по', 'ли', 'ёж'],
+    'ar': ['دي', 'مق', 'را', 'طي', 'ة', 'ان', 'تخ', 'اب', 'ات', 'حق', 'وق', 'إن', 'سا', 'ن',
+           'أم', 'ن', 'تن', 'مي', 'ة', 'مي', 'اه', 'أر', 'ض', 'سي', 'ا', 'سة'],
+    'zh': list('民主选举人权安全发展水土地政治经济社会文化国际法律环境卫生教育科学'),
+}
+
+
+def make_word(rng, lang):
+    n = rng.randint(1, 2) if lang == 'zh' else rng.randint(2, 4)
+    return ''.join(rng.choice(SYLLABLES[lang]) for _ in range(n))
+
+
+def make_label(rng, lang, words=None):
+    words = words or rng.randint(1, 3)
+    sep = '' if lang == 'zh' else ' '
+    label = sep.join(make_word(rng, lang) for _ in range(words))
+    if lang in ('en', 'fr', 'es', 'ru'):
+        label = label[0].upper() + label[1:]
+    return label
+
+
+def uri(anchor):
+    return '<{}{}>'.format(BASE, anchor)
+
+
+def literal(value, lang=None):
+    escaped = value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n').replace('\r', '\\r')
+    if lang:
+        return '"{}"@{}'.format(escaped, lang)
+    return '"{}"'.format(escaped)
+
+
+def structure(concepts):
+    """
+    (domains, microthesauri per domain) sized like EuroVoc for large
+    thesauri and smaller for small ones
+    """
+    domains = max(2, min(21, concepts // 1000))
+    per_domain = max(2, min(8, concepts // (domains * 100)))
+    return domains, per_domain
+
+
+def generate(out, concepts=1000, seed=0, alt_ratio=0.3, related_ratio=0.2, note_ratio=0.1):
+    """
+    write a thesaurus of @concepts concepts to the text stream @out;
+    returns a manifest of sample resources and query strings
+    """
+    rng = random.Random(seed)
+
+    def t(s, p, o):
+        out.write('{} {} {} .\n'.format(s, p, o))
+
+    def labels(s, words=None):
+        for lang in LANGUAGES:
+            t(s, '<{}prefLabel>'.format(SKOS), literal(make_label(rng, lang, words), lang))
+
+    scheme = uri('00')
+    t(scheme, '<{}>'.format(RDF_TYPE), '<{}ConceptScheme>'.format(SKOS))
+    t(scheme, '<{}title>'.format(DCTERMS), literal('UNBIS Thesaurus', 'en'))
+    t(scheme, '<{}hasVersion>'.format(DCTERMS), literal('synthetic'))
+
+    n_domains, per_domain = structure(concepts)
+    domains = []
+    microthesauri = []
+    for d in range(1, n_domains + 1):
+        domain = '{:02d}'.format(d)
+        domains.append(domain)
+        s = uri(domain)
+        t(scheme, '<{}hasTopConcept>'.format(SKOS), s)
+        t(s, '<{}>'.format(RDF_TYPE), '<{}Domain>'.format(EU))
+        t(s, '<{}>'.format(RDF_TYPE), '<{}Concept>'.format(SKOS))
+        t(s, '<{}inScheme>'.format(SKOS), scheme)
+        t(s, '<{}topConceptOf>'.format(SKOS), scheme)
+        labels(s, 3)
+        for m in range(1, per_domain + 1):
+            mt = '{:02d}{:02d}00'.format(d, m)
+            microthesauri.append(mt)
+            ms = uri(mt)
+            t(s, '<{}hasTopConcept>'.format(SKOS), ms)
+            t(ms, '<{}>'.format(RDF_TYPE), '<{}MicroThesaurus>'.format(EU))
+            t(ms, '<{}>'.format(RDF_TYPE), '<{}Concept>'.format(SKOS))
+            t(ms, '<{}inScheme>'.format(SKOS), scheme)
+            labels(ms, 2)
+
+    # concepts hang under a microthesaurus or, deeper, under an earlier
+    # concept of the same microthesaurus
+    under = dict((mt, []) for mt in microthesauri)
+    anchors = []
+    for i in range(concepts):
+        anchor = str(1000001 + i)
+        anchors.append(anchor)
+        s = uri(anchor)
+        mt = rng.choice(microthesauri)
+        siblings = under[mt]
+        parent = mt if not siblings or rng.random() < 0.4 else rng.choice(siblings[-200:])
+        siblings.append(anchor)
+        t(s, '<{}>'.format(RDF_TYPE), '<{}Concept>'.format(SKOS))
+        t(s, '<{}inScheme>'.format(SKOS), scheme)
+        t(s, '<{}identifier>'.format(DCTERMS), literal(anchor))
+        t(s, '<{}identifier>'.format(DCTERMS), '<http://eurovoc.europa.eu/{}>'.format(100000 + i))
+        t(s, '<{}broader>'.format(SKOS), uri(parent))
+        t(uri(parent), '<{}narrower>'.format(SKOS), s)
+        labels(s)
+        if rng.random() < alt_ratio:
+            for lang in LANGUAGES:
+                for _ in range(rng.randint(1, 2)):
+                    t(s, '<{}altLabel>'.format(SKOS), literal(make_label(rng, lang), lang))
+        if rng.random() < note_ratio:
+            t(s, '<{}scopeNote>'.format(SKOS), literal(make_label(rng, 'en', 8) + '.', 'en'))
+        if i and rng.random() < related_ratio:
+            other = uri(rng.choice(anchors[:-1]))
+            t(s, '<{}related>'.format(SKOS), other)
+            t(other, '<{}related>'.format(SKOS), s)
+
+    sample = random.Random(seed + 1)
+    return {
+        'concepts': concepts,
+        'seed': seed,
+        'base_uri': BASE.rstrip('#'),
+        'domains': domains,
+        'microthesauri': microthesauri,
+        'sample_concepts': sample.sample(anchors, min(50, len(anchors))),
+        'sample_queries': dict(
+            (lang, [make_word(sample, lang)[:3 if lang != 'zh' else 1] for _ in range(20)])
+            for lang in LANGUAGES),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a synthetic thesaurus as N-Triples')
+    parser.add_argument("-c", "--concepts", dest="concepts", type=int, default=1000,
+                        help="number of concepts (1k to 500k)")
+    parser.add_argument("-s", "--seed", dest="seed", type=int, default=0)
+    parser.add_argument("-o", "--output", dest="output", default="-",
+                        help="output file, - for stdout")
+    parser.add_argument("-m", "--manifest", dest="manifest", default=None,
+                        help="also write the sample manifest as JSON")
+    args = parser.parse_args()
+
+    out = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8')
+    try:
+        manifest = generate(out, args.concepts, args.seed)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    if args.manifest:
+        with open(args.manifest, 'w') as f:
+            json.dump(manifest, f, indent=2)
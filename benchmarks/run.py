@@ -0,0 +1,281 @@
+"""
+Benchmarks for loading, indexing and serving a synthetic thesaurus.
+
+Everything runs locally: the generated thesaurus is loaded into a
+SQLite rdflib-sqlalchemy store by create_db.py, load_es.py indexes it
+into a stub that only serializes the bulk requests, and the app is
+driven through the Flask test client with the in-process search
+backend.  The scripts and the app read their overrides from the
+settings file named by THESAURUS_SETTINGS, which is written here.
+
+Timings go to a JSON file; compare two of them with benchmarks.compare.
+"""
+import argparse
+import ast
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.generate import generate, LANGUAGES
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+THESAURUS_DIR = os.path.join(ROOT, 'thesaurus')
+
+TERM_METHODS = ['preferred_label', 'language_labels', 'alt_labels', 'breadcrumbs',
+                'scope_notes', 'relationships', 'rdf_types']
+API_FORMATS = ['turtle', 'xml', 'n3', 'json-ld']
+
+
+def summarize(timings):
+    """
+    statistics in milliseconds of a list of timings in seconds
+    """
+    ms = sorted(t * 1000 for t in timings)
+    n = len(ms)
+    return {
+        'n': n,
+        'first': timings[0] * 1000,
+        'mean': sum(ms) / n,
+        'median': ms[n // 2] if n % 2 else (ms[n // 2 - 1] + ms[n // 2]) / 2,
+        'p95': ms[min(n - 1, int(n * 0.95))],
+        'min': ms[0],
+        'max': ms[-1],
+    }
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def repeat(fn, inputs, iterations):
+    """
+    time fn(input) for @iterations calls, cycling through @inputs
+    """
+    timings = []
+    for i in range(iterations):
+        elapsed, _ = timed(fn, inputs[i % len(inputs)])
+        timings.append(elapsed)
+    return summarize(timings)
+
+
+def commit():
+    try:
+        head = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+        dirty = subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                        cwd=ROOT, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return head + ('-dirty' if dirty else '')
+
+
+def write_settings(path, db_path, overrides):
+    settings = {
+        'DB_URI': 'sqlite:///{}'.format(db_path),
+        'SEARCH_BACKEND': 'memory',
+        'CACHE_BACKEND': None,
+        'DOCUMENTS_DIR': None,
+        # every autocomplete request reaches the search backend
+        'AUTOCOMPLETE_CACHE_SIZE': 0,
+        'AUTOCOMPLETE_WINDOW': 0,
+    }
+    settings.update(overrides)
+    with open(path, 'w') as f:
+        for key, value in sorted(settings.items()):
+            f.write('{} = {!r}\n'.format(key, value))
+
+
+def load_database(data_file, settings_file, fast):
+    """
+    seconds create_db.py takes to load @data_file
+    """
+    command = [sys.executable, 'create_db.py', '-f', data_file]
+    if fast:
+        command.append('-fast')
+    env = dict(os.environ, THESAURUS_SETTINGS=settings_file)
+    start = time.perf_counter()
+    subprocess.run(command, cwd=THESAURUS_DIR, env=env, check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+class StubHelpers:
+    """
+    stands in for elasticsearch.helpers in load_es: bulk() serializes
+    the actions as the client would and reports them all indexed
+    """
+    def __init__(self):
+        self.bytes = 0
+
+    def bulk(self, client, actions, chunk_size=500, **kwargs):
+        count = 0
+        for action in actions:
+            self.bytes += len(json.dumps(action["_source"], ensure_ascii=False))
+            count += 1
+        return count, []
+
+
+def bench_indexing(results, workers, bulk_size, slice_size):
+    if THESAURUS_DIR not in sys.path:
+        sys.path.insert(0, THESAURUS_DIR)
+    import load_es
+    stub = StubHelpers()
+    load_es.helpers = stub
+    load_es.open_connections()
+    elapsed, uris = timed(load_es.concept_uris)
+    results['load_es.concept_uris'] = summarize([elapsed])
+    with contextlib.redirect_stdout(io.StringIO()):
+        elapsed, indexed = timed(load_es.index_concepts, uris, 'benchmark', workers, bulk_size, slice_size)
+    results['load_es.index_concepts'] = summarize([elapsed])
+    results['load_es.index_concepts']['documents'] = indexed
+    results['load_es.index_concepts']['docs_per_sec'] = indexed / elapsed if elapsed else None
+    if workers == 1:
+        results['load_es.index_concepts']['bytes'] = stub.bytes
+
+
+def bench_app(results, manifest, iterations):
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    start = time.perf_counter()
+    from thesaurus import app
+    results['app.import'] = summarize([time.perf_counter() - start])
+
+    base_uri = manifest['base_uri']
+    concepts = ['{}#{}'.format(base_uri, anchor) for anchor in manifest['sample_concepts']]
+    pairs = [(uri, LANGUAGES[i % len(LANGUAGES)]) for i, uri in enumerate(concepts)]
+
+    for method in TERM_METHODS:
+        results['Term.' + method] = repeat(
+            lambda pair: getattr(app.Term(pair[0], lang=pair[1]), method)(), pairs, iterations)
+
+    def whole_term(pair):
+        term = app.Term(pair[0], lang=pair[1])
+        for method in TERM_METHODS:
+            getattr(term, method)()
+    results['Term.all'] = repeat(whole_term, pairs, iterations)
+
+    client = app.application.test_client()
+
+    def get(url):
+        response = client.get(url)
+        if response.status_code != 200:
+            raise RuntimeError('{} returned {}'.format(url, response.status_code))
+        return response
+
+    def post(args):
+        url, data = args
+        response = client.post(url, data=data)
+        if response.status_code != 200 or response.data.startswith(b'ERROR'):
+            raise RuntimeError('{} {} returned {}'.format(url, data, response.status_code))
+        return response
+
+    index_urls = ['/?aspect={}&lang={}&page={}'.format(aspect, lang, page)
+                  for aspect in ('Domain', 'MicroThesaurus')
+                  for lang in LANGUAGES for page in (1, 2)]
+    results['route.index'] = repeat(get, index_urls, iterations)
+
+    term_urls = ['/term?base_uri={}&uri_anchor={}&lang={}'.format(base_uri, uri.split('#')[1], lang)
+                 for uri, lang in pairs]
+    results['route.term'] = repeat(get, term_urls, iterations)
+
+    queries = [(q, lang) for lang in LANGUAGES for q in manifest['sample_queries'][lang]]
+    queries.sort(key=lambda item: item[0])
+    search_urls = ['/search?q={}&lang={}'.format(q, lang) for q, lang in queries]
+    results['route.search'] = repeat(get, search_urls, iterations)
+    autocomplete_urls = ['/autocomplete?q={}&lang={}'.format(q, lang) for q, lang in queries]
+    results['route.autocomplete'] = repeat(get, autocomplete_urls, iterations)
+
+    api_requests = [('/api', {'base_uri': base_uri, 'uri_anchor': uri.split('#')[1],
+                              'format': API_FORMATS[i % len(API_FORMATS)]})
+                    for i, uri in enumerate(concepts)]
+    # /api prints every requested format
+    with contextlib.redirect_stdout(io.StringIO()):
+        results['route.api'] = repeat(post, api_requests, iterations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark loading, indexing and serving a synthetic thesaurus')
+    parser.add_argument("-c", "--concepts", dest="concepts", type=int, default=1000,
+                        help="number of concepts to generate (1k to 500k)")
+    parser.add_argument("-s", "--seed", dest="seed", type=int, default=0)
+    parser.add_argument("-n", "--iterations", dest="iterations", type=int, default=50,
+                        help="calls per Term method and per route")
+    parser.add_argument("--load-mode", dest="load_mode", choices=['fast', 'regular', 'both'], default='fast',
+                        help="create_db.py load to benchmark; the app uses the last one")
+    parser.add_argument("--es-workers", dest="es_workers", type=int, default=1,
+                        help="load_es.py worker processes")
+    parser.add_argument("--set", dest="settings", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra app setting, VALUE a Python literal (e.g. SNAPSHOT=True)")
+    parser.add_argument("-d", "--workdir", dest="workdir", default=None,
+                        help="directory for the data and databases (default: a temporary one)")
+    parser.add_argument("-o", "--output", dest="output", default="benchmark.json",
+                        help="JSON file for the results")
+    args = parser.parse_args()
+
+    if not os.path.exists(os.path.join(THESAURUS_DIR, 'config.py')):
+        parser.error("thesaurus/config.py is missing; copy config.default.py to it first")
+
+    overrides = {}
+    for setting in args.settings:
+        key, _, value = setting.partition('=')
+        overrides[key] = ast.literal_eval(value)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='thesaurus-benchmark-')
+    os.makedirs(workdir, exist_ok=True)
+    data_file = os.path.join(workdir, 'thesaurus-{}.nt'.format(args.concepts))
+    results = {}
+
+    print("Generating {} concepts in {}".format(args.concepts, data_file))
+    with open(data_file, 'w', encoding='utf-8') as out:
+        elapsed, manifest = timed(generate, out, args.concepts, args.seed)
+    results['generate'] = summarize([elapsed])
+    with open(data_file, encoding='utf-8') as f:
+        triples = sum(1 for _ in f)
+
+    modes = ['regular', 'fast'] if args.load_mode == 'both' else [args.load_mode]
+    settings_file = os.path.join(workdir, 'settings.py')
+    for mode in modes:
+        db_path = os.path.join(workdir, 'thesaurus-{}.db'.format(mode))
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        write_settings(settings_file, db_path, overrides)
+        print("Loading with create_db.py ({})".format(mode))
+        results['create_db.{}'.format(mode)] = summarize([load_database(data_file, settings_file, mode == 'fast')])
+    os.environ['THESAURUS_SETTINGS'] = settings_file
+
+    print("Indexing with load_es.py")
+    bench_indexing(results, args.es_workers, 500, 2000)
+    print("Timing Term methods and routes")
+    bench_app(results, manifest, args.iterations)
+
+    report = {
+        'commit': commit(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'concepts': args.concepts,
+        'seed': args.seed,
+        'triples': triples,
+        'iterations': args.iterations,
+        'settings': overrides,
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+    for name in sorted(results):
+        stats = results[name]
+        print("{:32} median {:10.2f} ms  p95 {:10.2f} ms  (n={})".format(
+            name, stats['median'], stats['p95'], stats['n']))
+    print("Results written to {}".format(args.output))
+
+
+if __name__ == '__main__':
+    main()
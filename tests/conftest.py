@@ -0,0 +1,39 @@
+import os
+import sys
+import types
+import pytest
+from rdflib import Literal
+from rdflib_sqlalchemy.store import SQLAlchemy
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA = os.path.join(ROOT, 'tests', 'data')
+
+# the thesaurus scripts import their modules from the package directory,
+# the app is imported as the thesaurus package
+sys.path.insert(0, os.path.join(ROOT, 'thesaurus'))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(scope='session')
+def client(tmp_path_factory):
+    """
+    test client of the app serving the fixture thesaurus from SQLite,
+    with the in-process search backend and no response cache
+    """
+    from fast_load import load_file
+    workdir = tmp_path_factory.mktemp('app')
+    db_uri = 'sqlite:///{}'.format(workdir / 'thesaurus.db')
+    settings = workdir / 'settings.py'
+    settings.write_text("DB_URI = {!r}\nSEARCH_BACKEND = 'memory'\nCACHE_BACKEND = None\n"
+                        "DOCUMENTS_DIR = {!r}\n".format(db_uri, str(workdir / 'documents')))
+    os.environ['THESAURUS_SETTINGS'] = str(settings)
+    if 'thesaurus.config' not in sys.modules:
+        # config.py is written per deployment; start from the defaults
+        config = types.ModuleType('thesaurus.config')
+        with open(os.path.join(ROOT, 'thesaurus', 'config.default.py')) as source:
+            exec(source.read(), config.__dict__)
+        sys.modules['thesaurus.config'] = config
+    store = SQLAlchemy(identifier='thesaurus', configuration=Literal(db_uri))
+    load_file(store, os.path.join(DATA, 'thesaurus.ttl'), 'thesaurus', progress=lambda message: None)
+    from thesaurus.app import application
+    return application.test_client()
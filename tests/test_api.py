@@ -0,0 +1,76 @@
+import json
+import pytest
+
+DEMOCRACY = 'http://metadata.un.org/thesaurus#1000001'
+
+
+def test_concepts_by_uri_and_identifier(client):
+    response = client.post('/api/concepts', json={'uris': [DEMOCRACY], 'identifiers': ['1000001']})
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.data.decode('utf-8').splitlines()]
+    assert [(line['query'], line['uri'], line['found']) for line in lines] == [
+        (DEMOCRACY, DEMOCRACY, True), ('1000001', DEMOCRACY, True)]
+
+
+@pytest.mark.parametrize('body', [
+    {'uris': 'abc'}, {'identifiers': '1000001'}, {'identifiers': [1000001]}, [DEMOCRACY], {},
+])
+def test_concepts_rejects_bad_bodies_with_400(client, body):
+    response = client.post('/api/concepts', json=body)
+    assert response.status_code == 400
+    assert response.content_type == 'application/json'
+    assert json.loads(response.data.decode('utf-8'))['error']
+
+
+def test_reconcile_caps_the_limit(client):
+    queries = {'q0': {'query': 'democracy', 'limit': 10 ** 9}, 'q1': {'query': 'elections', 'limit': '1'}}
+    response = client.get('/reconcile', query_string={'queries': json.dumps(queries)})
+    assert response.status_code == 200
+    results = json.loads(response.data.decode('utf-8'))
+    assert results['q0']['result'][0]['id'] == DEMOCRACY
+    assert len(results['q1']['result']) == 1
+
+
+@pytest.mark.parametrize('params', [
+    {'queries': json.dumps({'q0': {'query': 'democracy', 'limit': 0}})},
+    {'queries': json.dumps({'q0': {'query': 'democracy', 'limit': 'x'}})},
+    {'queries': json.dumps({'q0': {'query': 'democracy', 'limit': True}})},
+    {'queries': json.dumps({'q0': 'democracy'})},
+    {'queries': '[]'},
+    {'queries': '{not json'},
+    {'query': '{"limit": 3}'},
+])
+def test_reconcile_rejects_bad_queries_with_400(client, params):
+    response = client.get('/reconcile', query_string=params)
+    assert response.status_code == 400
+    assert response.content_type == 'application/json'
+    assert json.loads(response.data.decode('utf-8'))['error']
+
+
+def test_term_page_resolves_relation_labels_in_one_batch(client, monkeypatch):
+    from thesaurus import app
+    batches = []
+    get_preferred_labels = app.get_preferred_labels
+
+    def counted(uris, lang):
+        batches.append(sorted(str(uri) for uri in uris))
+        return get_preferred_labels(uris, lang)
+    monkeypatch.setattr(app, 'get_preferred_labels', counted)
+    app.label_cache.clear()
+    response = client.get('/term', query_string={
+        'lang': 'en', 'base_uri': 'http://metadata.un.org/thesaurus', 'uri_anchor': '1000001'})
+    assert response.status_code == 200
+    assert 'Elections' in response.data.decode('utf-8')
+    assert 'POLITICAL AND LEGAL QUESTIONS' in response.data.decode('utf-8')
+    assert [batch for batch in batches if 'http://metadata.un.org/thesaurus#1000002' in batch] == [
+        ['http://metadata.un.org/thesaurus#01', 'http://metadata.un.org/thesaurus#1000002']]
+
+
+def test_relation_pager_keeps_the_other_relation_pages(client, monkeypatch):
+    from thesaurus import app
+    monkeypatch.setattr(app, 'PER_PAGE', 1)
+    response = client.get('/term', query_string={
+        'lang': 'en', 'base_uri': 'http://metadata.un.org/thesaurus', 'uri_anchor': '01',
+        'related_page': '3', 'narrower_page': '2'})
+    page = response.data.decode('utf-8')
+    assert '&related_page=3&narrower_page=1"' in page
@@ -0,0 +1,39 @@
+import base64
+import json
+import pytest
+from rdflib import Literal, URIRef
+from browse import BrowseIndex, encode_cursor
+
+
+def browse_list():
+    resources = [URIRef('http://metadata.un.org/thesaurus#{}'.format(n)) for n in range(5)]
+    labels = [(r, Literal(name, lang='en'))
+              for r, name in zip(resources, ['Elections', 'democracy', 'Árbitros', 'voting', 'Courts'])]
+    return BrowseIndex.build({'Concept': set(resources)}, labels).get('Concept', 'en')
+
+
+def raw_cursor(value):
+    return base64.urlsafe_b64encode(json.dumps(value).encode('utf-8')).decode('ascii')
+
+
+def test_cursor_continues_after_its_key():
+    browse = browse_list()
+    items, cursor = browse.page(1, 2)
+    assert [str(label) for resource, label in items] == ['Árbitros', 'Courts']
+    start, items, cursor = browse.page_after(cursor, 2)
+    assert start == 2
+    assert [str(label) for resource, label in items] == ['democracy', 'Elections']
+
+
+@pytest.mark.parametrize('cursor', [
+    'not base64!', raw_cursor('not json'), raw_cursor([1]), raw_cursor(5),
+    raw_cursor({'a': 'b'}), raw_cursor(['too', 'short']), raw_cursor([None, None, None]),
+])
+def test_invalid_cursor_starts_at_the_beginning(cursor):
+    assert browse_list().position(cursor) == 0
+
+
+def test_cursor_of_another_key_shape_starts_at_the_beginning():
+    browse = browse_list()
+    assert browse.position(encode_cursor(list(browse.keys[2]) + ['extra'])) == 0
+    assert browse.position(encode_cursor(browse.keys[2])) == 3
@@ -0,0 +1,41 @@
+import os
+from rdflib import ConjunctiveGraph, Graph, Literal, URIRef, RDF
+from rdflib.namespace import SKOS, XSD
+from rdflib_sqlalchemy.store import SQLAlchemy
+from delta import diff_store, apply_delta
+from fast_load import load_file
+
+IDENTIFIER = 'http://metadata.un.org/thesaurus'
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+UNBIS = 'http://metadata.un.org/thesaurus#'
+DCTERMS = 'http://purl.org/dc/terms/'
+
+
+def quiet(message):
+    pass
+
+
+def test_apply_delta_turns_the_store_into_the_new_release(tmp_path):
+    uri = Literal('sqlite:///{}'.format(tmp_path / 'thesaurus.db'))
+    store = SQLAlchemy(identifier=IDENTIFIER, configuration=uri)
+    path = os.path.join(DATA, 'thesaurus.ttl')
+    load_file(store, path, IDENTIFIER, progress=quiet)
+
+    release = Graph()
+    release.parse(path, format='turtle')
+    democracy, elections = URIRef(UNBIS + '1000001'), URIRef(UNBIS + '1000002')
+    # a literal with a language, one with a datatype, a plain one, a type and a link
+    release.remove((democracy, SKOS.prefLabel, Literal('Démocratie', lang='fr')))
+    release.add((democracy, SKOS.prefLabel, Literal('La démocratie', lang='fr')))
+    release.remove((URIRef(UNBIS + '00'), URIRef(DCTERMS + 'modified'), Literal('2018-05-01', datatype=XSD.date)))
+    release.remove((democracy, URIRef(DCTERMS + 'identifier'), Literal('1000001')))
+    release.remove((elections, RDF.type, SKOS.Concept))
+    release.remove((elections, SKOS.related, democracy))
+    release.add((URIRef(UNBIS + '1000003'), SKOS.prefLabel, Literal('Voting', lang='en')))
+
+    delta = diff_store(store, release, progress=quiet)
+    assert delta.summary()['triples_removed'] == 5
+    apply_delta(store, delta, Graph(store=store, identifier=URIRef(IDENTIFIER)))
+
+    assert set(ConjunctiveGraph(store).triples((None, None, None))) == set(release)
+    store.destroy(uri)
@@ -0,0 +1,67 @@
+import os
+import pytest
+from rdflib import ConjunctiveGraph, Graph, Literal, URIRef
+from rdflib_sqlalchemy.store import SQLAlchemy
+from fast_load import TABLES, load_file, compare_stores, table_contents
+
+IDENTIFIER = 'http://metadata.un.org/thesaurus'
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+
+def quiet(message):
+    pass
+
+
+@pytest.fixture
+def stores(tmp_path):
+    uri = Literal('sqlite:///{}'.format(tmp_path / 'thesaurus.db'))
+    slow = SQLAlchemy(identifier=IDENTIFIER + '_compare_slow', configuration=uri)
+    fast = SQLAlchemy(identifier=IDENTIFIER + '_compare_fast', configuration=uri)
+    yield slow, fast
+    slow.destroy(uri)
+    fast.destroy(uri)
+
+
+@pytest.mark.parametrize('filename', ['thesaurus.ttl', 'thesaurus.nt'])
+def test_fast_load_matches_regular_load(stores, filename):
+    slow, fast = stores
+    path = os.path.join(DATA, filename)
+    ConjunctiveGraph(slow).parse(source=path, format='text/turtle', publicID=IDENTIFIER)
+    # a small batch size writes the file in several batches
+    count = load_file(fast, path, IDENTIFIER, batch_size=7, progress=quiet)
+    assert count == len(slow)
+    assert compare_stores(slow, fast) == []
+
+
+def test_compare_stores_finds_differences(stores):
+    slow, fast = stores
+    path = os.path.join(DATA, 'thesaurus.ttl')
+    ConjunctiveGraph(slow).parse(source=path, format='text/turtle', publicID=IDENTIFIER)
+    load_file(fast, path, IDENTIFIER, progress=quiet)
+    extra = (URIRef(IDENTIFIER + '#1000002'), URIRef('http://www.w3.org/2004/02/skos/core#altLabel'),
+             Literal('Voting', lang='en'))
+    fast_context = Graph(store=fast, identifier=URIRef(IDENTIFIER))
+    fast.add(extra, fast_context)
+    fast.commit()
+    assert compare_stores(slow, fast) == ['literal_statements']
+
+
+def test_load_file_needs_an_empty_store(stores):
+    slow, fast = stores
+    path = os.path.join(DATA, 'thesaurus.ttl')
+    load_file(fast, path, IDENTIFIER, progress=quiet)
+    with pytest.raises(ValueError):
+        load_file(fast, path, IDENTIFIER, progress=quiet)
+
+
+def test_fast_load_drops_repeated_triples(stores, tmp_path):
+    slow, fast = stores
+    path = tmp_path / 'repeated.nt'
+    with open(os.path.join(DATA, 'thesaurus.nt')) as source:
+        lines = [line for line in source if line.strip()]
+    # the first statement again, after all the others
+    path.write_text(''.join(lines + lines[:1]))
+    count = load_file(fast, str(path), IDENTIFIER, batch_size=7, progress=quiet)
+    assert count == len(lines)
+    contents = table_contents(fast)
+    assert sum(len(contents[name]) for name in TABLES) == len(lines)
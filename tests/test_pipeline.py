@@ -0,0 +1,48 @@
+import os
+from rdflib import Graph, Literal, URIRef
+from rdflib_sqlalchemy.store import SQLAlchemy
+from fast_load import TABLES, bulk_load, load_file, table_contents
+from pipeline import Pipeline, StreamSink
+from snapshot import Snapshot
+
+IDENTIFIER = 'http://metadata.un.org/thesaurus'
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+
+def quiet(message):
+    pass
+
+
+def snapshot_stage(triples):
+    snapshot = Snapshot()
+    for triple in triples:
+        snapshot.add(triple)
+    snapshot.freeze()
+    return snapshot
+
+
+def test_stages_cope_with_repeats_beyond_the_sink_window(tmp_path):
+    with open(os.path.join(DATA, 'thesaurus.nt')) as source:
+        lines = [line for line in source if line.strip()]
+    path = tmp_path / 'repeated.nt'
+    # every statement twice, the repeats far beyond a window of two triples
+    path.write_text(''.join(lines + lines))
+
+    uri = Literal('sqlite:///{}'.format(tmp_path / 'thesaurus.db'))
+    streamed = SQLAlchemy(identifier=IDENTIFIER + '_streamed', configuration=uri)
+    context = Graph(store=streamed, identifier=URIRef(IDENTIFIER))
+    pipeline = Pipeline(batch_size=5, progress=quiet)
+    pipeline.add_stage('store', lambda triples: bulk_load(
+        streamed, triples, context, batch_size=7, progress=quiet, repeats=True))
+    pipeline.add_stage('snapshot', snapshot_stage)
+
+    def produce(emit):
+        StreamSink(emit, window=2).parse(source=str(path), format='text/turtle', publicID=IDENTIFIER)
+    results = pipeline.run(produce)
+
+    assert results['store'] == len(lines)
+    assert len(results['snapshot']) == len(lines)
+    fast = SQLAlchemy(identifier=IDENTIFIER + '_fast', configuration=uri)
+    load_file(fast, str(path), IDENTIFIER, progress=quiet)
+    a, b = table_contents(streamed), table_contents(fast)
+    assert all(a[name] == b[name] for name in TABLES)
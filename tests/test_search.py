@@ -0,0 +1,27 @@
+from rdflib import Literal, URIRef, RDF
+from rdflib.namespace import SKOS
+from search import MemoryBackend, build_documents
+
+KINSHASA = URIRef('http://metadata.un.org/thesaurus#1004848')
+ELECTIONS = URIRef('http://metadata.un.org/thesaurus#1000002')
+GEOGRAPHIC_TERM = URIRef('https://metadata.un.org/schema/GeographicTerm')
+
+
+def documents():
+    uris = [KINSHASA, ELECTIONS]
+    pref_labels = [(KINSHASA, Literal('Kinshasa', lang='en')), (ELECTIONS, Literal('Kinship elections', lang='en'))]
+    rdf_types = [(KINSHASA, SKOS.Concept), (KINSHASA, GEOGRAPHIC_TERM), (ELECTIONS, SKOS.Concept)]
+    return build_documents(uris, pref_labels, [], rdf_types)
+
+
+def test_suggest_contexts_use_the_local_name_of_every_type():
+    kinshasa = documents()[0]
+    assert kinshasa['suggest_en'][0]['contexts'] == {'rdf_type': ['Concept', 'GeographicTerm']}
+
+
+def test_suggestions_filtered_by_a_slash_namespace_type():
+    backend = MemoryBackend(documents())
+    options = backend.suggest('kin', 'en', 10, 'GeographicTerm')['suggest']['labels'][0]['options']
+    assert [option['_source']['uri'] for option in options] == [str(KINSHASA)]
+    options = backend.suggest('kin', 'en', 10, 'Concept')['suggest']['labels'][0]['options']
+    assert len(options) == 2
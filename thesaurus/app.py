@@ -1,14 +1,33 @@
 import io
+import hashlib
 import json
+import os
 import re
+import threading
+import time
+from functools import wraps
 from math import ceil
-from rdflib import plugin, ConjunctiveGraph, Graph, Literal, Namespace, URIRef, RDF
+from collections import OrderedDict
+from rdflib import plugin, ConjunctiveGraph, Graph, Literal, Namespace, URIRef, RDF, RDFS
 from rdflib.store import Store
 from rdflib.namespace import SKOS
 from rdflib_sqlalchemy import registerplugins
+import click
 from flask import Flask
-from flask import render_template, abort, request, Response, send_file, redirect
+from flask import render_template, abort, request, Response, send_file, redirect, stream_with_context
 from .config import DevelopmentConfig
+from .snapshot import Snapshot
+from .mmap_snapshot import MappedSnapshot
+from .cache import LRUCache, TTLCache, make_cache, cache_stats
+from .browse import BrowseIndex
+from .dataset import current_state, latest_versions
+from .export import EXPORT_FORMATS, stream_triples, encode_lines, byte_range, stream_length
+from .documents import DocumentStore, FORMATS, store_path, write_documents
+from .search import ElasticsearchBackend, MemoryBackend, CoalescingSearch, Suggestions, tokenize, \
+    build_documents as build_search_documents, SUGGESTION
+from .hierarchy import Closure, ClosureTable, has_closure
+from .metrics import Metrics
+from .queries import QueryRegistry
 from elasticsearch import Elasticsearch
 from flask_babel import Babel
 
@@ -16,6 +35,8 @@ registerplugins()
 
 application = Flask(__name__)
 application.config.from_object(DevelopmentConfig)
+# optional file of overrides, e.g. to point the scripts at another database
+application.config.from_envvar('THESAURUS_SETTINGS', silent=True)
 LANGUAGES = application.config.get('LANGUAGES', None)
 babel = Babel(application)
 
@@ -27,17 +48,136 @@ graph = ConjunctiveGraph(store)
 graph.open(db_uri, create=False)
 graph.bind('skos', SKOS)
 
+# per-request timing of store calls, SQL statements, searches and
+# rendering; nothing is wrapped unless METRICS is set
+metrics = Metrics(application.config.get('METRICS', False))
+metrics.instrument_methods('store', graph, ['query', 'triples', 'triples_choices', 'objects',
+                                            'subjects', 'value', 'preferredLabel'])
+metrics.instrument_engine('sql', store.engine)
+render_template = metrics.instrument('render', render_template)
+
 PER_PAGE = application.config.get("PER_PAGE", 20)
 
+# version of the loaded data, as published by create_db.py and load_es.py;
+# re-read at most every VERSION_CHECK_INTERVAL seconds
+dataset_version, dataset_published = current_state(store.engine)
+version_checked = time.time()
+# held by the request thread that reloads the data for a new version
+reload_lock = threading.Lock()
+VERSION_CHECK_INTERVAL = application.config.get('VERSION_CHECK_INTERVAL', 30)
+# Cache-Control max-age of the conditional views, by view name
+HTTP_MAX_AGE = application.config.get('HTTP_MAX_AGE', 300)
+HTTP_MAX_AGES = application.config.get('HTTP_MAX_AGES', {})
+
+browse_index = None
+
+label_cache = LRUCache(application.config.get('LABEL_CACHE_SIZE', 50000))
+LABEL_BATCH_SIZE = application.config.get('LABEL_BATCH_SIZE', 500)
+# most concepts one /api/concepts request may ask for
+BATCH_LOOKUP_LIMIT = application.config.get('BATCH_LOOKUP_LIMIT', 5000)
+# most queries one /reconcile request may send
+RECONCILE_LIMIT = application.config.get('RECONCILE_LIMIT', 500)
+# most candidates returned for one reconciliation query
+RECONCILE_MAX_CANDIDATES = application.config.get('RECONCILE_MAX_CANDIDATES', 100)
+
+# rendered pages and API payloads, keyed on the dataset version
+response_cache = make_cache(
+    application.config.get('CACHE_BACKEND', 'memory'),
+    max_size=application.config.get('RESPONSE_CACHE_SIZE', 2000),
+    redis_url=application.config.get('CACHE_REDIS_URL', None),
+    prefix='{}:response'.format(application.config.get('IDENTIFIER', 'thesaurus')),
+    ttl=application.config.get('CACHE_TTL', 86400))
+
+# pre-serialized /api documents, see build_documents()
+DOCUMENTS_DIR = application.config.get('DOCUMENTS_DIR', None)
+# memory-mapped snapshots written by create_db.py
+SNAPSHOT_DIR = application.config.get('SNAPSHOT_DIR', None)
+
+# byte lengths of exports, needed to answer range requests
+export_lengths = LRUCache(256)
+
+snapshot = None
+hierarchy = None
+documents = None
+bound_namespaces = {}
+search_backend = None
+autocomplete_search = None
+
+
+def load_data(version):
+    """
+    build whatever is held in memory for the data of @version, without
+    touching what is being served; (snapshot, hierarchy, documents,
+    search_backend, autocomplete_search, bound_namespaces, browse_index)
+    """
+    graph_version = latest_versions(store.engine).get('graph')
+    graph_version = graph_version and graph_version[0]
+
+    # the views read from a snapshot when there is one and the SQL store
+    # is not queried per request: the file create_db.py wrote for this
+    # version, mapped and shared by all worker processes, or else the
+    # whole graph loaded into this process's memory
+    mapped = MappedSnapshot.open(SNAPSHOT_DIR, graph_version)
+    if mapped is not None:
+        new_snapshot = mapped
+        application.logger.info("Mapped snapshot of {} triples from {}".format(len(new_snapshot), mapped.path))
+    elif application.config.get('SNAPSHOT', False):
+        new_snapshot = Snapshot.from_graph(graph)
+        application.logger.info("Loaded snapshot of {} triples".format(len(new_snapshot)))
+    else:
+        new_snapshot = None
+
+    if new_snapshot is not None:
+        namespaces = dict(new_snapshot.namespaces)
+    else:
+        namespaces = dict((prefix, str(ns)) for prefix, ns in graph.namespaces())
+
+    # ancestors/descendants from the closure table built by create_db.py,
+    # held in memory alongside the snapshot
+    if mapped is not None and mapped.has_closure:
+        closure = mapped.closure()
+    elif has_closure(store.engine):
+        closure = Closure.load(store.engine) if new_snapshot is not None else ClosureTable(store.engine)
+    else:
+        closure = None
+        application.logger.warning("No hierarchy closure table; run create_db.py -hierarchy")
+
+    document_store = DocumentStore.open(DOCUMENTS_DIR, graph_version)
+
+    if SEARCH_BACKEND == 'memory':
+        backend = MemoryBackend(search_documents(new_snapshot))
+        application.logger.info("Built in-process search over {} concepts".format(len(backend)))
+    else:
+        backend = ElasticsearchBackend(es, index_name)
+    # type-ahead completion suggestions are cached briefly and coalesced
+    # into _msearch batches
+    suggestions = CoalescingSearch(
+        Suggestions(backend),
+        TTLCache(application.config.get('AUTOCOMPLETE_CACHE_SIZE', 5000),
+                 application.config.get('AUTOCOMPLETE_CACHE_TTL', 300)),
+        window=application.config.get('AUTOCOMPLETE_WINDOW', 0.005))
+    browse = build_browse_index(new_snapshot, version)
+    return new_snapshot, closure, document_store, backend, suggestions, namespaces, browse
+
+
 # setup Elasticsearch connection
 elasticsearch_uri = application.config.get('ELASTICSEARCH_URI', None)
 index_name = application.config.get('INDEX_NAME', None)
 es = Elasticsearch(elasticsearch_uri)
+SEARCH_BACKEND = application.config.get('SEARCH_BACKEND', 'elasticsearch')
 
 EU = Namespace('http://eurovoc.europa.eu/schema#')
 DCTERMS = Namespace("http://purl.org/dc/terms#")
 UNBIST = Namespace('http://unontologies.s3-website-us-east-1.amazonaws.com/unbist#')
 UNVOC = Namespace('https://metadata.un.org/schema/')
+# used by Term when the store binds no namespace to a prefix
+DEFAULT_NAMESPACES = {
+    'skos': str(SKOS),
+    'dcterms': 'http://purl.org/dc/terms/',
+}
+# relation types listed on the term page, in display order
+RELATIONS = [SKOS.broader, SKOS.related, SKOS.narrower, SKOS.hasTopConcept]
+
 ROUTABLES = {
     'Concept': SKOS.Concept,
     'ConceptScheme': SKOS.ConceptScheme,
@@ -47,6 +187,17 @@ ROUTABLES = {
     'RootContainer': UNVOC.RootContainer
 }
 
+# SPARQL run by the app, compiled once and run with bound parameters
+queries = QueryRegistry({'skos': SKOS, 'rdf': RDF, 'eu': EU})
+queries.register('breadcrumbs', """
+    select ?domain ?microthesaurus where
+    {
+        {  ?domain skos:hasTopConcept ?microthesaurus . ?microthesaurus skos:narrower ?concept . }
+    union
+        { ?domain rdf:type eu:Domain . ?domain skos:hasTopConcept ?concept . }
+    }
+    """)
+
 
 class Pagination:
     def __init__(self, page, per_page, total_count):
@@ -98,6 +249,8 @@ class Term:
         """
         self.concept = concept
         self.lang = lang
+        self._by_predicate = None
+        self._labels = {}
 
     # def _graph_query(self, property_name):
     #     prop_a = []
@@ -132,74 +285,149 @@ class Term:
     def preferred_language(self):
         return self.lang
 
+    def _description(self):
+        """
+        every (predicate, object) with the concept as subject, grouped
+        by predicate; fetched with one query the first time it is needed
+        """
+        if self._by_predicate is None:
+            subject = URIRef(self.concept)
+            if snapshot is not None:
+                pairs = snapshot.predicate_objects(subject)
+            else:
+                pairs = ((p, o) for s, p, o in graph.triples((subject, None, None)))
+            by_predicate = OrderedDict()
+            for p, o in pairs:
+                by_predicate.setdefault(p, []).append(o)
+            self._by_predicate = by_predicate
+        return self._by_predicate
+
+    def _objects(self, predicate, lang=None):
+        """
+        objects of @predicate, only those in @lang if given
+        """
+        objects = self._description().get(predicate, [])
+        if lang:
+            return [o for o in objects if getattr(o, 'language', None) == lang]
+        return list(objects)
+
+    def _prefixed(self, prefix, name):
+        """
+        objects of prefix:name, resolving @prefix against the namespaces
+        bound in the store, as the SPARQL queries used to
+        """
+        predicate = URIRef(bound_namespaces.get(prefix, DEFAULT_NAMESPACES[prefix]) + name)
+        return [(o,) for o in self._objects(predicate)]
+
+    def _label_list(self, lang=None):
+        """
+        same contract as rdflib.Graph.preferredLabel: a list of
+        (labelProperty, label) tuples, optionally filtered on language
+        """
+        for label_prop in (SKOS.prefLabel, RDFS.label):
+            labels = self._objects(label_prop)
+            if lang is not None:
+                if lang == '':
+                    labels = [l for l in labels if not l.language]
+                else:
+                    labels = [l for l in labels if l.language == lang]
+            if labels:
+                return [(label_prop, l) for l in labels]
+        return []
+
+    def _labels_for(self, resources):
+        """
+        preferred labels of neighbouring resources, fetched in one batch
+        for all the resources not labelled yet
+        """
+        missing = [r for r in resources if URIRef(r) not in self._labels]
+        if missing:
+            self._labels.update(get_preferred_labels(missing, self.lang))
+        return self._labels
+
     def preferred_label(self):
-        return get_preferred_label(self.concept, self.lang)
+        labels = self._label_list(self.lang or 'en')
+        return labels[0][1] if labels else URIRef(self.concept)
 
     def preferred_labels(self):
-        return graph.preferredLabel(self.concept)
+        return self._label_list()
 
     def notes(self):
-        notes = []
-        for rel in graph.objects(subject=URIRef(self.concept), predicate=SKOS.note):
-            notes.append(rel)
-        return notes
+        return self._objects(SKOS.note)
 
     def scheme(self):
-        scheme = []
-        q = "select ?scheme where { <%s> skos:inScheme ?scheme .}" % self.concept
-        res = graph.query(q)
-        for r in res:
-            scheme.append(r)
-        return scheme
+        return self._prefixed('skos', 'inScheme')
 
     def identifier(self):
-        ident = []
-        q = "select ?id where { <%s> dcterms:identifier ?id .}" % self.concept
-        res = graph.query(q)
-        for r in res:
-            ident.append(r)
-        return ident
+        return self._prefixed('dcterms', 'identifier')
 
     def top_concept_of(self):
-        c = []
-        q = "select ?id where { <%s> skos:topConceptOf ?id . }" % self.concept
-        res = graph.query(q)
-        for r in res:
-            c.append(r)
-        return c
+        return self._prefixed('skos', 'topConceptOf')
 
     def title(self):
-        title = []
-        q = "select ?id where { <%s> dcterms:title ?id .}" % self.concept
-        res = graph.query(q)
-        for r in res:
-            title.append(r)
-        return title
+        return self._prefixed('dcterms', 'title')
 
     def breadcrumbs(self):
         """
         get breadcumbs when a user clicks on a concept
         """
+        if hierarchy is not None:
+            return self._breadcrumbs(self._closure_breadcrumbs())
+        if snapshot is not None:
+            return self._breadcrumbs(list(self._snapshot_breadcrumbs()))
+        rows = [(res.domain, res.microthesaurus)
+                for res in queries.run(graph, 'breadcrumbs', concept=URIRef(self.concept))]
+        return self._breadcrumbs(rows)
+
+    def _closure_breadcrumbs(self):
+        """
+        (domain, microthesaurus) rows from the closure table: every
+        microthesaurus above the concept with the domains above it,
+        nearest first, then domains reached without a microthesaurus
+        """
+        ancestors = hierarchy.ancestors([self.concept])[str(self.concept)]
+        types = resource_types([a for a, depth in ancestors])
+        domains = [a for a, depth in ancestors if EU.Domain in types.get(a, ())]
+        micros = [a for a, depth in ancestors if EU.MicroThesaurus in types.get(a, ())]
+        above = hierarchy.ancestors(micros) if micros else {}
+        rows = []
+        covered = set()
+        for microthesaurus in micros:
+            for domain, depth in above[str(microthesaurus)]:
+                if domain in domains:
+                    rows.append((domain, microthesaurus))
+                    covered.add(domain)
+        rows.extend((domain, None) for domain in domains if domain not in covered)
+        return rows
+
+    def _snapshot_breadcrumbs(self):
+        """
+        (domain, microthesaurus) rows matching the breadcrumbs query
+        """
+        concept = URIRef(self.concept)
+        for microthesaurus in snapshot.subjects(SKOS.narrower, concept):
+            for domain in snapshot.subjects(SKOS.hasTopConcept, microthesaurus):
+                yield domain, microthesaurus
+        for domain in snapshot.subjects(SKOS.hasTopConcept, concept):
+            if EU.Domain in snapshot.objects(domain, RDF.type):
+                yield domain, None
+
+    def _breadcrumbs(self, rows):
+        """
+        label (domain, microthesaurus) rows in one batch
+        """
         breadcrumbs = []
-        breadcrumbs_q = """
-            prefix skos: <http://www.w3.org/2004/02/skos/core#>
-            select ?domain ?microthesaurus where
-            {
-                {  ?domain skos:hasTopConcept ?microthesaurus . ?microthesaurus skos:narrower <%s> . }
-            union
-                { ?domain rdf:type eu:Domain . ?domain skos:hasTopConcept <%s> . }
-            }
-            """ % (self.concept, self.concept)
-        for res in graph.query(breadcrumbs_q):
+        labels = self._labels_for([r for row in rows for r in row if r])
+        for domain, microthesaurus in rows:
             bc = {}
             bc.update(
                 {'domain':
-                    {'uri': res.domain, 'pref_label': get_preferred_label(res.domain, self.lang)}})
-            if res.microthesaurus:
+                    {'uri': domain, 'pref_label': labels[URIRef(domain)]}})
+            if microthesaurus:
                 bc.update(
                     {'microthesaurus':
-                        {'uri': res.microthesaurus,
-                        'pref_label': get_preferred_label(res.microthesaurus, self.lang)}})
+                        {'uri': microthesaurus,
+                        'pref_label': labels[URIRef(microthesaurus)]}})
             breadcrumbs.append(bc)
         return breadcrumbs
 
@@ -208,15 +436,7 @@ class Term:
         display scope notes (if avalable)
         for a concept
         """
-        scope_notes = []
-        sns = graph.objects(subject=URIRef(self.concept), predicate=SKOS.scopeNote)
-        for s in sns:
-            if self.lang:
-                if s.language == self.lang:
-                    scope_notes.append(s)
-            else:
-                scope_notes.append(s)
-        return scope_notes
+        return self._objects(SKOS.scopeNote, self.lang)
 
     def alt_labels(self):
         """
@@ -224,15 +444,7 @@ class Term:
         for this concept in the given language
         display them
         """
-        alt_labels = []
-        als = graph.objects(subject=URIRef(self.concept), predicate=SKOS.altLabel)
-        for a in als:
-            if self.lang:
-                if a.language == self.lang:
-                    alt_labels.append(a)
-            else:
-                alt_labels.append(a)
-        return alt_labels
+        return self._objects(SKOS.altLabel, self.lang)
 
     def relationships(self):
         """
@@ -240,32 +452,45 @@ class Term:
         broader and narrower terms
         """
         relationships = []
-        for c in [SKOS.broader, SKOS.related, SKOS.narrower, SKOS.hasTopConcept]:
+        labels = self._labels_for([rel for c in RELATIONS for rel in self._objects(c)])
+        for c in RELATIONS:
             this_results = []
-            for rel in graph.objects(subject=URIRef(self.concept), predicate=c):
-                rel_label = get_preferred_label(rel, self.lang)
-                this_results.append({'type': c.split('#')[1], 'uri': rel, 'pref_label': rel_label})
+            for rel in self._objects(c):
+                this_results.append({'type': c.split('#')[1], 'uri': rel, 'pref_label': labels[rel]})
             sorted_results = sorted(this_results, key=lambda tup: tup['pref_label'])
             for sr in sorted_results:
                 relationships.append(sr)
         return relationships
 
+    def relationship_counts(self):
+        """
+        number of neighbours of each relation type, no label is resolved
+        """
+        return OrderedDict((p.split('#')[1], len(self._objects(p))) for p in RELATIONS)
+
+    def relationship_pages(self, pages, per_page):
+        """
+        the neighbours on one page of each relation type, @pages mapping
+        predicates to page numbers, in the collation order of the browse
+        lists; the labels of all of them are resolved in one batch
+        """
+        ranks = get_browse_index().ranks(self.lang or 'en')
+        unranked = len(ranks)
+        shown = []
+        for predicate, page in pages.items():
+            neighbours = sorted(self._objects(predicate), key=lambda r: (ranks.get(r, unranked), str(r)))
+            start = (int(page) - 1) * int(per_page)
+            shown.extend((predicate, rel) for rel in neighbours[start:start + int(per_page)])
+        labels = self._labels_for([rel for predicate, rel in shown])
+        return [{'type': predicate.split('#')[1], 'uri': rel, 'pref_label': labels[rel]} for predicate, rel in shown]
+
     def matches(self):
         """
         punt for now
         """
-        matches = []
-        matches_q = """
-            prefix skos: <http://www.w3.org/2004/02/skos/core#>
-            select ?exactmatch where
-            {
-            <%s> dcterms:identifier ?identifier . ?identifier skos:exactMatch ?exactMatch
-            }""" % self.concept
-        # matches_q = """select ?evTerm where { ?evTerm skos:exactMatch ?id . ?unbisTerm dcterms:identifier ?id }"""
-
-        for m in graph.query(matches_q):
-            matches.append({'uri': m})
-        return matches
+        # the SPARQL query this used to run projected ?exactmatch, which its
+        # pattern never binds, so it never yielded a row
+        return []
 
     def rdf_types(self):
         """
@@ -273,7 +498,7 @@ class Term:
         1 or more of Concept, MicroThesaurus, etc
         """
         rdf_types = []
-        for t in graph.objects(subject=URIRef(self.concept), predicate=RDF.type):
+        for t in self._objects(RDF.type):
             rdf_types.append({'short_name': t.split('#')[1], 'uri': t})
         return rdf_types
 
@@ -283,48 +508,170 @@ class Term:
         """
         labels = []
         for lang in ['ar', 'zh', 'en', 'fr', 'ru', 'es']:
-            labels.append(graph.preferredLabel(URIRef(self.concept), lang=lang))
+            labels.append(self._label_list(lang))
         return labels
 
     def version(self):
-        vers_a = []
-        for v in graph.objects(subject=URIRef(self.concept), predicate=DCTERMS.hasVersion):
-            vers_a.append(v)
-        return vers_a
+        return self._objects(DCTERMS.hasVersion)
 
     def created(self):
-        c_a = []
-        for c in graph.objects(subject=URIRef(self.concept), predicate=DCTERMS.created):
-            c_a.append(c)
-        return c_a
+        return self._objects(DCTERMS.created)
 
     def description(self, lang):
-        d_a = []
-        for d in graph.objects(subject=URIRef(self.concept), predicate=DCTERMS.description):
-            if d.language == lang:
-                d_a.append(d)
-        return d_a
+        return [d for d in self._objects(DCTERMS.description) if d.language == lang]
 
     def has_part(self):
         p_a = []
-        for l in graph.objects(subject=URIRef(self.concept), predicate=DCTERMS.hasPart):
-            label = get_preferred_label(l, self.lang)
-            p_a.append({"link": l, "label": label})
+        parts = self._objects(DCTERMS.hasPart)
+        labels = self._labels_for(parts)
+        for l in parts:
+            p_a.append({"link": l, "label": labels[URIRef(l)]})
         return p_a
 
 
+# JSON APIs, whose clients get a 400 with a JSON body instead of the
+# plain text error page
+JSON_ERROR_ENDPOINTS = {'concepts', 'reconcile'}
+
+
 @application.errorhandler(400)
 def custom400(error):
+    if request.endpoint in JSON_ERROR_ENDPOINTS:
+        return Response(json.dumps({"error": error.description['message']}),
+                        status=400, content_type='application/json')
     response = 'ERROR: ' + error.description['message']
     return response
 
 
+@application.before_request
+def start_timing():
+    if metrics.enabled:
+        metrics.start()
+
+
+@application.after_request
+def record_timing(response):
+    """
+    report where the request's time went in a Server-Timing header and
+    add it to the totals of its route
+    """
+    if metrics.enabled:
+        recorded = metrics.stop()
+        if recorded is not None:
+            elapsed, timings = recorded
+            response.headers['Server-Timing'] = metrics.server_timing(elapsed, timings)
+            metrics.observe(request.url_rule.rule if request.url_rule else 'unmatched', elapsed, timings)
+    return response
+
+
+@application.before_request
+def check_dataset_version():
+    """
+    pick up a version published by a reload; everything cached for
+    the old version is dropped as a group
+    """
+    global dataset_version, dataset_published, version_checked
+    global snapshot, hierarchy, documents, search_backend, autocomplete_search, bound_namespaces, browse_index
+    if time.time() - version_checked < VERSION_CHECK_INTERVAL:
+        return
+    # one thread checks and reloads while the others go on serving the
+    # data that is loaded
+    if not reload_lock.acquire(blocking=False):
+        return
+    try:
+        version_checked = time.time()
+        version, published = current_state(store.engine)
+        if version == dataset_version:
+            return
+        application.logger.info("Dataset version changed from {} to {}".format(dataset_version, version))
+        state = load_data(version) + (version, published)
+        (snapshot, hierarchy, documents, search_backend, autocomplete_search, bound_namespaces, browse_index,
+         dataset_version, dataset_published) = state
+        label_cache.clear()
+        if response_cache is not None:
+            response_cache.clear()
+    finally:
+        reload_lock.release()
+
+
+def cached_view(view):
+    """
+    serve the response of @view from the response cache, keyed on route,
+    request parameters (language, page, ...), interface locale and
+    dataset version
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if response_cache is None:
+            return view(*args, **kwargs)
+        key = (request.path, request.method, tuple(sorted(request.values.items(multi=True))),
+               get_locale(), 'gzip' in request.accept_encodings, dataset_version)
+        cached = response_cache.get(key)
+        if cached is not None:
+            body, status, headers = cached
+            response = Response(body, status=status, headers=headers)
+            response.headers['X-Cache'] = 'HIT'
+            return response
+        response = application.make_response(view(*args, **kwargs))
+        if response.status_code == 200:
+            response.direct_passthrough = False
+            response_cache.set(key, (response.get_data(), response.status_code, list(response.headers)))
+        response.headers['X-Cache'] = 'MISS'
+        return response
+    return wrapper
+
+
+def request_etag():
+    """
+    strong validator of the response to this request: a hash of the
+    dataset version and everything the cached views key their responses on
+    """
+    key = repr((dataset_version, request.path, tuple(sorted(request.values.items(multi=True))),
+                get_locale(), 'gzip' in request.accept_encodings))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def conditional_view(view):
+    """
+    give the GET responses of @view an ETag and Last-Modified from the
+    dataset version and the Cache-Control of its HTTP_MAX_AGES entry,
+    and answer a matching If-None-Match (or If-Modified-Since) with a
+    304 before the view runs
+    """
+    max_age = HTTP_MAX_AGES.get(view.__name__, HTTP_MAX_AGE)
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method not in ('GET', 'HEAD') or dataset_version is None:
+            return view(*args, **kwargs)
+        etag = request_etag()
+        last_modified = dataset_published.replace(microsecond=0)
+        if request.if_none_match:
+            not_modified = request.if_none_match.contains_weak(etag)
+        else:
+            not_modified = request.if_modified_since is not None and last_modified <= request.if_modified_since
+        if not_modified:
+            response = Response(status=304)
+        else:
+            response = application.make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        response.headers['Cache-Control'] = 'public, max-age={}'.format(max_age) if max_age else 'no-cache'
+        response.headers['Vary'] = 'Accept-Language, Accept-Encoding'
+        return response
+    return wrapper
+
+
 @babel.localeselector
 def get_locale():
     return request.accept_languages.best_match(LANGUAGES.keys())
 
 
 @application.route('/')
+@conditional_view
+@cached_view
 def index():
     page = request.args.get('page')
     if not page:
@@ -334,31 +681,25 @@ def index():
         preferred_language = 'en'
     aspect = request.args.get('aspect', 'Domain')
 
-    aspect_uri = ''
+    browse_aspect = aspect
     try:
-        aspect_uri = ROUTABLES[aspect]
+        ROUTABLES[aspect]
     except KeyError as e:
         application.logger.error("Caught exception : {}".format(e))
-        aspect_uri = ROUTABLES['MicroThesaurus']
+        browse_aspect = 'MicroThesaurus'
+
+    # pages come from the precomputed browse list, either by number
+    # or, for deep paging, by the cursor of the previous page
+    browse_list = get_browse_index().get(browse_aspect, preferred_language)
+    after = request.args.get('after')
+    if after:
+        start, rows, next_cursor = browse_list.page_after(after, PER_PAGE)
+        page = start // int(PER_PAGE) + 1
+    else:
+        rows, next_cursor = browse_list.page(page, PER_PAGE)
 
     results = []
-    count_q = """select (count(distinct ?subject) as ?count)
-                where { ?subject a <%s> .}
-    """ % str(aspect_uri)
-    count = 0
-    res = graph.query(count_q)
-    for r in res:
-        count = int(r[0])
-
-    q = """ select ?subject ?prefLabel
-        where { ?subject a <%s> .
-        ?subject skos:prefLabel ?prefLabel .
-        FILTER (lang(?prefLabel) = '%s') . }
-        order by ?prefLabel
-        LIMIT %s OFFSET %s""" % (
-            str(aspect_uri), preferred_language, int(PER_PAGE), (int(page) - 1) * int(PER_PAGE))
-
-    for res in graph.query(q):
+    for res in rows:
         res_label = res[1]
         base_uri = ''
         uri_anchor = ''
@@ -372,17 +713,21 @@ def index():
             'uri_anchor': uri_anchor,
             'pref_label': res_label})
 
-    pagination = Pagination(page, PER_PAGE, count)
+    pagination = Pagination(page, PER_PAGE, browse_list.count)
 
     return render_template("index.html",
         context=results,
         lang=preferred_language,
         aspect=aspect,
         page=page,
-        pagination=pagination)
+        pagination=pagination,
+        after=after,
+        next_cursor=next_cursor)
 
 
 @application.route('/term')
+@conditional_view
+@cached_view
 def term():
     page = request.args.get('page', '1')
     preferred_language = request.args.get('lang', 'en')
@@ -398,10 +743,19 @@ def term():
 
     term = Term(uri, lang=preferred_language)
 
-    relationships = term.relationships()
-    count = len(relationships)
-    rel = relationships[(int(page) - 1) * int(PER_PAGE):(int(page) - 1) * int(PER_PAGE) + int(PER_PAGE)]
-    pagination = Pagination(page, PER_PAGE, count)
+    # every relation type is paged on its own (<type>_page, defaulting to
+    # page); counts come first and only the shown neighbours get labels
+    counts = term.relationship_counts()
+    shown_pages = OrderedDict()
+    relation_pages = []
+    for predicate in RELATIONS:
+        name = predicate.split('#')[1]
+        rel_page = request.args.get(name + '_page', page)
+        if counts[name]:
+            shown_pages[predicate] = rel_page
+        relation_pages.append((name, Pagination(rel_page, PER_PAGE, counts[name])))
+    rel = term.relationship_pages(shown_pages, PER_PAGE)
+    pagination = Pagination(page, PER_PAGE, max(counts.values()))
 
     return render_template('term.html',
         rdf_types=term.rdf_types(),
@@ -411,12 +765,15 @@ def term():
         breadcrumbs=term.breadcrumbs(),
         scope_notes=term.scope_notes(),
         relationships=rel,
+        relation_pages=relation_pages,
         matches=term.matches(),
         lang=preferred_language,
         pagination=pagination)
 
 
 @application.route('/root')
+@conditional_view
+@cached_view
 def root():
     preferred_language = request.args.get('lang', 'en')
     uri_anchor = request.args.get('uri_anchor')
@@ -439,6 +796,8 @@ def root():
 
 
 @application.route('/search')
+@conditional_view
+@cached_view
 def search():
     import unicodedata
     query = request.args.get('q', None)
@@ -457,21 +816,20 @@ def search():
 
     query = remove_control_characters(query)
 
-    match = query_es(query, preferred_language, 50)
-    count = len(match)
-    if count == 0:
-        resp = ["No Matches"]
-        return render_template('search.html', results=resp, lang=preferred_language)
-    response = []
-    for m in match['hits']['hits']:
-        response.append({
+    # one backend call for the page; labels come from the indexed documents
+    offset = (int(page) - 1) * int(PER_PAGE)
+    match = query_index(query, preferred_language, int(PER_PAGE), offset, hit_fields(preferred_language))
+    hits = match['hits']['hits']
+    labels = hit_labels(hits, preferred_language)
+    resp = []
+    for m in hits:
+        resp.append({
             'score': m['_score'],
-            'pref_label': get_preferred_label(URIRef(m["_source"]["uri"]), preferred_language),
+            'pref_label': labels[m["_source"]["uri"]],
             'uri': m["_source"]["uri"]
         }
         )
-    resp = response[(int(page) - 1) * int(PER_PAGE):(int(page) - 1) * int(PER_PAGE) + int(PER_PAGE)]
-    pagination = Pagination(page, PER_PAGE, len(response))
+    pagination = Pagination(page, PER_PAGE, match['hits']['total'])
 
     return render_template(
         'search.html',
@@ -490,12 +848,18 @@ def autocomplete():
     if not preferred_language:
         abort(500)
 
-    match = query_es(q, preferred_language, 20)
+    # optionally only suggest resources of one rdf type, e.g. aspect=Concept
+    aspect = request.args.get('aspect') or None
+
+    application.logger.debug("Autocomplete {} against suggest_{}".format(q, preferred_language))
+    with metrics.timer('search'):
+        match = autocomplete_search.search(q, preferred_language, 20, aspect, hit_fields(preferred_language))
     results = []
-    for res in match["hits"]["hits"]:
-        if not res["_source"].get("labels_%s" % preferred_language):
-            continue
-        pref_label = get_preferred_label(URIRef(res["_source"]["uri"]), preferred_language)
+    # label and uri come straight from the suggestions, nothing is looked up
+    options = match["suggest"][SUGGESTION][0]["options"]
+    hits = [res for res in options if res["_source"].get("labels_%s" % preferred_language)]
+    for res in hits:
+        pref_label = res["_source"]["labels_%s" % preferred_language][0]
         base_uri = ''
         uri_anchor = ''
         m = re.search('#', res["_source"]["uri"])
@@ -524,6 +888,8 @@ def thesuarus_fragment():
 
 
 @application.route('/api', methods=['GET', 'POST'])
+@conditional_view
+@cached_view
 def serialize_data():
     base_uri = request.form.get('base_uri')
     uri_anchor = request.form.get('uri_anchor')
@@ -537,6 +903,57 @@ def serialize_data():
     if req_format.lower() == 'xml':
         req_format = 'xml'
 
+    uri = base_uri + '#' + uri_anchor
+
+    # serve the pre-serialized document when the store has it
+    gzipped = 'gzip' in request.accept_encodings
+    data = None
+    if documents is not None:
+        data = documents.get(uri, req_format, gzipped)
+    if data is None:
+        gzipped = False
+        node = URIRef(uri)
+        data = serialize_graph(concept_graph(node, uri_anchor, concept_properties(node), req_format), req_format)
+
+    file_ext, mimetype = FORMATS[req_format]
+
+    if target == "download":
+        response = send_file(
+            io.BytesIO(data),
+            attachment_filename='{}.{}'.format(uri_anchor, file_ext),
+            as_attachment=True
+        )
+    else:
+        response = Response(data, mimetype=mimetype)
+    if gzipped:
+        response.headers['Content-Encoding'] = 'gzip'
+    if documents is not None:
+        response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+
+def concept_properties(node):
+    """
+    the properties of the given concept(term) that go into its serialization
+    """
+    term = Term(node)
+    return {
+        'pref_labels': term.preferred_labels(),
+        'alt_labels': term.alt_labels(),
+        'in_scheme': term.scheme(),
+        'notes': term.notes(),
+        'scope_notes': term.scope_notes(),
+        'related': term.relationships(),
+        'identifier': term.identifier(),
+        'title': term.title(),
+        'top_concept': term.top_concept_of(),
+    }
+
+
+def concept_graph(node, uri_anchor, props, req_format):
+    """
+    a new graph describing @node with @props from concept_properties()
+    """
     # This is very kludgy!
     iseuconcept = False
     if len(uri_anchor) == 6:
@@ -546,23 +963,6 @@ def serialize_data():
         isskosconceptscheme = True
         iseuconcept = True
 
-    # get the properties of the given concept(term)
-    uri = base_uri + '#' + uri_anchor
-    node = URIRef(uri)
-    term = Term(node)
-    pref_labels = term.preferred_labels()
-    scope_notes = term.scope_notes()
-    alt_labels = term.alt_labels()
-    in_scheme = term.scheme()
-    notes = term.notes()
-    scope_notes = term.scope_notes()
-    related = term.relationships()
-    identifier = term.identifier()
-    title = term.title()
-    top_concept = term.top_concept_of()
-
-    # create a new graph
-    # from rdflib import Graph
     g = Graph()
     g.bind('skos', SKOS)
     g.bind('dcterms', DCTERMS)
@@ -578,17 +978,17 @@ def serialize_data():
     if iseuconcept:
         g.add((node, RDF.type, EU.Domain))
 
-    for l in pref_labels:
+    for l in props['pref_labels']:
         g.add((node, SKOS.prefLabel, l[1]))
-    for l in alt_labels:
+    for l in props['alt_labels']:
         g.add((node, SKOS.altLabel, l))
-    for l in in_scheme:
+    for l in props['in_scheme']:
         g.add((node, SKOS.inScheme, URIRef(l[0])))
-    for l in notes:
+    for l in props['notes']:
         g.add((node, SKOS.note, l))
-    for l in scope_notes:
+    for l in props['scope_notes']:
         g.add((node, SKOS.scopeNote, l))
-    for l in related:
+    for l in props['related']:
         if l.get('type') == 'broader':
             g.add((node, SKOS.broader, URIRef(l.get('uri'))))
         elif l.get('type') == 'narrower':
@@ -598,77 +998,582 @@ def serialize_data():
         elif l.get('type') == 'hasTopConcept':
             g.add((node, SKOS.hasTopConcept, URIRef(l.get('uri'))))
 
+    identifier = props['identifier']
     if(len(identifier)):
         g.add((node, DCTERMS.identifier, identifier[0][0]))
         g.add((node, DCTERMS.identifier, URIRef(identifier[1][0])))
 
-    for i in title:
+    for i in props['title']:
         g.add((node, DCTERMS.title, Literal(i[0])))
 
+    top_concept = props['top_concept']
     if top_concept:
         g.add((node, SKOS.topConceptOf, URIRef(top_concept[0][0])))
+    return g
+
 
+def serialize_graph(g, req_format):
     # graph.serialize returns binary data
-    data = b''
     if req_format != 'json-ld':
-        data = g.serialize(format=req_format, encoding='utf-8')
+        return g.serialize(format=req_format, encoding='utf-8')
+    return g.serialize(format="json-ld", indent=4)
+
+
+@application.cli.command('build-documents')
+def build_documents():
+    """
+    Pre-serialize every concept in all /api formats for the loaded graph.
+    """
+    graph_version = latest_versions(store.engine).get('graph')
+    if not graph_version or not DOCUMENTS_DIR:
+        print("Nothing to build: no graph version published or DOCUMENTS_DIR not set")
+        return
+    os.makedirs(DOCUMENTS_DIR, exist_ok=True)
+    source = triple_source()
+    uris = sorted(set(r for t in ROUTABLES.values() for r in source.subjects(RDF.type, t)))
+
+    def serialized():
+        for uri in uris:
+            if '#' not in uri:
+                continue
+            uri_anchor = uri.split('#')[1]
+            props = concept_properties(uri)
+            for req_format in FORMATS:
+                g = concept_graph(uri, uri_anchor, props, req_format)
+                yield uri, req_format, serialize_graph(g, req_format)
+
+    path = store_path(DOCUMENTS_DIR, graph_version[0])
+    count = write_documents(path, serialized())
+    print("Stored {} documents in {}".format(count, path))
+
+
+def request_list(name):
+    """
+    values of the request parameter @name, repeated or comma separated
+    """
+    values = request.values.getlist(name)
+    return [u.strip() for v in values for u in v.split(',') if u.strip()]
+
+
+def body_list(body, name):
+    """
+    the list of strings under @name in the JSON @body, if any; aborts
+    with 400 on anything else
+    """
+    values = body.get(name)
+    if values is None:
+        return []
+    if not isinstance(values, list) or not all(isinstance(v, str) for v in values):
+        abort(400, {"message": "{} must be a list of strings".format(name)})
+    return values
+
+
+def _hierarchy_response(direction):
+    """
+    JSON {uri: [{"uri": ..., "depth": ...}, ...]} for the uri parameters
+    of the request (repeated, or comma separated), optionally limited
+    to max_depth levels
+    """
+    if hierarchy is None:
+        abort(503, {"message": "The hierarchy closure table has not been built"})
+    uris = request_list('uri')
+    if not uris:
+        abort(400, {"message": "At least one uri is required"})
+    max_depth = request.values.get('max_depth', type=int)
+    found = getattr(hierarchy, direction)(uris, max_depth)
+    results = OrderedDict()
+    for uri in uris:
+        results[uri] = [{'uri': r, 'depth': depth} for r, depth in found[uri]]
+    return Response(json.dumps(results), content_type='application/json')
+
+
+@application.route('/api/ancestors', methods=['GET', 'POST'])
+def ancestors():
+    return _hierarchy_response('ancestors')
+
+
+@application.route('/api/descendants', methods=['GET', 'POST'])
+def descendants():
+    return _hierarchy_response('descendants')
+
+
+# direct relations reported by /api/concepts: (key, predicate)
+CONCEPT_RELATIONS = [
+    ('broader', SKOS.broader),
+    ('narrower', SKOS.narrower),
+    ('related', SKOS.related),
+    ('has_top_concept', SKOS.hasTopConcept),
+    ('top_concept_of', SKOS.topConceptOf),
+]
+
+
+def resolve_identifiers(identifiers):
+    """
+    {identifier: concept URI} for the concepts with those dcterms:identifier
+    values, one store query per batch
+    """
+    predicate = URIRef(bound_namespaces.get('dcterms', DEFAULT_NAMESPACES['dcterms']) + 'identifier')
+    found = {}
+    for i in range(0, len(identifiers), LABEL_BATCH_SIZE):
+        batch = [Literal(identifier) for identifier in identifiers[i:i + LABEL_BATCH_SIZE]]
+        for s, p, o in graph.triples_choices((None, predicate, batch)):
+            found.setdefault(str(o), s)
+    return found
+
+
+def describe_concepts(uris):
+    """
+    {uri: {predicate: [objects]}} for every statement about @uris, in
+    one store query (or from the snapshot)
+    """
+    described = dict((URIRef(uri), OrderedDict()) for uri in uris)
+    if snapshot is not None:
+        triples = ((s, p, o) for s in described for p, o in snapshot.predicate_objects(s))
     else:
-        data = g.serialize(format="json-ld", indent=4)
+        triples = graph.triples_choices((list(described), None, None)) if described else ()
+    for s, p, o in triples:
+        described[s].setdefault(p, []).append(o)
+    return described
+
+
+def concept_record(query, uri, by_predicate):
+    """
+    the /api/concepts line for @uri, looked up as @query
+    """
+    if not by_predicate:
+        return {'query': query, 'uri': uri and str(uri), 'found': False}
+    labels = OrderedDict()
+    for label in by_predicate.get(SKOS.prefLabel, []):
+        labels.setdefault(label.language or '', str(label))
+    alt_labels = OrderedDict()
+    for label in by_predicate.get(SKOS.altLabel, []):
+        alt_labels.setdefault(label.language or '', []).append(str(label))
+    identifier = URIRef(bound_namespaces.get('dcterms', DEFAULT_NAMESPACES['dcterms']) + 'identifier')
+    record = OrderedDict([
+        ('query', query),
+        ('uri', str(uri)),
+        ('found', True),
+        ('identifiers', [str(i) for i in by_predicate.get(identifier, [])]),
+        ('types', [str(t) for t in by_predicate.get(RDF.type, [])]),
+        ('labels', labels),
+        ('alt_labels', alt_labels),
+    ])
+    for key, predicate in CONCEPT_RELATIONS:
+        record[key] = [str(o) for o in by_predicate.get(predicate, [])]
+    return record
+
+
+def concept_lines(entries):
+    """
+    one JSON line per (query, uri) entry, described a batch at a time
+    """
+    for i in range(0, len(entries), LABEL_BATCH_SIZE):
+        batch = entries[i:i + LABEL_BATCH_SIZE]
+        described = describe_concepts([uri for query, uri in batch if uri is not None])
+        for query, uri in batch:
+            by_predicate = described.get(URIRef(uri)) if uri is not None else None
+            yield json.dumps(concept_record(query, uri, by_predicate), ensure_ascii=False) + "\n"
+
+
+@application.route('/api/concepts', methods=['POST'])
+def concepts():
+    """
+    labels in every language, alt labels, types, identifiers and direct
+    relations of many concepts, given by uri and/or identifier (form
+    parameters, repeated or comma separated, or a JSON body
+    {"uris": [...], "identifiers": [...]}), streamed as JSON lines in
+    the order asked
+    """
+    body = request.get_json(silent=True) or {}
+    if not isinstance(body, dict):
+        abort(400, {"message": "The JSON body must be an object"})
+    uris = body_list(body, 'uris') or request_list('uri')
+    identifiers = body_list(body, 'identifiers') or request_list('identifier')
+    if not uris and not identifiers:
+        abort(400, {"message": "At least one uri or identifier is required"})
+    if len(uris) + len(identifiers) > BATCH_LOOKUP_LIMIT:
+        abort(400, {"message": "At most {} concepts can be looked up at once".format(BATCH_LOOKUP_LIMIT)})
+    resolved = resolve_identifiers(identifiers) if identifiers else {}
+    entries = [(uri, URIRef(uri)) for uri in uris]
+    entries.extend((identifier, resolved.get(identifier)) for identifier in identifiers)
+    return Response(stream_with_context(encode_lines(concept_lines(entries))),
+                    mimetype='application/x-ndjson')
+
+
+RECONCILE_MANIFEST = {
+    'name': 'UNBIS Thesaurus',
+    'identifierSpace': 'http://metadata.un.org/thesaurus',
+    'schemaSpace': str(SKOS),
+    'defaultTypes': [{'id': str(SKOS.Concept), 'name': 'Concept'}],
+    'view': {'url': '{{id}}'},
+}
 
-    file_ext = ''
-    if req_format == 'turtle':
-        file_ext = 'ttl'
 
-    elif req_format == 'xml':
-        file_ext = 'xml'
-    elif req_format == 'json-ld':
-        file_ext = 'json'
+def reconcile_queries(queries):
+    """
+    @queries with every limit checked and clamped to RECONCILE_MAX_CANDIDATES
+    (3 when missing); aborts with 400 on a query without a text or with a
+    limit that is not a positive integer
+    """
+    checked = {}
+    for key, query in queries.items():
+        if not isinstance(query, dict) or 'query' not in query:
+            abort(400, {"message": "queries must map keys to objects with a query"})
+        limit = query.get('limit')
+        if limit is None:
+            limit = 3
+        try:
+            if isinstance(limit, bool):
+                raise ValueError(limit)
+            limit = int(limit)
+        except (TypeError, ValueError):
+            abort(400, {"message": "limit of query {} is not an integer".format(key)})
+        if limit < 1:
+            abort(400, {"message": "limit of query {} must be positive".format(key)})
+        checked[key] = dict(query, limit=min(limit, RECONCILE_MAX_CANDIDATES))
+    return checked
+
+
+def reconcile_results(queries, lang):
+    """
+    {key: {"result": [candidate, ...]}} for the OpenRefine @queries
+    {key: {"query": ..., "limit": ...}}, validated by reconcile_queries,
+    searched with one msearch
+    """
+    keys = list(queries)
+    fields = hit_fields(lang) + ["alt_labels_{}".format(lang)]
+    searches = [(str(queries[k]['query']), lang, queries[k]['limit'], 0, fields) for k in keys]
+    with metrics.timer('search'):
+        responses = search_backend.msearch(searches) if searches else []
+    results = {}
+    for key, (query, _, _, _, _), response in zip(keys, searches, responses):
+        hits = response["hits"]["hits"]
+        labels = hit_labels(hits, lang)
+        wanted = tokenize(query, lang)
+        candidates = []
+        for m in hits:
+            source = m["_source"]
+            names = source.get("labels_{}".format(lang), []) + source.get("alt_labels_{}".format(lang), [])
+            candidates.append({
+                'id': source["uri"],
+                'name': str(labels[source["uri"]]),
+                'score': m['_score'],
+                'match': any(tokenize(name, lang) == wanted for name in names),
+                'type': RECONCILE_MANIFEST['defaultTypes'],
+            })
+        results[key] = {'result': candidates}
+    return results
+
+
+@application.route('/reconcile', methods=['GET', 'POST'])
+def reconcile():
+    """
+    OpenRefine reconciliation service: without queries the service
+    manifest, otherwise ranked candidate concepts for a batch of
+    queries={"q0": {"query": ..., "limit": ...}, ...} (or one query=...)
+    matched against the labels and alt labels in ?lang; candidates flag
+    exact label matches.  Query types and properties are ignored, every
+    candidate is a skos:Concept.
+    """
+    lang = request.values.get('lang', 'en')
+    if 'queries' in request.values:
+        try:
+            queries = json.loads(request.values['queries'])
+        except ValueError:
+            abort(400, {"message": "queries is not valid JSON"})
+        if not isinstance(queries, dict):
+            abort(400, {"message": "queries must map keys to objects with a query"})
+        if len(queries) > RECONCILE_LIMIT:
+            abort(400, {"message": "At most {} queries can be sent at once".format(RECONCILE_LIMIT)})
+        result = reconcile_results(reconcile_queries(queries), lang)
+    elif 'query' in request.values:
+        query = request.values['query']
+        if query.startswith('{'):
+            try:
+                query = json.loads(query)
+            except ValueError:
+                abort(400, {"message": "query is not valid JSON"})
+        else:
+            query = {'query': query}
+        result = reconcile_results(reconcile_queries({'q': query}), lang)['q']
     else:
-        file_ext = req_format
+        result = RECONCILE_MANIFEST
+    body = json.dumps(result, ensure_ascii=False)
+    callback = request.values.get('callback')
+    if callback:
+        if not re.match(r'^[\w.$]+$', callback):
+            abort(400, {"message": "Invalid callback"})
+        return Response('{}({})'.format(callback, body), content_type='application/javascript')
+    return Response(body, content_type='application/json')
 
-    if target == "download":
-        return send_file(
-            io.BytesIO(data),
-            attachment_filename='{}.{}'.format(uri_anchor, file_ext),
-            as_attachment=True
-        )
+
+def export_chunks(root, export_format, gzipped):
+    """
+    encoded chunks of the export of the thesaurus, or of the subtree
+    under @root
+    """
+    subjects = None
+    if root:
+        if hierarchy is None:
+            abort(503, {"message": "The hierarchy closure table has not been built"})
+        subjects = [root] + [d for d, depth in hierarchy.descendants([root])[root]]
+    lines = EXPORT_FORMATS[export_format][2](stream_triples(store, subjects))
+    return encode_lines(lines, gzipped)
+
+
+@application.route('/export')
+def export():
+    """
+    stream the whole thesaurus, or the subtree under ?root=<uri>, as
+    N-Triples (format=nt) or JSON-LD lines (format=jsonld); gzipped
+    when accepted, resumable with a Range header
+    """
+    export_format = request.args.get('format', 'nt')
+    if export_format not in EXPORT_FORMATS:
+        abort(400, {"message": "Unsuported export format: {}".format(export_format)})
+    root = request.args.get('root')
+    gzipped = 'gzip' in request.accept_encodings
+    mimetype, file_ext, _ = EXPORT_FORMATS[export_format]
+    etag = '{}-{}-{}'.format(dataset_version, hashlib.sha1((root or '').encode('utf-8')).hexdigest()[:8],
+                             export_format + ('-gz' if gzipped else ''))
+
+    # ranges are only served for the current version of the export
+    byte_range_request = request.range
+    if byte_range_request is not None and request.if_range.etag not in (None, etag):
+        byte_range_request = None
+    chunks = export_chunks(root, export_format, gzipped)
+    status = 200
+    content_range = None
+    if byte_range_request is not None:
+        key = (dataset_version, root, export_format, gzipped)
+        length = export_lengths.get(key)
+        if length is None:
+            length = stream_length(export_chunks(root, export_format, gzipped))
+            export_lengths.set(key, length)
+        bounds = byte_range_request.range_for_length(length)
+        if bounds is None:
+            return Response(status=416, headers={'Content-Range': 'bytes */{}'.format(length)})
+        chunks = byte_range(chunks, bounds[0], bounds[1])
+        status = 206
+        content_range = byte_range_request.make_content_range(length)
+
+    response = Response(stream_with_context(chunks), status=status, mimetype=mimetype)
+    if content_range is not None:
+        response.content_range = content_range
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.set_etag(etag)
+    if gzipped:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Content-Disposition'] = 'attachment; filename=thesaurus.{}'.format(file_ext)
+    return response
+
+
+@application.cli.command('export')
+@click.option('--format', 'export_format', type=click.Choice(sorted(EXPORT_FORMATS)), default='nt')
+@click.option('--root', default=None, help='export only the subtree under this URI')
+@click.option('--gzip', 'gzipped', is_flag=True, help='gzip the output')
+@click.argument('output', type=click.File('wb'), default='-')
+def export_command(export_format, root, gzipped, output):
+    """
+    Stream the thesaurus, or a subtree, to OUTPUT.
+    """
+    for chunk in export_chunks(root, export_format, gzipped):
+        output.write(chunk)
+
+
+@application.route('/metrics')
+def prometheus_metrics():
+    """
+    request latency histograms and per-category call totals of this
+    process, by route, in the Prometheus text format
+    """
+    if not metrics.enabled:
+        abort(404)
+    return Response(metrics.prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@application.route('/api/queries')
+def query_statistics():
+    """
+    executions and total time of each registered SPARQL query in this process
+    """
+    return Response(json.dumps(queries.stats()), content_type='application/json')
+
+
+@application.route('/api/cache')
+def cache_statistics():
+    """
+    hit/miss counters of this process's caches
+    """
+    return Response(json.dumps({
+        'dataset_version': dataset_version,
+        'response_cache': cache_stats(response_cache),
+        'label_cache': cache_stats(label_cache),
+        'autocomplete_cache': cache_stats(autocomplete_search.cache),
+        'autocomplete': autocomplete_search.stats(),
+    }), content_type='application/json')
+
+
+def triple_source():
+    """
+    the snapshot when one is loaded, otherwise the SQL backed graph
+    """
+    if snapshot is not None:
+        return snapshot
+    return graph
+
+
+def resource_types(resources):
+    """
+    {resource: set of rdf:type} for @resources in one lookup
+    """
+    types = dict((URIRef(r), set()) for r in resources)
+    if not types:
+        return types
+    if snapshot is not None:
+        for r in types:
+            types[r].update(snapshot.objects(r, RDF.type))
+    else:
+        for s, p, o in graph.triples_choices((list(types), RDF.type, None)):
+            types[s].add(o)
+    return types
+
+
+def search_documents(source_snapshot):
+    """
+    the documents load_es.py indexes, built from @source_snapshot, or
+    from the graph when there is none
+    """
+    source = source_snapshot if source_snapshot is not None else graph
+    uris = sorted(set(source.subjects(RDF.type, SKOS.Concept)))
+    if source_snapshot is not None:
+        pref_labels = ((u, o) for u in uris for o in source_snapshot.objects(u, SKOS.prefLabel))
+        alt_labels = ((u, o) for u in uris for o in source_snapshot.objects(u, SKOS.altLabel))
+        rdf_types = ((u, o) for u in uris for o in source_snapshot.objects(u, RDF.type))
+    else:
+        pref_labels = ((s, o) for s, p, o in graph.triples((None, SKOS.prefLabel, None)))
+        alt_labels = ((s, o) for s, p, o in graph.triples((None, SKOS.altLabel, None)))
+        rdf_types = ((s, o) for s, p, o in graph.triples((None, RDF.type, None)))
+    return build_search_documents(uris, pref_labels, alt_labels, rdf_types)
+
+
+def build_browse_index(source_snapshot, version):
+    """
+    browse lists of @version, read from @source_snapshot, or from the
+    graph when there is none
+    """
+    source = source_snapshot if source_snapshot is not None else graph
+    members = dict(
+        (aspect, set(source.subjects(RDF.type, uri))) for aspect, uri in ROUTABLES.items())
+    if source_snapshot is not None:
+        resources = set().union(*members.values())
+        labels = ((r, l) for r in resources for l in source_snapshot.objects(r, SKOS.prefLabel))
     else:
-        if req_format == 'turtle':
-            return Response(data, mimetype='text/turtle')
-        elif req_format == 'xml':
-            return Response(data, mimetype='text/xml')
-        elif req_format == 'n3':
-            return Response(data, mimetype='text/n3')
-        elif req_format == 'json-ld':
-            return Response(data, mimetype='application/ld+json')
+        labels = ((s, o) for s, p, o in graph.triples((None, SKOS.prefLabel, None)))
+    return BrowseIndex.build(members, labels, version)
+
+
+def get_browse_index():
+    """
+    browse lists for the loaded dataset version, built by load_data()
+    """
+    return browse_index
 
 
 def get_preferred_label(resource, language):
+    return get_preferred_labels([resource], language)[URIRef(resource)]
+
+
+def get_preferred_labels(resources, language):
+    """
+    resolve the preferred labels of many resources at once
+
+    returns a dict of URIRef -> label; resources without a label in
+    @language map to themselves.  Labels not in the label cache are
+    fetched with one store query per LABEL_BATCH_SIZE resources
+    """
     if not language:
         language = 'en'
-    label = graph.preferredLabel(resource, lang=language)
-    # pref labels come back as tupels
-    if len(label) > 0:
-        return label[0][1]
-    else:
-        return resource
-
+    resources = [URIRef(r) for r in resources]
+    if snapshot is not None:
+        labels = {}
+        for r in resources:
+            label = snapshot.preferredLabel(r, lang=language)
+            # pref labels come back as tupels
+            labels[r] = label[0][1] if label else r
+        return labels
 
-def query_es(query, lang, max_hits):
+    labels = {}
+    missing = []
+    for r in resources:
+        label = label_cache.get((dataset_version, language, r))
+        if label is None:
+            missing.append(r)
+        else:
+            labels[r] = label
+    missing = list(OrderedDict.fromkeys(missing))
+    for i in range(0, len(missing), LABEL_BATCH_SIZE):
+        batch = missing[i:i + LABEL_BATCH_SIZE]
+        found = fetch_preferred_labels(batch, language)
+        for r in batch:
+            labels[r] = found.get(r, r)
+            label_cache.set((dataset_version, language, r), labels[r])
+    return labels
+
+
+def fetch_preferred_labels(resources, language):
+    """
+    one store query for the skos:prefLabels of @resources, with the same
+    rdfs:label fallback as graph.preferredLabel for any that have none
+    """
+    found = {}
+    for label_prop in (SKOS.prefLabel, RDFS.label):
+        pending = [r for r in resources if r not in found]
+        if not pending:
+            break
+        for s, p, o in graph.triples_choices((pending, label_prop, None)):
+            if isinstance(o, Literal) and o.language == language:
+                found.setdefault(s, o)
+    return found
+
+
+def query_index(query, lang, size, offset=0, fields=None):
     """
     match against label and alt label for
     the preferred language
     boost preferred label
     """
     application.logger.debug("Match {} against labels_{} and alt_labels_{}".format(query, lang, lang))
-    dsl_q = """
-     {
-       "query": {
-         "multi_match" : {
-           "query":    "%s",
-           "fields": [ "labels_%s^3", "alt_labels_%s" ]
-         }
-       }
-     }""" % (query, lang, lang)
-    match = es.search(index='thesaurus', body=dsl_q, size=max_hits)
-    return match
+    with metrics.timer('search'):
+        return search_backend.search(query, lang, size, offset, fields)
+
+
+def hit_fields(lang):
+    """
+    the document fields a results page needs
+    """
+    return ["uri", "labels_{}".format(lang)]
+
+
+def hit_labels(hits, lang):
+    """
+    {uri: display label} for search hits, from the indexed labels;
+    hits matched on an alt label only fall back to the graph
+    """
+    labels = {}
+    for m in hits:
+        indexed = m["_source"].get("labels_{}".format(lang))
+        if indexed:
+            labels[m["_source"]["uri"]] = indexed[0]
+    missing = [m["_source"]["uri"] for m in hits if m["_source"]["uri"] not in labels]
+    if missing:
+        found = get_preferred_labels(missing, lang)
+        for uri in missing:
+            labels[uri] = found[URIRef(uri)]
+    return labels
+
+
+# needs the helpers above, so it runs once the module is fully defined
+(snapshot, hierarchy, documents, search_backend, autocomplete_search, bound_namespaces,
+ browse_index) = load_data(dataset_version)
@@ -0,0 +1,169 @@
+import base64
+import heapq
+import json
+import unicodedata
+from bisect import bisect_right
+
+try:
+    import icu
+except ImportError:
+    icu = None
+
+ARABIC_ALEFS = {'آ': 'ا', 'أ': 'ا', 'إ': 'ا', 'ٱ': 'ا'}
+
+
+def _strip_marks(text):
+    return ''.join(ch for ch in unicodedata.normalize('NFKD', text) if not unicodedata.combining(ch))
+
+
+def fallback_sort_key(label, lang):
+    """
+    approximate the alphabet order of @lang when PyICU is not installed:
+    case and accents are ignored at the first level, Spanish ñ sorts
+    as its own letter after n, Russian ё with е, Arabic harakat and
+    hamza seats on alef are ignored.  Chinese keeps codepoint
+    (radical-stroke) order.
+    """
+    text = label.casefold()
+    if lang == 'es':
+        text = text.replace('ñ', 'n\uffff')
+    elif lang == 'ru':
+        text = text.replace('ё', 'е')
+    elif lang == 'ar':
+        text = ''.join(ARABIC_ALEFS.get(ch, ch) for ch in text)
+    return _strip_marks(text), text
+
+
+class Collation:
+    """
+    Sort keys for labels in one language, from ICU when available
+    """
+    def __init__(self, lang):
+        self.lang = lang
+        self._collator = icu.Collator.createInstance(icu.Locale(lang)) if icu else None
+
+    def key(self, label):
+        label = str(label)
+        if self._collator is not None:
+            return (self._collator.getSortKey(label).hex(), label)
+        return fallback_sort_key(label, self.lang) + (label,)
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """
+    the key encoded in @cursor, or None if it does not hold a list of strings
+    """
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(key, list) or not all(isinstance(part, str) for part in key):
+        return None
+    return tuple(key)
+
+
+class BrowseList:
+    """
+    Labelled members of one aspect in one language, in collation order
+    """
+    def __init__(self, entries, count):
+        entries.sort()
+        self.keys = [e[0] for e in entries]
+        self.items = [(e[1], e[2]) for e in entries]
+        self.count = count
+
+    def slice(self, start, per_page):
+        """
+        @per_page items from @start, and the cursor of the
+        following page (None on the last page)
+        """
+        items = self.items[start:start + per_page]
+        next_cursor = None
+        if start + per_page < len(self.items):
+            next_cursor = encode_cursor(self.keys[start + per_page - 1])
+        return items, next_cursor
+
+    def page(self, page, per_page):
+        return self.slice((int(page) - 1) * int(per_page), int(per_page))
+
+    def position(self, cursor):
+        """
+        index of the first item after @cursor; an invalid cursor, or one
+        for keys of another shape, starts at the beginning
+        """
+        key = decode_cursor(cursor)
+        if key is None or not self.keys or len(key) != len(self.keys[0]):
+            return 0
+        return bisect_right(self.keys, key)
+
+    def page_after(self, cursor, per_page):
+        """
+        keyset pagination: the position of the first item after @cursor,
+        the @per_page items from there and the cursor of the next page
+        """
+        start = self.position(cursor)
+        items, next_cursor = self.slice(start, int(per_page))
+        return start, items, next_cursor
+
+
+class BrowseIndex:
+    """
+    Precomputed browse lists for every (aspect, language) pair, along
+    with the number of resources of each aspect
+    """
+    def __init__(self, version=None):
+        self.version = version
+        self.lists = {}
+        self.counts = {}
+        self._ranks = {}
+
+    @classmethod
+    def build(cls, members, labels, version=None):
+        """
+        @members maps aspect names to sets of resources,
+        @labels yields (resource, prefLabel) pairs
+        """
+        index = cls(version)
+        by_resource = {}
+        for resource, label in labels:
+            by_resource.setdefault(resource, []).append(label)
+        collations = {}
+        for aspect, resources in members.items():
+            index.counts[aspect] = len(resources)
+            entries = {}
+            for resource in resources:
+                for label in by_resource.get(resource, ()):
+                    lang = label.language
+                    if not lang:
+                        continue
+                    if lang not in collations:
+                        collations[lang] = Collation(lang)
+                    key = collations[lang].key(label) + (str(resource),)
+                    entries.setdefault(lang, []).append((key, resource, label))
+            for lang, lang_entries in entries.items():
+                index.lists[(aspect, lang)] = BrowseList(lang_entries, len(resources))
+        return index
+
+    def get(self, aspect, lang):
+        return self.lists.get((aspect, lang), BrowseList([], self.counts.get(aspect, 0)))
+
+    def ranks(self, lang):
+        """
+        {resource: position} in the collation order of the browse lists
+        of every aspect in @lang, built on first use; sorts any set of
+        resources without resolving their labels
+        """
+        ranks = self._ranks.get(lang)
+        if ranks is None:
+            lists = [l for (aspect, l_lang), l in sorted(self.lists.items()) if l_lang == lang]
+            ranks = {}
+            entries = heapq.merge(*[zip(l.keys, l.items) for l in lists], key=lambda entry: entry[0])
+            for key, (resource, label) in entries:
+                if resource not in ranks:
+                    ranks[resource] = len(ranks)
+            self._ranks[lang] = ranks
+        return ranks
@@ -0,0 +1,134 @@
+import hashlib
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+class LRUCache:
+    """
+    Thread-safe, size-bounded mapping that evicts the least
+    recently used entry.  Counts hits and misses.
+    """
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class TTLCache(LRUCache):
+    """
+    LRUCache whose entries also expire @ttl seconds after being set
+    """
+    def __init__(self, max_size=10000, ttl=300):
+        super(TTLCache, self).__init__(max_size)
+        self.ttl = ttl
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.time():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        super(TTLCache, self).set(key, (time.time() + self.ttl, value))
+
+
+class RedisCache:
+    """
+    Cache shared by every app process through Redis.  Same interface
+    as LRUCache; values are pickled and expire after @ttl seconds.
+    Counters are per process.
+    """
+    def __init__(self, url, prefix='thesaurus', ttl=86400):
+        if redis is None:
+            raise RuntimeError("the redis package is required for the redis cache backend")
+        self.prefix = prefix
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._redis = redis.StrictRedis.from_url(url)
+
+    def _key(self, key):
+        return '{}:{}'.format(self.prefix, hashlib.sha1(repr(key).encode('utf-8')).hexdigest())
+
+    def __len__(self):
+        return sum(1 for _ in self._redis.scan_iter(match='{}:*'.format(self.prefix)))
+
+    def get(self, key, default=None):
+        value = self._redis.get(self._key(key))
+        if value is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return pickle.loads(value)
+
+    def set(self, key, value):
+        self._redis.setex(self._key(key), self.ttl, pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+    def clear(self):
+        keys = list(self._redis.scan_iter(match='{}:*'.format(self.prefix)))
+        if keys:
+            self._redis.delete(*keys)
+
+
+def make_cache(backend, max_size=10000, redis_url=None, prefix='thesaurus', ttl=86400):
+    """
+    cache for the configured @backend: 'memory', 'redis', or None for no caching
+    """
+    if not backend:
+        return None
+    if backend == 'memory':
+        return LRUCache(max_size)
+    if backend == 'redis':
+        return RedisCache(redis_url, prefix, ttl)
+    raise ValueError("Unknown cache backend: {}".format(backend))
+
+
+def cache_stats(cache):
+    if cache is None:
+        return None
+    return {
+        'backend': 'redis' if isinstance(cache, RedisCache) else 'memory',
+        'hits': cache.hits,
+        'misses': cache.misses,
+        'size': len(cache),
+    }
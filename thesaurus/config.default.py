@@ -16,9 +16,65 @@ class Config:
     PER_PAGE = 25
     ELASTICSEARCH_URI = "http://127.0.0.1:9200/"
     INDEX_NAME = 'thesaurus'
+    # 'elasticsearch', or 'memory' to search labels in process without an ES node
+    SEARCH_BACKEND = 'elasticsearch'
+    # /autocomplete: prefixes cached for AUTOCOMPLETE_CACHE_TTL seconds, and
+    # distinct prefixes arriving within AUTOCOMPLETE_WINDOW seconds share one _msearch
+    AUTOCOMPLETE_CACHE_SIZE = 5000
+    AUTOCOMPLETE_CACHE_TTL = 300
+    AUTOCOMPLETE_WINDOW = 0.005
+    # load_es.py: worker processes, documents per bulk request,
+    # concepts handed to a worker at a time
+    ES_WORKERS = 4
+    ES_BULK_SIZE = 500
+    ES_SLICE_SIZE = 2000
+    # INDEX_NAME is an alias over versioned indices; settings restored after
+    # a build, and how many old indices are kept for load_es.py --rollback
+    ES_REPLICAS = 1
+    ES_REFRESH_INTERVAL = '1s'
+    ES_KEEP_INDICES = 3
     LANGUAGES = {
         'en': 'English',
     }
+    # load the whole graph into memory at startup and serve views from it
+    SNAPSHOT = False
+    # create_db.py also writes a memory-mapped snapshot of the graph and the
+    # hierarchy here; worker processes map it (sharing one copy) and serve
+    # views from it instead of loading SNAPSHOT or querying the store
+    SNAPSHOT_DIR = None
+    # preferred labels kept in memory, and how many URIs go in one store query
+    LABEL_CACHE_SIZE = 50000
+    LABEL_BATCH_SIZE = 500
+    # most concepts one /api/concepts request may ask for
+    BATCH_LOOKUP_LIMIT = 5000
+    # most queries one /reconcile request may send, all in one _msearch
+    RECONCILE_LIMIT = 500
+    # most candidates returned for one reconciliation query
+    RECONCILE_MAX_CANDIDATES = 100
+    # cache for rendered pages and /api payloads: 'memory', 'redis' or None;
+    # entries are dropped when a new dataset version is published, which
+    # the app checks for every VERSION_CHECK_INTERVAL seconds
+    CACHE_BACKEND = 'memory'
+    CACHE_REDIS_URL = 'redis://127.0.0.1:6379/0'
+    RESPONSE_CACHE_SIZE = 2000
+    CACHE_TTL = 86400
+    VERSION_CHECK_INTERVAL = 30
+    # Cache-Control max-age in seconds of /, /term, /root, /search and /api by
+    # view name (index, term, root, search, serialize_data), HTTP_MAX_AGE for
+    # any not listed, 0 for no-cache; all carry an ETag and Last-Modified
+    # from the dataset version, and conditional requests get a 304
+    HTTP_MAX_AGE = 300
+    HTTP_MAX_AGES = {
+        'index': 3600,
+        'term': 3600,
+        'root': 86400,
+        'serialize_data': 3600,
+    }
+    # where `flask build-documents` writes the pre-serialized /api documents
+    DOCUMENTS_DIR = 'documents'
+    # time store calls, SQL, searches and rendering per request: a Server-Timing
+    # header on every response and latency histograms by route at /metrics
+    METRICS = False
 
 
 class ProductionConfig(Config):
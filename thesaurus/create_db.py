@@ -4,12 +4,23 @@
 # when loading data, DROP DATABASE thesaurus
 # CREATE DATABASE thesaurus
 # then run this script
+#
+# -fast loads with COPY instead of inserting triple by triple;
+# -compare loads FILE both ways into scratch tables and checks
+# that the two results are identical;
+# -hierarchy only rebuilds the closure table of an existing database;
+# -snapshot only rewrites the memory-mapped snapshot (see SNAPSHOT_DIR)
 
 import argparse
 from rdflib import ConjunctiveGraph, Literal
 from rdflib_sqlalchemy import registerplugins
 from flask import Flask
 from config import DevelopmentConfig
+from dataset import file_version, publish_version, latest_versions
+from fast_load import load_file, compare_stores
+from hierarchy import hierarchy_edges, build_closure, store_closure, has_closure, Closure
+from mmap_snapshot import snapshot_path, write_snapshot
+from snapshot import Snapshot
 from rdflib_sqlalchemy.store import SQLAlchemy
 import os.path
 import sys
@@ -18,24 +29,93 @@ registerplugins()
 
 app = Flask(__name__)
 app.config.from_object(DevelopmentConfig)
+# optional file of overrides, e.g. to point the scripts at another database
+app.config.from_envvar('THESAURUS_SETTINGS', silent=True)
 
 
 parser = argparse.ArgumentParser(description='Input File')
-parser.add_argument("-f", dest="filename", required=True,
-                    help="input file to be parsed", metavar="FILE")
+parser.add_argument("-f", dest="filename",
+                    help="input file to be parsed; not needed with -hierarchy or -snapshot",
+                    metavar="FILE")
+parser.add_argument("-fast", dest="fast", action="store_true",
+                    help="bulk load with COPY, building indexes afterwards")
+parser.add_argument("-batch", dest="batch_size", type=int, default=50000,
+                    help="triples per COPY batch in fast mode")
+parser.add_argument("-compare", dest="compare", action="store_true",
+                    help="check that fast and regular loads of FILE give the same tables")
+parser.add_argument("-hierarchy", dest="hierarchy", action="store_true",
+                    help="rebuild the hierarchy closure table from the loaded graph and exit")
+parser.add_argument("-snapshot", dest="snapshot", action="store_true",
+                    help="rewrite the memory-mapped snapshot of the loaded graph and exit")
 
 args = parser.parse_args()
 
-if not os.path.exists(args.filename):
+if args.filename is None and not (args.hierarchy or args.snapshot):
+    parser.error("the following arguments are required: -f")
+if args.filename is not None and not os.path.exists(args.filename):
     print("Invalid file: exiting.")
     sys.exit(-1)
 
 DB_URI = app.config.get('DB_URI', None)
 IDENTIFIER = app.config.get('IDENTIFIER', None)
+SNAPSHOT_DIR = app.config.get('SNAPSHOT_DIR', None)
 
 uri = Literal(DB_URI)
+
+if args.compare:
+    slow_store = SQLAlchemy(identifier=IDENTIFIER + '_compare_slow', configuration=uri)
+    ConjunctiveGraph(slow_store).parse(source=args.filename, format='text/turtle', publicID=IDENTIFIER)
+    fast_store = SQLAlchemy(identifier=IDENTIFIER + '_compare_fast', configuration=uri)
+    load_file(fast_store, args.filename, IDENTIFIER, args.batch_size)
+    differences = compare_stores(slow_store, fast_store)
+    slow_store.destroy(uri)
+    fast_store.destroy(uri)
+    if differences:
+        print("Fast load differs from regular load in: {}".format(", ".join(differences)))
+        sys.exit(-1)
+    print("Fast and regular loads are identical")
+    sys.exit(0)
+
+
+def load_hierarchy(store):
+    rows = store_closure(store.engine, build_closure(hierarchy_edges(ConjunctiveGraph(store))))
+    print("Stored {} hierarchy closure rows".format(rows))
+
+
+def load_snapshot(store, graph_version):
+    if not SNAPSHOT_DIR:
+        print("SNAPSHOT_DIR is not configured; no snapshot written")
+        return
+    closure = Closure.load(store.engine) if has_closure(store.engine) else None
+    if not os.path.isdir(SNAPSHOT_DIR):
+        os.makedirs(SNAPSHOT_DIR)
+    path = snapshot_path(SNAPSHOT_DIR, graph_version)
+    terms = write_snapshot(path, Snapshot.from_graph(ConjunctiveGraph(store)), closure)
+    print("Wrote snapshot of {} terms to {}".format(terms, path))
+
+
 store = SQLAlchemy(identifier=IDENTIFIER, configuration=uri)
-graph = ConjunctiveGraph(store)
-graph.parse(source=args.filename, format='text/turtle', publicID=IDENTIFIER)
-graph.commit()
+if args.hierarchy:
+    load_hierarchy(store)
+    sys.exit(0)
+if args.snapshot:
+    graph_version = latest_versions(store.engine).get('graph')
+    if graph_version is None:
+        print("No graph version published; load the data first.")
+        sys.exit(-1)
+    load_snapshot(store, graph_version[0])
+    sys.exit(0)
+
+if args.fast:
+    load_file(store, args.filename, IDENTIFIER, args.batch_size)
+else:
+    graph = ConjunctiveGraph(store)
+    graph.parse(source=args.filename, format='text/turtle', publicID=IDENTIFIER)
+    graph.commit()
+load_hierarchy(store)
+graph_version = file_version(args.filename)
+# the snapshot has to exist before the version that names it is published
+if SNAPSHOT_DIR:
+    load_snapshot(store, graph_version)
+publish_version(store.engine, 'graph', graph_version)
 print("Created new database '{}'".format(app.config.get("POSTGRES_DB")))
@@ -0,0 +1,79 @@
+"""
+Bookkeeping for the version of the loaded thesaurus data.
+
+Loaders publish a version string for the component they load (the
+triple store, the search index) into a small table next to the
+rdflib-sqlalchemy tables.  The app combines the latest publication
+of each component into one dataset version, which is used to key
+anything cached from the data.
+"""
+import hashlib
+from datetime import datetime
+from sqlalchemy import MetaData, Table, Column, Integer, String, DateTime, select
+
+metadata = MetaData()
+
+versions = Table(
+    'thesaurus_dataset_version', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('component', String(32), nullable=False),
+    Column('version', String(64), nullable=False),
+    Column('published', DateTime, nullable=False),
+)
+
+
+def file_version(filename):
+    """
+    sha1 of the contents of @filename
+    """
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def publish_version(engine, component, version):
+    """
+    record that @component now holds data at @version
+    """
+    metadata.create_all(engine, tables=[versions])
+    with engine.begin() as connection:
+        connection.execute(versions.insert(), {
+            'component': component,
+            'version': version,
+            'published': datetime.utcnow()})
+
+
+def latest_versions(engine):
+    """
+    {component: (version, published)} for the latest publication of each component
+    """
+    latest = {}
+    with engine.connect() as connection:
+        if not engine.dialect.has_table(connection, versions.name):
+            return latest
+        for row in connection.execute(select([versions]).order_by(versions.c.id)):
+            latest[row['component']] = (row['version'], row['published'])
+    return latest
+
+
+def current_state(engine):
+    """
+    (short hash over the latest version of every component, time of the
+    latest publication), (None, None) if nothing was ever published
+    """
+    latest = latest_versions(engine)
+    if not latest:
+        return None, None
+    key = ';'.join('{}:{}'.format(c, latest[c][0]) for c in sorted(latest))
+    published = max(published for version, published in latest.values())
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16], published
+
+
+def current_version(engine):
+    """
+    short hash over the latest version of every component,
+    None if nothing was ever published
+    """
+    return current_state(engine)[0]
@@ -0,0 +1,157 @@
+"""
+Differences between a new release of the thesaurus and the loaded graph.
+
+Every subject gets a canonical hash of its statements: the sum of the
+sha1 of each statement's N-Triples line, so it does not depend on the
+order the store or the parser returns them in.  The hashes of the
+loaded graph are computed while streaming the store and only the
+subjects whose hash differs are read back to find the exact triples
+added and removed.  apply_delta() writes both in one transaction.
+
+Blank nodes get new labels on every parse, so subjects with blank-node
+statements always count as changed.
+"""
+import hashlib
+from rdflib import Literal, RDF
+from rdflib.namespace import SKOS
+from rdflib.plugins.serializers.nt import _nt_row
+from sqlalchemy import and_, bindparam
+from export import stream_triples
+from fast_load import statement_rows, copy_rows, insert_rows
+
+HASH_MODULUS = 1 << 160
+
+
+def triple_hash(triple):
+    return int(hashlib.sha1(_nt_row(triple).encode('utf-8')).hexdigest(), 16)
+
+
+def subject_hashes(triples):
+    """
+    {subject: canonical hash of its statements} for @triples in any order
+    """
+    hashes = {}
+    for triple in triples:
+        s = triple[0]
+        hashes[s] = (hashes.get(s, 0) + triple_hash(triple)) % HASH_MODULUS
+    return hashes
+
+
+class Delta:
+    def __init__(self):
+        self.added = []
+        self.removed = []
+        self.added_subjects = []
+        self.removed_subjects = []
+        self.changed_subjects = []
+
+    def __bool__(self):
+        return bool(self.added or self.removed)
+
+    def summary(self):
+        return {
+            'triples_added': len(self.added),
+            'triples_removed': len(self.removed),
+            'subjects_added': len(self.added_subjects),
+            'subjects_removed': len(self.removed_subjects),
+            'subjects_changed': len(self.changed_subjects),
+        }
+
+
+def diff_store(store, new_graph, progress=print):
+    """
+    the Delta turning the contents of @store into @new_graph
+    """
+    old_hashes = subject_hashes(stream_triples(store))
+    progress("Hashed {} subjects in the store".format(len(old_hashes)))
+    new_hashes = subject_hashes(new_graph.triples((None, None, None)))
+    progress("Hashed {} subjects in the new release".format(len(new_hashes)))
+
+    delta = Delta()
+    for s, digest in new_hashes.items():
+        old = old_hashes.get(s)
+        if old is None:
+            delta.added_subjects.append(s)
+        elif old != digest:
+            delta.changed_subjects.append(s)
+    delta.removed_subjects = [s for s in old_hashes if s not in new_hashes]
+    for subjects in (delta.added_subjects, delta.removed_subjects, delta.changed_subjects):
+        subjects.sort()
+
+    for s in delta.added_subjects:
+        delta.added.extend(new_graph.triples((s, None, None)))
+    old_triples = {}
+    for triple in stream_triples(store, delta.removed_subjects + delta.changed_subjects):
+        old_triples.setdefault(triple[0], set()).add(triple)
+    for s in delta.removed_subjects:
+        delta.removed.extend(sorted(old_triples.get(s, ()), key=_nt_row))
+    for s in delta.changed_subjects:
+        new = set(new_graph.triples((s, None, None)))
+        old = old_triples.get(s, set())
+        delta.added.extend(sorted(new - old, key=_nt_row))
+        delta.removed.extend(sorted(old - new, key=_nt_row))
+    return delta
+
+
+def _delete_statement(table, columns, nulls):
+    # rdflib-sqlalchemy gives some columns keys that differ from their names
+    by_name = dict((c.name, c) for c in table.columns)
+    return table.delete().where(and_(*[
+        by_name[column].is_(None) if column in nulls else by_name[column] == bindparam('b_' + column)
+        for column in columns]))
+
+
+def delete_rows(connection, store, triples):
+    """
+    delete the rows of @triples from the store's tables, in any context;
+    the triples are grouped by table (and, for literals, by which of
+    language and datatype are set) and each group is deleted with one
+    executemany of a single DELETE
+    """
+    groups = {}
+    for s, p, o in triples:
+        if p == RDF.type:
+            name = "type_statements"
+            values = [("member", str(s)), ("klass", str(o))]
+        elif isinstance(o, Literal):
+            name = "literal_statements"
+            values = [("subject", str(s)), ("predicate", str(p)), ("object", str(o)),
+                      ("objlanguage", o.language or None),
+                      ("objdatatype", o.datatype and str(o.datatype) or None)]
+        else:
+            name = "asserted_statements"
+            values = [("subject", str(s)), ("predicate", str(p)), ("object", str(o))]
+        columns = tuple(column for column, value in values)
+        nulls = frozenset(column for column, value in values if value is None)
+        groups.setdefault((name, columns, nulls), []).append(
+            dict(('b_' + column, value) for column, value in values if value is not None))
+    for (name, columns, nulls), params in groups.items():
+        connection.execute(_delete_statement(store.tables[name], columns, nulls), params)
+
+
+def apply_delta(store, delta, context):
+    """
+    remove and add the triples of @delta in one transaction; the added
+    ones go into @context
+    """
+    write = copy_rows if store.engine.dialect.name == 'postgresql' else insert_rows
+    with store.engine.begin() as connection:
+        delete_rows(connection, store, delta.removed)
+        for name, rows in statement_rows(delta.added, context).items():
+            if rows:
+                write(connection, store.tables[name], rows)
+
+
+def affected_concepts(delta, new_graph):
+    """
+    (concepts whose search document changed, concepts no longer in the
+    thesaurus)
+    """
+    touched = set()
+    for s, p, o in delta.added + delta.removed:
+        if p in (SKOS.prefLabel, SKOS.altLabel, RDF.type):
+            touched.add(s)
+    reindex = sorted(s for s in touched if (s, RDF.type, SKOS.Concept) in new_graph)
+    removed = sorted(s for s, p, o in delta.removed
+                     if p == RDF.type and o == SKOS.Concept and (s, p, o) not in new_graph)
+    return reindex, removed
@@ -0,0 +1,103 @@
+"""
+On-disk store of pre-serialized concept documents.
+
+`flask build-documents` serializes every concept once in each /api
+format, plain and gzipped, into a single SQLite file named after the
+graph version.  /api streams the stored bytes and only builds and
+serializes a graph itself for concepts missing from the file.
+"""
+import gzip
+import io
+import os
+import sqlite3
+import threading
+
+# /api format: (file extension, mimetype)
+FORMATS = {
+    'turtle': ('ttl', 'text/turtle'),
+    'xml': ('xml', 'text/xml'),
+    'n3': ('n3', 'text/n3'),
+    'json-ld': ('json', 'application/ld+json'),
+}
+
+SCHEMA = """
+create table if not exists documents (
+    uri text not null,
+    format text not null,
+    data blob not null,
+    gz blob not null,
+    primary key (uri, format)
+)
+"""
+
+
+def store_path(directory, graph_version):
+    return os.path.join(directory, 'documents-{}.sqlite'.format(graph_version[:16]))
+
+
+def gzip_bytes(data):
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb', mtime=0) as f:
+        f.write(data)
+    return buf.getvalue()
+
+
+def write_documents(path, documents, progress=print):
+    """
+    write (uri, format, data) triples from @documents to a new store at
+    @path; the file only appears once it is complete
+    """
+    tmp_path = path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    connection = sqlite3.connect(tmp_path)
+    count = 0
+    try:
+        connection.execute(SCHEMA)
+        for uri, req_format, data in documents:
+            connection.execute(
+                "insert or replace into documents values (?, ?, ?, ?)",
+                (str(uri), req_format, data, gzip_bytes(data)))
+            count += 1
+            if count % 1000 == 0:
+                progress("{} documents stored".format(count))
+        connection.commit()
+    finally:
+        connection.close()
+    os.replace(tmp_path, path)
+    return count
+
+
+class DocumentStore:
+    """
+    read-only access to a store written by write_documents()
+    """
+    def __init__(self, path):
+        self.path = path
+        self._connection = sqlite3.connect(
+            'file:{}?mode=ro'.format(path), uri=True, check_same_thread=False)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def open(cls, directory, graph_version):
+        """
+        the store for @graph_version, None if it was not built
+        """
+        if not directory or not graph_version:
+            return None
+        path = store_path(directory, graph_version)
+        if not os.path.exists(path):
+            return None
+        return cls(path)
+
+    def get(self, uri, req_format, gzipped=False):
+        """
+        stored bytes of @uri in @req_format, gzip compressed if
+        @gzipped; None when the concept is not in the store
+        """
+        column = 'gz' if gzipped else 'data'
+        with self._lock:
+            row = self._connection.execute(
+                "select {} from documents where uri = ? and format = ?".format(column),
+                (str(uri), req_format)).fetchone()
+        return row[0] if row else None
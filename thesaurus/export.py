@@ -0,0 +1,159 @@
+"""
+Streaming export of the whole thesaurus or of a subtree.
+
+Statements are read straight from the rdflib-sqlalchemy tables through
+a streaming cursor, ordered by subject so the output is the same for
+the same data and a client can resume a download with a byte range.
+Only one chunk of rows (and, for JSON-LD lines, one subject) is held
+in memory at a time.
+"""
+import json
+import zlib
+from rdflib import Literal, BNode, RDF
+from rdflib.plugins.serializers.nt import _nt_row
+from rdflib_sqlalchemy.constants import (
+    ASSERTED_LITERAL_PARTITION,
+    ASSERTED_NON_TYPE_PARTITION,
+    ASSERTED_TYPE_PARTITION,
+    TRIPLE_SELECT,
+)
+from rdflib_sqlalchemy.sql import union_select
+from rdflib_sqlalchemy.termutils import extract_triple
+from sqlalchemy.sql import expression
+
+CHUNK_SIZE = 1000
+SUBJECT_BATCH_SIZE = 500
+BUFFER_SIZE = 1 << 16
+
+
+def statements_query(store, subjects=None):
+    """
+    union of the statement tables, ordered by subject, predicate and object,
+    optionally restricted to @subjects
+    """
+    literal = expression.alias(store.tables["literal_statements"], "literal")
+    asserted = expression.alias(store.tables["asserted_statements"], "asserted")
+    typetable = expression.alias(store.tables["type_statements"], "typetable")
+    clauses = [None, None, None]
+    if subjects is not None:
+        clauses = [literal.c.subject.in_(subjects),
+                   asserted.c.subject.in_(subjects),
+                   typetable.c.member.in_(subjects)]
+    return union_select([
+        (literal, clauses[0], ASSERTED_LITERAL_PARTITION),
+        (asserted, clauses[1], ASSERTED_NON_TYPE_PARTITION),
+        (typetable, clauses[2], ASSERTED_TYPE_PARTITION),
+    ], select_type=TRIPLE_SELECT)
+
+
+def stream_triples(store, subjects=None, chunk_size=CHUNK_SIZE):
+    """
+    (s, p, o) for every statement, or those about @subjects, fetched
+    @chunk_size rows at a time
+    """
+    if subjects is None:
+        queries = [statements_query(store)]
+    else:
+        subjects = sorted(set(str(s) for s in subjects))
+        queries = (statements_query(store, subjects[i:i + SUBJECT_BATCH_SIZE])
+                   for i in range(0, len(subjects), SUBJECT_BATCH_SIZE))
+    with store.engine.connect() as connection:
+        connection = connection.execution_options(stream_results=True)
+        for q in queries:
+            result = connection.execute(q)
+            while True:
+                rows = result.fetchmany(chunk_size)
+                if not rows:
+                    break
+                for row in rows:
+                    _id, s, p, o, _context = extract_triple(row, store)
+                    yield s, p, o
+            result.close()
+
+
+def ntriples_lines(triples):
+    for triple in triples:
+        yield _nt_row(triple)
+
+
+def _jsonld_value(o):
+    if isinstance(o, Literal):
+        value = {"@value": str(o)}
+        if o.language:
+            value["@language"] = o.language
+        elif o.datatype:
+            value["@type"] = str(o.datatype)
+        return value
+    if isinstance(o, BNode):
+        return {"@id": "_:{}".format(o)}
+    return {"@id": str(o)}
+
+
+def jsonld_lines(triples):
+    """
+    one expanded JSON-LD node object per line, one line per subject;
+    relies on the triples being ordered by subject
+    """
+    node = None
+    subject = None
+    for s, p, o in triples:
+        if s != subject:
+            if node is not None:
+                yield json.dumps(node, ensure_ascii=False) + "\n"
+            subject = s
+            node = {"@id": _jsonld_value(s)["@id"]}
+        if p == RDF.type:
+            node.setdefault("@type", []).append(str(o))
+        else:
+            node.setdefault(str(p), []).append(_jsonld_value(o))
+    if node is not None:
+        yield json.dumps(node, ensure_ascii=False) + "\n"
+
+
+# format: (mimetype, file extension, line generator)
+EXPORT_FORMATS = {
+    'nt': ('application/n-triples', 'nt', ntriples_lines),
+    'jsonld': ('application/x-ndjson', 'jsonl', jsonld_lines),
+}
+
+
+def encode_lines(lines, gzipped=False, buffer_size=BUFFER_SIZE):
+    """
+    utf-8 (optionally gzip) encoded chunks of about @buffer_size bytes
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if gzipped else None
+    buf = []
+    size = 0
+    for line in lines:
+        data = line.encode('utf-8')
+        if compressor is not None:
+            data = compressor.compress(data)
+        if data:
+            buf.append(data)
+            size += len(data)
+        if size >= buffer_size:
+            yield b''.join(buf)
+            buf = []
+            size = 0
+    if compressor is not None:
+        buf.append(compressor.flush())
+    if buf:
+        yield b''.join(buf)
+
+
+def byte_range(chunks, start, stop):
+    """
+    the bytes [@start, @stop) of the stream of @chunks
+    """
+    position = 0
+    for chunk in chunks:
+        end = position + len(chunk)
+        if end > start and position < stop:
+            yield chunk[max(start - position, 0):stop - position]
+        position = end
+        if position >= stop:
+            break
+
+
+def stream_length(chunks):
+    return sum(len(chunk) for chunk in chunks)
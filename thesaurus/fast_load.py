@@ -0,0 +1,221 @@
+"""
+Bulk loader for the rdflib-sqlalchemy store.
+
+Parses the source into memory and writes the statements straight into
+the store's tables in batches, with Postgres COPY (multi-row INSERTs on
+other databases), building the tables' indexes once all rows are in.
+Rows are laid out exactly as SQLAlchemy.add() would write them, so the
+result is read back unchanged by ConjunctiveGraph(store).
+"""
+import io
+import time
+from rdflib import Graph, Literal, URIRef, RDF
+from sqlalchemy import select, func
+from rdflib_sqlalchemy.termutils import statement_to_term_combination, type_to_term_combination
+
+TABLES = ["asserted_statements", "type_statements", "literal_statements"]
+
+
+class ParsedGraph(Graph):
+    """
+    In-memory graph that also keeps its triples in the order the parser
+    produced them, which is the order a regular load inserts them in.
+    """
+    def __init__(self):
+        super(ParsedGraph, self).__init__()
+        self.parsed = []
+
+    def add(self, triple):
+        if triple not in self:
+            self.parsed.append(triple)
+        super(ParsedGraph, self).add(triple)
+
+
+def parse_file(filename, public_id, format='text/turtle'):
+    """
+    parse @filename into an in-memory graph
+    """
+    g = ParsedGraph()
+    g.parse(source=filename, format=format, publicID=public_id)
+    return g
+
+
+def drop_indexes(store):
+    for table in store.tables.values():
+        for index in table.indexes:
+            index.drop(store.engine)
+
+
+def create_indexes(store):
+    for table in store.tables.values():
+        for index in table.indexes:
+            index.create(store.engine)
+
+
+def clear_store(store):
+    """
+    delete every row from @store's tables, e.g. after a load that failed
+    """
+    with store.engine.begin() as connection:
+        for table in store.tables.values():
+            connection.execute(table.delete())
+
+
+def statement_rows(triples, context):
+    """
+    split @triples into rows for the type, literal and asserted tables,
+    with the same values SQLAlchemy._get_build_command produces
+    """
+    rows = dict((name, []) for name in TABLES)
+    for s, p, o in triples:
+        if p == RDF.type:
+            rows["type_statements"].append({
+                "member": str(s),
+                "klass": str(o),
+                "context": str(context.identifier),
+                "termcomb": int(type_to_term_combination(s, o, context))})
+        elif isinstance(o, Literal):
+            rows["literal_statements"].append({
+                "subject": str(s),
+                "predicate": str(p),
+                "object": str(o),
+                "context": str(context.identifier),
+                "termcomb": int(statement_to_term_combination(s, p, o, context)),
+                "objlanguage": o.language or None,
+                "objdatatype": o.datatype and str(o.datatype) or None})
+        else:
+            rows["asserted_statements"].append({
+                "subject": str(s),
+                "predicate": str(p),
+                "object": str(o),
+                "context": str(context.identifier),
+                "termcomb": int(statement_to_term_combination(s, p, o, context))})
+    return rows
+
+
+def _copy_value(value):
+    if value is None:
+        return '\\N'
+    if isinstance(value, int):
+        return str(value)
+    return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def copy_rows(connection, table, rows):
+    """
+    write @rows into @table with COPY ... FROM STDIN (Postgres only)
+    """
+    columns = [c.name for c in table.columns if c.name != 'id']
+    buf = io.StringIO()
+    for row in rows:
+        buf.write('\t'.join(_copy_value(row[c]) for c in columns))
+        buf.write('\n')
+    buf.seek(0)
+    cursor = connection.connection.cursor()
+    cursor.copy_expert('COPY {} ({}) FROM STDIN'.format(
+        table.name, ', '.join(columns)), buf)
+
+
+def insert_rows(connection, table, rows):
+    """
+    multi-row INSERT fallback for databases without COPY
+    """
+    keys = dict((c.name, c.key) for c in table.columns)
+    keyed = [dict((keys[name], value) for name, value in row.items()) for row in rows]
+    connection.execute(table.insert(), keyed)
+
+
+def delete_repeated_rows(connection, table):
+    """
+    delete all but the first of the rows of @table that are alike in every
+    column but the id; returns the number of rows deleted
+    """
+    by_name = dict((c.name, c) for c in table.columns)
+    columns = [c for name, c in by_name.items() if name != 'id']
+    ranked = select([by_name['id'], func.row_number().over(
+        partition_by=columns, order_by=by_name['id']).label('rank')]).alias('ranked')
+    repeated = select([ranked.c.id]).where(ranked.c.rank > 1)
+    return connection.execute(table.delete().where(by_name['id'].in_(repeated))).rowcount
+
+
+def bulk_load(store, triples, context, batch_size=50000, progress=print, repeats=False):
+    """
+    write @triples into the empty @store in batches of @batch_size,
+    building the indexes afterwards; returns the number of triples written.
+    With @repeats the triples may come more than once: the indexes,
+    unique ones included, are dropped while loading, so the repeated rows
+    are deleted before they are built again
+    """
+    write = copy_rows if store.engine.dialect.name == 'postgresql' else insert_rows
+    start = time.time()
+    drop_indexes(store)
+    count = 0
+    batch = []
+    try:
+        with store.engine.begin() as connection:
+            for triple in triples:
+                batch.append(triple)
+                if len(batch) == batch_size:
+                    count += _write_batch(connection, store, batch, context, write)
+                    batch = []
+                    elapsed = time.time() - start
+                    progress("{} triples loaded ({:.0f} triples/sec)".format(count, count / elapsed))
+            if batch:
+                count += _write_batch(connection, store, batch, context, write)
+            if repeats:
+                progress("removing repeated statements ...")
+                for name in TABLES:
+                    count -= delete_repeated_rows(connection, store.tables[name])
+    except BaseException:
+        # the rows were rolled back; leave the tables as they were, indexes included
+        create_indexes(store)
+        raise
+    progress("building indexes ...")
+    create_indexes(store)
+    elapsed = time.time() - start
+    progress("Loaded {} triples in {:.1f}s ({:.0f} triples/sec)".format(
+        count, elapsed, count / elapsed if elapsed else 0))
+    return count
+
+
+def _write_batch(connection, store, batch, context, write):
+    for name, rows in statement_rows(batch, context).items():
+        if rows:
+            write(connection, store.tables[name], rows)
+    return len(batch)
+
+
+def load_file(store, filename, public_id, batch_size=50000, progress=print):
+    """
+    fast equivalent of ConjunctiveGraph(store).parse(filename, publicID=public_id)
+    """
+    if len(store) > 0:
+        raise ValueError("fast load needs an empty store")
+    start = time.time()
+    g = parse_file(filename, public_id)
+    progress("Parsed {} triples in {:.1f}s".format(len(g), time.time() - start))
+    for prefix, namespace in g.namespaces():
+        store.bind(prefix, namespace)
+    context = Graph(store=store, identifier=URIRef(public_id))
+    return bulk_load(store, g.parsed, context, batch_size, progress)
+
+
+def table_contents(store):
+    """
+    every row of the store's tables, ids included, sorted
+    """
+    contents = {}
+    with store.engine.connect() as connection:
+        for name, table in store.tables.items():
+            rows = connection.execute(table.select())
+            contents[name] = sorted((tuple(row) for row in rows), key=repr)
+    return contents
+
+
+def compare_stores(store_a, store_b):
+    """
+    names of the tables whose contents differ between two stores
+    """
+    a = table_contents(store_a)
+    b = table_contents(store_b)
+    return [name for name in sorted(a) if a[name] != b[name]]
@@ -0,0 +1,163 @@
+"""
+Transitive closure of the thesaurus hierarchy.
+
+create_db.py walks skos:broader, skos:narrower and skos:hasTopConcept
+once at load time and stores every (ancestor, descendant, depth) pair
+in a table next to the rdflib-sqlalchemy tables, so the app can answer
+"all ancestors" / "all descendants" of any number of resources with a
+single indexed lookup instead of walking the graph one level at a time.
+"""
+from collections import deque
+from rdflib import URIRef
+from rdflib.namespace import SKOS
+from sqlalchemy import MetaData, Table, Column, Index, Integer, Text, select, and_
+
+metadata = MetaData()
+
+closure_table = Table(
+    'thesaurus_hierarchy', metadata,
+    Column('ancestor', Text, nullable=False),
+    Column('descendant', Text, nullable=False),
+    Column('depth', Integer, nullable=False),
+    Index('thesaurus_hierarchy_ancestor_index', 'ancestor', 'depth'),
+    Index('thesaurus_hierarchy_descendant_index', 'descendant', 'depth'),
+)
+
+BATCH_SIZE = 500
+
+
+def hierarchy_edges(graph):
+    """
+    (parent, child) pairs asserted in @graph
+    """
+    for s, p, o in graph.triples((None, SKOS.broader, None)):
+        yield o, s
+    for predicate in (SKOS.narrower, SKOS.hasTopConcept):
+        for s, p, o in graph.triples((None, predicate, None)):
+            yield s, o
+
+
+def triple_edges(triples):
+    """
+    (parent, child) pairs among @triples, in the order they come
+    """
+    for s, p, o in triples:
+        if p == SKOS.broader:
+            yield o, s
+        elif p in (SKOS.narrower, SKOS.hasTopConcept):
+            yield s, o
+
+
+def build_closure(edges):
+    """
+    {descendant: {ancestor: depth}} with the shortest depth of every
+    ancestor reachable from each resource; cycles are cut
+    """
+    parents = {}
+    for parent, child in edges:
+        if parent != child:
+            parents.setdefault(str(child), set()).add(str(parent))
+    closure = {}
+    for resource in parents:
+        depths = {}
+        queue = deque([(resource, 0)])
+        while queue:
+            node, depth = queue.popleft()
+            for parent in parents.get(node, ()):
+                if parent != resource and parent not in depths:
+                    depths[parent] = depth + 1
+                    queue.append((parent, depth + 1))
+        closure[resource] = depths
+    return closure
+
+
+def store_closure(engine, closure):
+    """
+    replace the contents of the closure table; returns the number of rows
+    """
+    metadata.create_all(engine, tables=[closure_table])
+    rows = [{'ancestor': a, 'descendant': d, 'depth': depth}
+            for d, ancestors in closure.items() for a, depth in ancestors.items()]
+    with engine.begin() as connection:
+        connection.execute(closure_table.delete())
+        for i in range(0, len(rows), 10000):
+            connection.execute(closure_table.insert(), rows[i:i + 10000])
+    return len(rows)
+
+
+def has_closure(engine):
+    with engine.connect() as connection:
+        return engine.dialect.has_table(connection, closure_table.name)
+
+
+def _sorted(found):
+    return dict((uri, sorted(pairs, key=lambda pair: (pair[1], pair[0])))
+                for uri, pairs in found.items())
+
+
+class ClosureTable:
+    """
+    ancestors/descendants looked up in the closure table
+    """
+    def __init__(self, engine, batch_size=BATCH_SIZE):
+        self.engine = engine
+        self.batch_size = batch_size
+
+    def _lookup(self, uris, column, other, max_depth):
+        uris = [str(u) for u in uris]
+        found = dict((uri, []) for uri in uris)
+        with self.engine.connect() as connection:
+            for i in range(0, len(uris), self.batch_size):
+                clause = column.in_(uris[i:i + self.batch_size])
+                if max_depth is not None:
+                    clause = and_(clause, closure_table.c.depth <= max_depth)
+                q = select([column, other, closure_table.c.depth]).where(clause)
+                for key, value, depth in connection.execute(q):
+                    found[key].append((URIRef(value), depth))
+        return _sorted(found)
+
+    def ancestors(self, uris, max_depth=None):
+        """
+        {uri: [(ancestor, depth), ...]} nearest first
+        """
+        return self._lookup(uris, closure_table.c.descendant, closure_table.c.ancestor, max_depth)
+
+    def descendants(self, uris, max_depth=None):
+        """
+        {uri: [(descendant, depth), ...]} nearest first
+        """
+        return self._lookup(uris, closure_table.c.ancestor, closure_table.c.descendant, max_depth)
+
+
+class Closure:
+    """
+    the closure table held in memory, same interface as ClosureTable
+    """
+    def __init__(self):
+        self.up = {}
+        self.down = {}
+
+    @classmethod
+    def load(cls, engine):
+        closure = cls()
+        with engine.connect() as connection:
+            q = select([closure_table.c.ancestor, closure_table.c.descendant, closure_table.c.depth])
+            for ancestor, descendant, depth in connection.execute(q):
+                closure.up.setdefault(descendant, []).append((URIRef(ancestor), depth))
+                closure.down.setdefault(ancestor, []).append((URIRef(descendant), depth))
+        closure.up = _sorted(closure.up)
+        closure.down = _sorted(closure.down)
+        return closure
+
+    def _lookup(self, pairs, uris, max_depth):
+        found = {}
+        for uri in uris:
+            uri = str(uri)
+            found[uri] = [(r, d) for r, d in pairs.get(uri, ()) if max_depth is None or d <= max_depth]
+        return found
+
+    def ancestors(self, uris, max_depth=None):
+        return self._lookup(self.up, uris, max_depth)
+
+    def descendants(self, uris, max_depth=None):
+        return self._lookup(self.down, uris, max_depth)
@@ -1,23 +1,61 @@
 #!/bin/env python
 
+# Loads a thesaurus file into an empty database and a new Elasticsearch
+# index with a single parse: the triples are streamed, through bounded
+# queues, to the store writer, the search document builder and the
+# hierarchy (and, with SNAPSHOT_DIR, snapshot) builders at the same time.
+# If any of them fails the store is emptied again and nothing is published.
+#
+# -sequential runs create_db.py and then load_es.py instead;
+# -no-index leaves Elasticsearch alone (e.g. with SEARCH_BACKEND = 'memory')
+
 import os
 import sys
+import time
 import argparse
 import subprocess
 from flask import Flask
+from rdflib import Graph, Literal, URIRef, RDF
+from rdflib.namespace import SKOS
+from rdflib_sqlalchemy import registerplugins
+from rdflib_sqlalchemy.store import SQLAlchemy
 from config import AWSConfig
+from dataset import file_version, publish_version
+from fast_load import bulk_load, clear_store
+from hierarchy import triple_edges, build_closure, store_closure, Closure
+import load_es
+from mmap_snapshot import snapshot_path, write_snapshot
+from pipeline import Pipeline, StageFailed, stream_file
+from search import build_documents
+from snapshot import Snapshot
+
+registerplugins()
 
 app = Flask(__name__)
 
 app.config.from_object(AWSConfig)
+# optional file of overrides, e.g. to point the scripts at another database
+app.config.from_envvar('THESAURUS_SETTINGS', silent=True)
 
 POSTGRES_DB = app.config.get('POSTGRES_DB')
 POSTGRES_USER = app.config.get('POSTGRES_DB')
 DB_URI = app.config.get('DB_URI')
+IDENTIFIER = app.config.get('IDENTIFIER', None)
+SNAPSHOT_DIR = app.config.get('SNAPSHOT_DIR', None)
+BULK_SIZE = app.config.get('ES_BULK_SIZE', 500)
+KEEP_INDICES = app.config.get('ES_KEEP_INDICES', 3)
 
 parser = argparse.ArgumentParser(description='Input File')
 parser.add_argument("-f", dest="filename", required=True,
                     help="input file to be parsed", metavar="FILE")
+parser.add_argument("-sequential", dest="sequential", action="store_true",
+                    help="run create_db.py and then load_es.py")
+parser.add_argument("-no-index", dest="no_index", action="store_true",
+                    help="do not build an Elasticsearch index")
+parser.add_argument("-queue", dest="queue_size", type=int, default=8,
+                    help="batches queued per stage before the parser waits")
+parser.add_argument("-batch", dest="batch_size", type=int, default=50000,
+                    help="triples per COPY batch of the store writer")
 
 args = parser.parse_args()
 
@@ -25,10 +63,12 @@ if not os.path.exists(args.filename):
     print("Invalid file: exiting.")
     sys.exit(-1)
 
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
 
 def setup_postgres():
     try:
-        subprocess.run(['python', 'create_db.py', '-f', args.filename])
+        subprocess.run([sys.executable, 'create_db.py', '-f', args.filename], cwd=SCRIPT_DIR, check=True)
     except subprocess.CalledProcessError as ex:
         print("Print failed loading pg db: {}".format(ex))
         sys.exit(-1)
@@ -36,12 +76,165 @@ def setup_postgres():
 
 def setup_es():
     try:
-        subprocess.run(['python', 'load_es.py'])
+        subprocess.run([sys.executable, 'load_es.py'], cwd=SCRIPT_DIR, check=True)
     except subprocess.CalledProcessError as ex:
         print("Failed to load terms into elasticsearch: {}".format(ex))
         sys.exit(-1)
 
+
+def reporter(stage):
+    return lambda message: print("[{}] {}".format(stage, message))
+
+
+def store_stage(store, context):
+    def consume(triples):
+        # the parser only drops repeats among its recent triples
+        return bulk_load(store, triples, context, args.batch_size, progress=reporter('store'), repeats=True)
+    return consume
+
+
+def hierarchy_stage(triples):
+    return build_closure(triple_edges(triples))
+
+
+def snapshot_stage(triples):
+    snapshot = Snapshot()
+    for triple in triples:
+        snapshot.add(triple)
+    snapshot.freeze()
+    return snapshot
+
+
+def search_stage(target_index):
+    """
+    builds the concepts' documents as the file is parsed and bulk-indexes
+    them @BULK_SIZE at a time; a concept's document is built once the
+    next resource's type or labels come, so the file has to keep each
+    resource's types and labels together, as Turtle writers do.  Only
+    the URIs of the resources already seen are kept to check that
+    """
+    def consume(triples):
+        progress = reporter('search')
+        start = time.time()
+        indexed = 0
+        done = set()
+        pending = []
+        subject = None
+        pref_labels, alt_labels, rdf_types = [], [], []
+
+        def finish():
+            if subject in done:
+                raise ValueError("The types and labels of {} are not grouped together; "
+                                 "load the file with -sequential".format(subject))
+            done.add(subject)
+            if (subject, SKOS.Concept) in rdf_types:
+                pending.extend(build_documents([subject], pref_labels, alt_labels, rdf_types))
+
+        def flush():
+            nonlocal indexed
+            actions = load_es.index_actions(pending, target_index)
+            success, _ = load_es.helpers.bulk(load_es.es_con, actions, chunk_size=BULK_SIZE)
+            indexed += success
+            del pending[:]
+            elapsed = time.time() - start
+            progress("{} documents indexed ({:.0f} docs/sec)".format(
+                indexed, indexed / elapsed if elapsed else 0))
+
+        for s, p, o in triples:
+            if p not in (RDF.type, SKOS.prefLabel, SKOS.altLabel):
+                continue
+            if s != subject:
+                if subject is not None:
+                    finish()
+                if len(pending) >= BULK_SIZE:
+                    flush()
+                subject = s
+                pref_labels, alt_labels, rdf_types = [], [], []
+            pairs = rdf_types if p == RDF.type else pref_labels if p == SKOS.prefLabel else alt_labels
+            if (s, o) not in pairs:
+                pairs.append((s, o))
+        if subject is not None:
+            finish()
+        if pending:
+            flush()
+        return indexed
+    return consume
+
+
+def load_single_pass():
+    store = SQLAlchemy(identifier=IDENTIFIER, configuration=Literal(DB_URI))
+    if len(store) > 0:
+        print("The database is not empty; load into a new database or apply the release with update_db.py.")
+        sys.exit(-1)
+    graph_version = file_version(args.filename)
+
+    pipeline = Pipeline(queue_size=args.queue_size, progress=reporter('parse'))
+    pipeline.add_stage('store', store_stage(store, Graph(store=store, identifier=URIRef(IDENTIFIER))))
+    pipeline.add_stage('hierarchy', hierarchy_stage)
+    if SNAPSHOT_DIR:
+        pipeline.add_stage('snapshot', snapshot_stage)
+    target_index = None
+    if not args.no_index:
+        # build into a new physical index; the alias keeps serving the old one
+        load_es.open_search()
+        target_index = load_es.new_index_name()
+        load_es.create_index(target_index)
+        pipeline.add_stage('search', search_stage(target_index))
+
+    produce = stream_file(args.filename, IDENTIFIER)
+    try:
+        results = pipeline.run(produce)
+    except StageFailed as ex:
+        # the store writer may already have committed its rows
+        clear_store(store)
+        if target_index is not None:
+            load_es.es_con.indices.delete(index=target_index, ignore=[404])
+        print("Loading stopped, the database was emptied and nothing was published: {}".format(ex))
+        sys.exit(-1)
+
+    try:
+        for prefix, namespace in produce.sink.namespaces():
+            store.bind(prefix, namespace)
+        rows = store_closure(store.engine, results['hierarchy'])
+        print("Stored {} hierarchy closure rows".format(rows))
+        # the snapshot has to exist before the version that names it is published
+        if SNAPSHOT_DIR:
+            snapshot = results['snapshot']
+            snapshot.namespaces = dict(produce.sink.namespaces())
+            if not os.path.isdir(SNAPSHOT_DIR):
+                os.makedirs(SNAPSHOT_DIR)
+            path = snapshot_path(SNAPSHOT_DIR, graph_version)
+            terms = write_snapshot(path, snapshot, Closure.load(store.engine))
+            print("Wrote snapshot of {} terms to {}".format(terms, path))
+    except BaseException:
+        clear_store(store)
+        if target_index is not None:
+            load_es.es_con.indices.delete(index=target_index, ignore=[404])
+        print("Loading stopped, the database was emptied and nothing was published")
+        raise
+    publish_version(store.engine, 'graph', graph_version)
+    print("Created new database '{}'".format(POSTGRES_DB))
+
+    if target_index is None:
+        return
+    load_es.finish_index(target_index)
+    count = load_es.es_con.count(index=target_index)["count"]
+    if count != results['search']:
+        print("Index {} holds {} documents but {} were indexed; alias not moved, index deleted.".format(
+            target_index, count, results['search']))
+        load_es.es_con.indices.delete(index=target_index, ignore=[404])
+        sys.exit(-1)
+    load_es.swap_alias(target_index)
+    # tell the app the search results changed, so cached pages are dropped
+    publish_version(store.engine, 'search', target_index)
+    load_es.prune_indices(KEEP_INDICES)
+
+
 if __name__ == '__main__':
-    setup_postgres()
-    setup_es()
+    if args.sequential:
+        setup_postgres()
+        if not args.no_index:
+            setup_es()
+    else:
+        load_single_pass()
     print("Congrats!  Postgres database and Elasticsearch are ready to use")
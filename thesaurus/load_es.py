@@ -1,36 +1,36 @@
+import argparse
 import json
+import sys
+import time
+from datetime import datetime
+from multiprocessing import Pool
 from flask import Flask
 from config import DevelopmentConfig
-from rdflib import plugin, ConjunctiveGraph, Namespace, Literal, URIRef
+from dataset import publish_version
+from search import LANGUAGES, SUGGEST_CONTEXT, build_documents as build_search_documents
+from rdflib import plugin, ConjunctiveGraph, Namespace, Literal, URIRef, RDF
 from rdflib.store import Store
 from rdflib_sqlalchemy import registerplugins
 from rdflib.namespace import SKOS
-from elasticsearch import Elasticsearch
+from elasticsearch import Elasticsearch, helpers
 
 registerplugins()
 
 app = Flask(__name__)
 
 app.config.from_object(DevelopmentConfig)
+# optional file of overrides, e.g. to point the scripts at another database
+app.config.from_envvar('THESAURUS_SETTINGS', silent=True)
 
 identifier = URIRef(app.config.get('IDENTIFIER', None))
 db_uri = Literal(app.config.get('DB_URI'))
 
-store = plugin.get("SQLAlchemy", Store)(identifier=identifier, configuration=db_uri)
-graph = ConjunctiveGraph(store)
-graph.open(db_uri, create=False)
-graph.bind('skos', SKOS)
-
 elasticsearch_uri = app.config.get('ELASTICSEARCH_URI', None)
 index_name = app.config.get('INDEX_NAME', None)
-es_con = Elasticsearch(elasticsearch_uri)
 
 EU = Namespace('http://eurovoc.europa.eu/schema#')
 UNBIST = Namespace('http://unontologies.s3-website-us-east-1.amazonaws.com/unbist#')
 
-querystring = """ select ?uri where { ?uri rdf:type skos:Concept . }"""
-
-
 thesaurus_index = {
     "settings": {
         "index": {
@@ -46,6 +46,15 @@ thesaurus_index = {
                 },
                 "autocomplete_search": {
                     "tokenizer": "lowercase"
+                },
+                # completion inputs and prefixes in every language: words
+                # (single characters in Chinese), lower-cased, accents folded
+                "suggest": {
+                    "tokenizer": "standard",
+                    "filter": [
+                        "lowercase",
+                        "asciifolding"
+                    ]
                 }
             },
             "tokenizer": {
@@ -63,19 +72,6 @@ thesaurus_index = {
     }
 }
 
-
-# Delete index if exists
-if es_con.indices.exists(index_name):
-    print("deleting '%s' index..." % (index_name))
-    res = es_con.indices.delete(index=index_name)
-    print(" response: '%s'" % (res))
-
-# Create Index
-print("creating {} index...".format(index_name))
-res = es_con.indices.create(index=index_name, body=thesaurus_index)
-print(" response: {}".format(res))
-
-
 thesaurus_mapping = {
     "properties": {
         "uri": {"type": "text", "index": "false"},
@@ -93,33 +89,240 @@ thesaurus_mapping = {
         "alt_labels_es": {"type": "text", "analyzer": "autocomplete", "search_analyzer": "autocomplete_search"},
     }
 }
+# type-ahead: one completion field per language, filterable by rdf type
+for lang in LANGUAGES:
+    thesaurus_mapping["properties"]["suggest_{}".format(lang)] = {
+        "type": "completion",
+        "analyzer": "suggest",
+        "contexts": [{"name": SUGGEST_CONTEXT, "type": "category"}],
+    }
+
+# per-process connections, set up by open_connections()
+graph = None
+es_con = None
+
+
+def open_connections():
+    """
+    open the graph and the Elasticsearch client for this process;
+    run in every worker so no connection is shared across a fork
+    """
+    global graph
+    store = plugin.get("SQLAlchemy", Store)(identifier=identifier, configuration=db_uri)
+    graph = ConjunctiveGraph(store)
+    graph.open(db_uri, create=False)
+    graph.bind('skos', SKOS)
+    open_search()
+
+
+def open_search():
+    """
+    open only the Elasticsearch client, for loaders that bring their own documents
+    """
+    global es_con
+    es_con = Elasticsearch(elasticsearch_uri)
+
+
+def create_index(target_index):
+    """
+    create @target_index with refresh and replicas turned off for the build
+    """
+    print("creating {} index...".format(target_index))
+    body = json.loads(json.dumps(thesaurus_index))
+    body["settings"]["index"].update({"number_of_replicas": 0, "refresh_interval": "-1"})
+    res = es_con.indices.create(index=target_index, body=body)
+    print(" response: {}".format(res))
+
+    print("creating mapping ...")
+    res = es_con.indices.put_mapping(index=target_index, doc_type="doc", body=thesaurus_mapping)
+    print("resonse: {}".format(res))
+
+
+def finish_index(target_index):
+    """
+    turn refresh and replicas back on and wait until the index can serve
+    """
+    es_con.indices.put_settings(index=target_index, body={"index": {
+        "number_of_replicas": app.config.get('ES_REPLICAS', 1),
+        "refresh_interval": app.config.get('ES_REFRESH_INTERVAL', '1s')}})
+    es_con.indices.refresh(index=target_index)
+    es_con.cluster.health(index=target_index, wait_for_status='yellow')
+
+
+def physical_indices():
+    """
+    versioned indices behind the alias, oldest first
+    """
+    return sorted(es_con.indices.get(index="{}_*".format(index_name)).keys())
+
+
+def new_index_name():
+    """
+    name for a new versioned index, sorting after the existing ones;
+    the timestamp goes down to microseconds and taken names are skipped
+    """
+    while True:
+        name = "{}_{}".format(index_name, datetime.now().strftime("%Y%m%d%H%M%S%f"))
+        if not es_con.indices.exists(index=name):
+            return name
+
+
+def alias_targets():
+    if not es_con.indices.exists_alias(name=index_name):
+        return []
+    return list(es_con.indices.get_alias(name=index_name).keys())
+
+
+def swap_alias(target_index):
+    """
+    atomically point the alias read by the app at @target_index
+    """
+    actions = [{"remove": {"index": i, "alias": index_name}} for i in alias_targets()]
+    actions.append({"add": {"index": target_index, "alias": index_name}})
+    if not actions[:-1] and es_con.indices.exists(index_name):
+        # a concrete index from before aliases were used holds the name;
+        # it goes in the same request, so search never finds the name unset
+        print("replacing unversioned '{}' index...".format(index_name))
+        actions.insert(0, {"remove_index": {"index": index_name}})
+    res = es_con.indices.update_aliases(body={"actions": actions})
+    print("alias {} -> {}: {}".format(index_name, target_index, res))
+
+
+def prune_indices(keep):
+    """
+    delete all but the @keep newest versioned indices, never the live one
+    """
+    live = alias_targets()
+    indices = physical_indices()
+    for old in indices[:max(len(indices) - keep, 0)]:
+        if old not in live:
+            print("deleting old index {}".format(old))
+            es_con.indices.delete(index=old)
+
+
+def rollback():
+    """
+    point the alias back at the index built before the live one
+    """
+    live = alias_targets()
+    older = [i for i in physical_indices() if live and i < min(live)]
+    if not older:
+        print("No earlier index to roll back to.")
+        sys.exit(-1)
+    swap_alias(older[-1])
+    return older[-1]
+
+
+def concept_uris():
+    """
+    sorted URIs of every skos:Concept, so slices are stable between runs
+    """
+    return sorted(set(graph.subjects(RDF.type, SKOS.Concept)))
+
+
+def build_documents(uris):
+    """
+    one document per concept holding the labels and alt labels in
+    every language and their completion fields; three store queries
+    for the whole batch
+    """
+    pairs = {}
+    for predicate in (SKOS.prefLabel, SKOS.altLabel, RDF.type):
+        pairs[predicate] = [(s, o) for s, p, o in graph.triples_choices((list(uris), predicate, None))]
+    return build_search_documents(uris, pairs[SKOS.prefLabel], pairs[SKOS.altLabel], pairs[RDF.type])
+
+
+def index_actions(docs, target_index):
+    for doc in docs:
+        yield {
+            "_index": target_index,
+            "_type": "doc",
+            "_id": doc["uri"],
+            "_source": doc,
+        }
+
+
+def index_slice(job):
+    """
+    worker: build and bulk-index the documents for one slice of the concept list
+    """
+    uris, target_index, bulk_size = job
+    count = 0
+    for i in range(0, len(uris), bulk_size):
+        docs = build_documents(uris[i:i + bulk_size])
+        success, _ = helpers.bulk(es_con, index_actions(docs, target_index), chunk_size=bulk_size)
+        count += success
+    return count
+
+
+def index_concepts(uris, target_index, workers, bulk_size, slice_size):
+    """
+    spread @uris over @workers processes and report throughput
+    """
+    jobs = [(uris[i:i + slice_size], target_index, bulk_size) for i in range(0, len(uris), slice_size)]
+    start = time.time()
+    indexed = 0
+    if workers > 1:
+        pool = Pool(workers, initializer=open_connections)
+        results = pool.imap_unordered(index_slice, jobs)
+    else:
+        pool = None
+        results = (index_slice(job) for job in jobs)
+    try:
+        for count in results:
+            indexed += count
+            elapsed = time.time() - start
+            print("{} of {} documents indexed ({:.0f} docs/sec)".format(
+                indexed, len(uris), indexed / elapsed if elapsed else 0))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    elapsed = time.time() - start
+    print("Indexed {} documents in {:.1f}s ({:.0f} docs/sec)".format(
+        indexed, elapsed, indexed / elapsed if elapsed else 0))
+    return indexed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load the thesaurus concepts into Elasticsearch')
+    parser.add_argument("-w", "--workers", dest="workers", type=int,
+                        default=app.config.get('ES_WORKERS', 4),
+                        help="number of worker processes")
+    parser.add_argument("-b", "--bulk-size", dest="bulk_size", type=int,
+                        default=app.config.get('ES_BULK_SIZE', 500),
+                        help="documents per bulk request")
+    parser.add_argument("-s", "--slice-size", dest="slice_size", type=int,
+                        default=app.config.get('ES_SLICE_SIZE', 2000),
+                        help="concepts handed to a worker at a time")
+    parser.add_argument("-k", "--keep", dest="keep", type=int,
+                        default=app.config.get('ES_KEEP_INDICES', 3),
+                        help="versioned indices to keep for rollback")
+    parser.add_argument("--rollback", dest="rollback", action="store_true",
+                        help="point the alias back at the previous index and exit")
+    args = parser.parse_args()
+    if args.keep < 0:
+        parser.error("--keep cannot be negative")
+
+    open_connections()
+    if args.rollback:
+        publish_version(graph.store.engine, 'search', rollback())
+        sys.exit(0)
+
+    # build into a new physical index; the alias keeps serving the old one
+    target_index = new_index_name()
+    create_index(target_index)
+    uris = concept_uris()
+    index_concepts(uris, target_index, args.workers, args.bulk_size, args.slice_size)
+    finish_index(target_index)
 
-print("creating mapping ...")
-res = es_con.indices.put_mapping(index=index_name, doc_type="doc", body=thesaurus_mapping)
-print("resonse: {}".format(res))
-
-i = 0
-for uri in graph.query(querystring):
-    this_uri = uri[0]
-    doc = {"uri": this_uri}
-    j = 0
-    for lang in ['ar', 'zh', 'en', 'fr', 'ru', 'es']:
-        pref_labels = []
-        for label in graph.preferredLabel(URIRef(this_uri), lang):
-            pref_labels.append(label[1])
-        doc.update({"labels_{}".format(lang): pref_labels})
-
-        alt_labels = []
-        for label in graph.objects(URIRef(this_uri), SKOS.altLabel):
-            if label.language == lang:
-                alt_labels.append(label)
-        doc.update({"alt_labels_{}".format(lang): alt_labels})
-
-        payload = json.dumps(doc)
-
-        res = es_con.index(index=index_name, doc_type='doc', body=payload)
-        doc = {"uri": this_uri}
-        j += 1
-    i += j
-    if i % 50 == 0:
-        print("{} fields indexed".format(i))
+    count = es_con.count(index=target_index)["count"]
+    if count != len(uris):
+        print("Index {} holds {} documents but the graph has {} concepts; alias not moved, index deleted.".format(
+            target_index, count, len(uris)))
+        es_con.indices.delete(index=target_index, ignore=[404])
+        sys.exit(-1)
+    swap_alias(target_index)
+    # tell the app the search results changed, so cached pages are dropped
+    publish_version(graph.store.engine, 'search', target_index)
+    prune_indices(args.keep)
@@ -0,0 +1,249 @@
+"""
+Per-request timing of the store, the search backend and rendering.
+
+Metrics.instrument() wraps a callable so the calls made while a request
+is being recorded are counted and timed under a category.  Only the
+outermost call of a category is timed, so graph.objects() calling
+graph.triples() counts once, and generators (graph.triples) are timed
+while they are consumed.  Each request's timings become a
+Server-Timing header and are added to per-route totals and latency
+histograms, exported in the Prometheus text format.
+
+Nothing is wrapped when metrics are disabled, so they cost nothing.
+"""
+import threading
+import time
+import types
+from contextlib import contextmanager
+
+# upper bounds in seconds of the request latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class RouteStats:
+    def __init__(self, buckets):
+        self.buckets = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.categories = {}
+
+
+class Metrics:
+    def __init__(self, enabled=False, buckets=BUCKETS, prefix='thesaurus'):
+        self.enabled = enabled
+        self.bucket_bounds = tuple(buckets)
+        self.prefix = prefix
+        self._routes = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    # recording
+
+    def start(self):
+        """
+        begin recording the calls made by this thread
+        """
+        self._local.timings = {}
+        self._local.active = set()
+        self._local.started = time.perf_counter()
+
+    def stop(self):
+        """
+        (seconds since start(), {category: [calls, seconds]}) and stop
+        recording; None when this thread was not recording
+        """
+        timings = getattr(self._local, 'timings', None)
+        if timings is None:
+            return None
+        self._local.timings = None
+        return time.perf_counter() - self._local.started, timings
+
+    def _enter(self, category):
+        """
+        True when @category should be timed: this thread is recording and
+        not already inside a call of the same category
+        """
+        timings = getattr(self._local, 'timings', None)
+        if timings is None or category in self._local.active:
+            return False
+        self._local.active.add(category)
+        return True
+
+    def _leave(self, category, elapsed):
+        self._local.active.discard(category)
+        self._add(category, elapsed)
+
+    def _add(self, category, elapsed):
+        timings = getattr(self._local, 'timings', None)
+        if timings is None:
+            return
+        entry = timings.setdefault(category, [0, 0.0])
+        entry[0] += 1
+        entry[1] += elapsed
+
+    def _timed_iter(self, category, iterator, elapsed):
+        try:
+            while True:
+                outer = self._enter(category)
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    if outer:
+                        self._local.active.discard(category)
+                        elapsed += time.perf_counter() - start
+                yield item
+        finally:
+            # counted as one call, once the caller is done with the generator
+            self._add(category, elapsed)
+
+    @contextmanager
+    def _timer(self, category):
+        outer = self._enter(category)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if outer:
+                self._leave(category, time.perf_counter() - start)
+
+    @contextmanager
+    def _no_timer(self):
+        yield
+
+    def timer(self, category):
+        """
+        context manager timing its block under @category
+        """
+        if not self.enabled:
+            return self._no_timer()
+        return self._timer(category)
+
+    def instrument(self, category, fn):
+        """
+        @fn, timed under @category when metrics are enabled
+        """
+        if not self.enabled:
+            return fn
+
+        def wrapper(*args, **kwargs):
+            if not self._enter(category):
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException:
+                self._leave(category, time.perf_counter() - start)
+                raise
+            elapsed = time.perf_counter() - start
+            if isinstance(result, types.GeneratorType):
+                self._local.active.discard(category)
+                return self._timed_iter(category, result, elapsed)
+            self._leave(category, elapsed)
+            return result
+        wrapper.__wrapped__ = fn
+        wrapper.__name__ = getattr(fn, '__name__', 'wrapper')
+        return wrapper
+
+    def instrument_methods(self, category, obj, names):
+        """
+        replace the methods @names of @obj with instrumented ones
+        """
+        if not self.enabled:
+            return
+        for name in names:
+            setattr(obj, name, self.instrument(category, getattr(obj, name)))
+
+    def instrument_engine(self, category, engine):
+        """
+        time every statement a SQLAlchemy @engine executes
+        """
+        if not self.enabled:
+            return
+        from sqlalchemy import event
+
+        @event.listens_for(engine, 'before_cursor_execute')
+        def before(conn, cursor, statement, parameters, context, executemany):
+            context._metrics_start = time.perf_counter()
+
+        @event.listens_for(engine, 'after_cursor_execute')
+        def after(conn, cursor, statement, parameters, context, executemany):
+            start = getattr(context, '_metrics_start', None)
+            if start is not None:
+                self._add(category, time.perf_counter() - start)
+
+    # reporting
+
+    def observe(self, route, elapsed, timings):
+        """
+        add one request to the totals of @route
+        """
+        with self._lock:
+            stats = self._routes.get(route)
+            if stats is None:
+                stats = self._routes[route] = RouteStats(self.bucket_bounds)
+            stats.count += 1
+            stats.sum += elapsed
+            for i, bound in enumerate(self.bucket_bounds):
+                if elapsed <= bound:
+                    stats.buckets[i] += 1
+            for category, (calls, seconds) in timings.items():
+                entry = stats.categories.setdefault(category, [0, 0.0])
+                entry[0] += calls
+                entry[1] += seconds
+
+    @staticmethod
+    def server_timing(elapsed, timings):
+        """
+        Server-Timing header value: the time and number of calls of
+        each category, and the total
+        """
+        parts = ['{};dur={:.2f};desc="{} calls"'.format(category, seconds * 1000, calls)
+                 for category, (calls, seconds) in sorted(timings.items())]
+        parts.append('total;dur={:.2f}'.format(elapsed * 1000))
+        return ', '.join(parts)
+
+    def prometheus(self):
+        """
+        the per-route totals in the Prometheus text exposition format
+        """
+        name = self.prefix + '_request_duration_seconds'
+        calls_name = self.prefix + '_request_calls_total'
+        seconds_name = self.prefix + '_request_call_seconds_total'
+        lines = [
+            '# HELP {} Request latency by route.'.format(name),
+            '# TYPE {} histogram'.format(name),
+        ]
+        calls = [
+            '# HELP {} Calls made while serving requests, by route and category.'.format(calls_name),
+            '# TYPE {} counter'.format(calls_name),
+        ]
+        seconds = [
+            '# HELP {} Time spent in calls while serving requests, by route and category.'.format(seconds_name),
+            '# TYPE {} counter'.format(seconds_name),
+        ]
+        with self._lock:
+            for route in sorted(self._routes):
+                stats = self._routes[route]
+                label = 'route="{}"'.format(_escape(route))
+                for bound, count in zip(self.bucket_bounds, stats.buckets):
+                    lines.append('{}_bucket{{{},le="{}"}} {}'.format(name, label, _float(bound), count))
+                lines.append('{}_bucket{{{},le="+Inf"}} {}'.format(name, label, stats.count))
+                lines.append('{}_sum{{{}}} {}'.format(name, label, _float(stats.sum)))
+                lines.append('{}_count{{{}}} {}'.format(name, label, stats.count))
+                for category in sorted(stats.categories):
+                    n, total = stats.categories[category]
+                    labels = '{},category="{}"'.format(label, _escape(category))
+                    calls.append('{}{{{}}} {}'.format(calls_name, labels, n))
+                    seconds.append('{}{{{}}} {}'.format(seconds_name, labels, _float(total)))
+        return '\n'.join(lines + calls + seconds) + '\n'
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _float(value):
+    return repr(float(value))
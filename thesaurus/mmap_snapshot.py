@@ -0,0 +1,311 @@
+"""
+Memory-mapped, read-only snapshot of the thesaurus graph.
+
+create_db.py writes the graph and the hierarchy closure into one binary
+file named after the graph version: a table of interned terms, and
+CSR-style index arrays (an offsets array indexed by term id pointing
+into a flat array of id pairs) for (predicate, object) by subject,
+(predicate, subject) by object, and (ancestor, depth) / (descendant,
+depth) by resource.  The app maps the file read-only, so every worker
+process shares the one copy in the page cache, and opening it costs
+no queries and no parsing.
+
+MappedSnapshot has the same interface as Snapshot, and its closure()
+the same interface as hierarchy.Closure.
+"""
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from rdflib import BNode, Literal, RDF, RDFS, URIRef
+from rdflib.namespace import SKOS
+
+MAGIC = b'THESMAP1'
+HEADER = struct.Struct('<8sQ')
+
+URI, LITERAL, BNODE = b'U', b'L', b'B'
+_LENGTH = struct.Struct('<I')
+_SHORT = struct.Struct('<H')
+
+
+def snapshot_path(directory, graph_version):
+    return os.path.join(directory, 'snapshot-{}.bin'.format(graph_version[:16]))
+
+
+def encode_term(term):
+    """
+    bytes identifying @term; also the sort key of the term table
+    """
+    if isinstance(term, Literal):
+        kind = LITERAL
+        lang = (term.language or '').encode('utf-8')
+        datatype = str(term.datatype or '').encode('utf-8')
+    else:
+        kind = BNODE if isinstance(term, BNode) else URI
+        lang = datatype = b''
+    value = str(term).encode('utf-8')
+    return b''.join([kind, _LENGTH.pack(len(value)), value,
+                     _SHORT.pack(len(lang)), lang, _SHORT.pack(len(datatype)), datatype])
+
+
+def decode_term(data, start=0):
+    kind = data[start:start + 1]
+    pos = start + 1
+    n, = _LENGTH.unpack_from(data, pos)
+    pos += _LENGTH.size
+    value = str(data[pos:pos + n], 'utf-8')
+    pos += n
+    if kind == URI:
+        return URIRef(value)
+    if kind == BNODE:
+        return BNode(value)
+    n, = _SHORT.unpack_from(data, pos)
+    pos += _SHORT.size
+    lang = str(data[pos:pos + n], 'utf-8') or None
+    pos += n
+    n, = _SHORT.unpack_from(data, pos)
+    pos += _SHORT.size
+    datatype = str(data[pos:pos + n], 'utf-8') or None
+    return Literal(value, lang=lang, datatype=URIRef(datatype) if datatype else None)
+
+
+def _csr(rows, count):
+    """
+    (offsets, flat pairs) arrays from {id: [(a, b), ...]}
+    """
+    offsets = array('I', [0]) * (count + 1)
+    pairs = array('I')
+    for i in range(count):
+        for a, b in rows.get(i, ()):
+            pairs.append(a)
+            pairs.append(b)
+        offsets[i + 1] = len(pairs) // 2
+    return offsets, pairs
+
+
+def write_snapshot(path, snapshot, closure=None):
+    """
+    write the frozen in-memory @snapshot (snapshot.Snapshot) and the
+    optional hierarchy @closure (hierarchy.Closure) to @path; the file
+    only appears once it is complete
+    """
+    ids = {}
+    terms = []
+
+    def intern(term):
+        i = ids.get(term)
+        if i is None:
+            i = ids[term] = len(terms)
+            terms.append(term)
+        return i
+
+    spo = {}
+    for s, by_predicate in snapshot._spo.items():
+        spo[intern(s)] = [(intern(p), intern(o)) for p, objects in by_predicate.items() for o in objects]
+    ops = {}
+    for o, by_predicate in snapshot._ops.items():
+        ops[intern(o)] = [(intern(p), intern(s)) for p, subjects in by_predicate.items() for s in subjects]
+    up, down = {}, {}
+    if closure is not None:
+        for source, target in [(closure.up, up), (closure.down, down)]:
+            for uri, pairs in source.items():
+                target[intern(URIRef(uri))] = [(intern(r), depth) for r, depth in pairs]
+
+    encoded = [encode_term(t) for t in terms]
+    term_offsets = array('Q', [0])
+    for data in encoded:
+        term_offsets.append(term_offsets[-1] + len(data))
+    term_order = array('I', sorted(range(len(terms)), key=encoded.__getitem__))
+
+    sections = [('term_offsets', term_offsets), ('term_data', b''.join(encoded)), ('term_order', term_order)]
+    for name, rows in [('spo', spo), ('ops', ops), ('up', up), ('down', down)]:
+        offsets, pairs = _csr(rows, len(terms))
+        sections.extend([(name + '_offsets', offsets), (name, pairs)])
+
+    header = {
+        'byteorder': sys.byteorder,
+        'terms': len(terms),
+        'triples': len(snapshot),
+        'closure': closure is not None,
+        'namespaces': dict((prefix, str(ns)) for prefix, ns in snapshot.namespaces.items()),
+        'sections': {},
+    }
+    # section offsets are relative to the end of the header, 8-byte aligned
+    position = 0
+    for name, data in sections:
+        size = len(data) * (data.itemsize if isinstance(data, array) else 1)
+        header['sections'][name] = [position, size, data.typecode if isinstance(data, array) else 'B']
+        position += size + (-size % 8)
+    header_bytes = json.dumps(header).encode('utf-8')
+    header_bytes += b' ' * (-(HEADER.size + len(header_bytes)) % 8)
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(header_bytes)))
+        f.write(header_bytes)
+        for name, data in sections:
+            raw = data.tobytes() if isinstance(data, array) else data
+            f.write(raw)
+            f.write(b'\0' * (-len(raw) % 8))
+    os.replace(tmp_path, path)
+    return len(terms)
+
+
+class MappedSnapshot:
+    """
+    read-only view of a file written by write_snapshot()
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, header_size = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError("{} is not a thesaurus snapshot".format(path))
+        header = json.loads(self._mmap[HEADER.size:HEADER.size + header_size].decode('utf-8'))
+        if header['byteorder'] != sys.byteorder:
+            raise ValueError("{} was written on a {}-endian machine".format(path, header['byteorder']))
+        self.namespaces = header['namespaces']
+        self.has_closure = header['closure']
+        self._count = header['triples']
+        self._terms = header['terms']
+        view = memoryview(self._mmap)
+        base = HEADER.size + header_size
+        for name, (offset, size, typecode) in header['sections'].items():
+            section = view[base + offset:base + offset + size]
+            setattr(self, '_' + name, section.cast(typecode) if typecode != 'B' else section)
+
+    @classmethod
+    def open(cls, directory, graph_version):
+        """
+        the snapshot for @graph_version, None if it was not built
+        """
+        if not directory or not graph_version:
+            return None
+        path = snapshot_path(directory, graph_version)
+        if not os.path.exists(path):
+            return None
+        return cls(path)
+
+    def _term(self, i):
+        return decode_term(self._term_data, self._term_offsets[i])
+
+    def _id(self, term):
+        """
+        id of @term by binary search over the sorted term table, None if absent
+        """
+        if term is None:
+            return None
+        key = encode_term(term)
+        lo, hi = 0, self._terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            i = self._term_order[mid]
+            found = self._term_data[self._term_offsets[i]:self._term_offsets[i + 1]].tobytes()
+            if found < key:
+                lo = mid + 1
+            elif found > key:
+                hi = mid
+            else:
+                return i
+        return None
+
+    def _pairs(self, offsets, pairs, i):
+        if i is None:
+            return
+        for k in range(offsets[i], offsets[i + 1]):
+            yield pairs[2 * k], pairs[2 * k + 1]
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, subject):
+        i = self._id(subject)
+        return i is not None and self._spo_offsets[i + 1] > self._spo_offsets[i]
+
+    def ns(self, prefix, default=None):
+        return self.namespaces.get(prefix, default)
+
+    def objects(self, subject=None, predicate=None):
+        p = self._id(predicate)
+        if p is None:
+            return
+        for pred, o in self._pairs(self._spo_offsets, self._spo, self._id(subject)):
+            if pred == p:
+                yield self._term(o)
+
+    def subjects(self, predicate=None, object=None):
+        p = self._id(predicate)
+        if p is None:
+            return
+        for pred, s in self._pairs(self._ops_offsets, self._ops, self._id(object)):
+            if pred == p:
+                yield self._term(s)
+
+    def predicate_objects(self, subject=None):
+        predicates = {}
+        for p, o in self._pairs(self._spo_offsets, self._spo, self._id(subject)):
+            if p not in predicates:
+                predicates[p] = self._term(p)
+            yield predicates[p], self._term(o)
+
+    def triples(self, triple):
+        s, p, o = triple
+        if s is None:
+            raise ValueError("MappedSnapshot.triples needs a bound subject")
+        for pred, obj in self.predicate_objects(s):
+            if (p is None or p == pred) and (o is None or o == obj):
+                yield s, pred, obj
+
+    def value(self, subject=None, predicate=RDF.value, default=None):
+        for o in self.objects(subject, predicate):
+            return o
+        return default
+
+    def preferredLabel(self, subject, lang=None, default=None,
+                       labelProperties=(SKOS.prefLabel, RDFS.label)):
+        """
+        same contract as rdflib.Graph.preferredLabel
+        """
+        if default is None:
+            default = []
+        for label_prop in labelProperties:
+            labels = list(self.objects(subject, label_prop))
+            if lang is not None:
+                if lang == '':
+                    labels = [l for l in labels if not l.language]
+                else:
+                    labels = [l for l in labels if l.language == lang]
+            if labels:
+                return [(label_prop, l) for l in labels]
+        return default
+
+    def closure(self):
+        """
+        the hierarchy closure stored with the snapshot, None if there is none
+        """
+        return MappedClosure(self) if self.has_closure else None
+
+
+class MappedClosure:
+    """
+    hierarchy.Closure over the arrays of a MappedSnapshot
+    """
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+
+    def _lookup(self, offsets, pairs, uris, max_depth):
+        found = {}
+        for uri in uris:
+            rows = self.snapshot._pairs(offsets, pairs, self.snapshot._id(URIRef(uri)))
+            found[str(uri)] = [(self.snapshot._term(r), d) for r, d in rows
+                               if max_depth is None or d <= max_depth]
+        return found
+
+    def ancestors(self, uris, max_depth=None):
+        return self._lookup(self.snapshot._up_offsets, self.snapshot._up, uris, max_depth)
+
+    def descendants(self, uris, max_depth=None):
+        return self._lookup(self.snapshot._down_offsets, self.snapshot._down, uris, max_depth)
@@ -0,0 +1,200 @@
+"""
+Fan-out of one parse of the thesaurus to several consumers.
+
+The source is parsed once, as a stream: the parser's triples are put in
+batches on one bounded queue per stage, and every stage consumes its
+queue in its own thread.  A full queue blocks the parser, so the
+slowest stage sets the pace and the parser never runs more than the
+queued batches ahead of it; what a stage keeps of the triples it has
+consumed is up to the stage.  If a stage raises, the parser
+stops, the other stages abort at their next read, and run() raises
+StageFailed naming the stage that failed first.
+"""
+import queue
+import threading
+import time
+from collections import OrderedDict
+from rdflib import Graph
+
+# seconds a blocked put or get waits before checking for a failure
+POLL = 0.5
+# recent triples the sink remembers to drop repeated ones
+DEDUPE_WINDOW = 100000
+
+_END = object()
+
+
+class StageFailed(Exception):
+    def __init__(self, stage, error):
+        super(StageFailed, self).__init__("{} failed: {!r}".format(stage, error))
+        self.stage = stage
+        self.error = error
+
+
+class Aborted(Exception):
+    """
+    raised to a stage, or the parser, when another stage failed
+    """
+
+
+class StreamSink(Graph):
+    """
+    graph for the parser to write into that hands each triple to @emit
+    instead of storing it; only the namespace bindings are kept.
+    Duplicates are dropped among the last @window triples, which is
+    where a file repeats them, so memory does not grow with the file;
+    the stages have to cope with repeats that are further apart
+    """
+    def __init__(self, emit, window=DEDUPE_WINDOW):
+        super(StreamSink, self).__init__()
+        self.emit = emit
+        self.window = window
+        self._seen = OrderedDict()
+
+    def add(self, triple):
+        if triple not in self._seen:
+            self._seen[triple] = None
+            if len(self._seen) > self.window:
+                self._seen.popitem(last=False)
+            self.emit(triple)
+        return self
+
+
+class Stage(threading.Thread):
+    def __init__(self, name, consume, queue_size, pipeline):
+        super(Stage, self).__init__(name=name, daemon=True)
+        self.consume = consume
+        self.queue = queue.Queue(queue_size)
+        self.pipeline = pipeline
+        self.count = 0
+        self.result = None
+        self.error = None
+
+    def triples(self):
+        while True:
+            if self.pipeline.failed.is_set():
+                raise Aborted()
+            try:
+                batch = self.queue.get(timeout=POLL)
+            except queue.Empty:
+                continue
+            if batch is _END:
+                return
+            self.count += len(batch)
+            for triple in batch:
+                yield triple
+
+    def run(self):
+        try:
+            self.result = self.consume(self.triples())
+        except Aborted as ex:
+            self.error = ex
+        except BaseException as ex:
+            self.error = ex
+            self.pipeline.fail(self)
+
+
+class Pipeline:
+    def __init__(self, queue_size=8, batch_size=1000, progress=print, interval=10):
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.progress = progress
+        self.interval = interval
+        self.failed = threading.Event()
+        self._consumers = []
+        self._stages = []
+        self._failures = []
+        self._lock = threading.Lock()
+        self.parsed = 0
+
+    def add_stage(self, name, consume):
+        """
+        run consume(triples) in its own thread over every parsed triple;
+        its return value is the stage's result
+        """
+        self._consumers.append((name, consume))
+
+    def fail(self, stage):
+        with self._lock:
+            self._failures.append(stage)
+        self.failed.set()
+
+    def _put(self, item):
+        if self.failed.is_set():
+            raise Aborted()
+        for stage in self._stages:
+            while stage.is_alive():
+                if self.failed.is_set():
+                    raise Aborted()
+                try:
+                    stage.queue.put(item, timeout=POLL)
+                    break
+                except queue.Full:
+                    continue
+            # a stage that returned early takes no more batches
+
+    def _report(self, start):
+        elapsed = time.time() - start
+        queues = ", ".join("{} {}/{}".format(s.name, s.queue.qsize(), self.queue_size) for s in self._stages)
+        self.progress("{} triples parsed ({:.0f} triples/sec); queued batches: {}".format(
+            self.parsed, self.parsed / elapsed if elapsed else 0, queues))
+
+    def run(self, produce):
+        """
+        start the stages and call produce(emit), which hands every
+        triple of the source to emit(); {stage name: result} once all
+        stages are done
+        """
+        self._stages = [Stage(name, consume, self.queue_size, self) for name, consume in self._consumers]
+        for stage in self._stages:
+            stage.start()
+        start = last = time.time()
+        batch = []
+
+        def emit(triple):
+            nonlocal batch, last
+            batch.append(triple)
+            if len(batch) < self.batch_size:
+                return
+            self._put(batch)
+            self.parsed += len(batch)
+            batch = []
+            if time.time() - last >= self.interval:
+                last = time.time()
+                self._report(start)
+
+        error = None
+        try:
+            produce(emit)
+            if batch:
+                self._put(batch)
+                self.parsed += len(batch)
+            self._put(_END)
+            self.progress("Parsed {} triples in {:.1f}s".format(self.parsed, time.time() - start))
+        except BaseException as ex:
+            error = ex
+            self.failed.set()
+        for stage in self._stages:
+            stage.join()
+
+        if self._failures:
+            first = self._failures[0]
+            raise StageFailed(first.name, first.error) from first.error
+        if isinstance(error, Exception):
+            raise StageFailed('parser', error) from error
+        if error is not None:
+            raise error
+        return dict((stage.name, stage.result) for stage in self._stages)
+
+
+def stream_file(filename, public_id, format='text/turtle'):
+    """
+    produce() for Pipeline.run parsing @filename; the sink it parsed
+    into, holding the file's namespace bindings, is set on the
+    returned function once it has run
+    """
+    def produce(emit):
+        produce.sink = StreamSink(emit)
+        produce.sink.parse(source=filename, format=format, publicID=public_id)
+    produce.sink = None
+    return produce
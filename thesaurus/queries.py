@@ -0,0 +1,49 @@
+"""
+Registry of the app's SPARQL queries.
+
+Each query is parsed and translated to algebra once, when it is
+registered, and run with its parameters passed as initBindings, so no
+request value is ever formatted into query text.  The registry counts
+the executions of every query and the time spent in them.
+"""
+import threading
+import time
+from rdflib.plugins.sparql import prepareQuery
+
+
+class QueryRegistry:
+    def __init__(self, namespaces=None):
+        self.namespaces = dict(namespaces or {})
+        self._queries = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, text):
+        """
+        compile @text, with the registry's namespaces, under @name
+        """
+        self._queries[name] = prepareQuery(text, initNs=self.namespaces)
+        self._stats[name] = [0, 0.0]
+
+    def run(self, graph, name, **bindings):
+        """
+        rows of the query @name against @graph, with its variables
+        bound to @bindings
+        """
+        query = self._queries[name]
+        start = time.perf_counter()
+        rows = list(graph.query(query, initBindings=bindings))
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            stats = self._stats[name]
+            stats[0] += 1
+            stats[1] += elapsed
+        return rows
+
+    def stats(self):
+        """
+        {name: {'count', 'seconds'}} for every registered query
+        """
+        with self._lock:
+            return dict((name, {'count': count, 'seconds': seconds})
+                        for name, (count, seconds) in self._stats.items())
@@ -0,0 +1,422 @@
+"""
+Search backends for /search and /autocomplete.
+
+Both backends answer search(query, lang, size, offset, fields) with an
+Elasticsearch-shaped response ({"hits": {"total", "max_score",
+"hits": [{"_id", "_score", "_source"}]}}), where _source holds the
+requested @fields of the document load_es.py indexes for a concept and
+total counts every match, not only the returned page.
+ElasticsearchBackend queries the index; MemoryBackend answers from
+sorted word arrays built in process from the graph, for small
+deployments and tests.  msearch() answers a list of searches at once.
+
+For type-ahead every document also holds a completion field per
+language, suggest_<lang>: the preferred and alt labels, from each of
+their words on so a prefix of any word matches, weighted towards the
+preferred label, with the concept's rdf types as context.  msuggest()
+answers (prefix, lang, size, rdf_type, fields) suggestions in the shape
+of an Elasticsearch suggest response, from the completion suggester or
+in process.
+
+CoalescingSearch sits in front of a backend for /autocomplete, where
+many users type the same prefixes at the same time.
+"""
+import math
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left
+
+LANGUAGES = ['ar', 'zh', 'en', 'fr', 'ru', 'es']
+
+PREF_BOOST = 3
+
+# name of the completion context holding the short rdf type names, and
+# of the suggestion in suggest requests and responses
+SUGGEST_CONTEXT = 'rdf_type'
+SUGGESTION = 'labels'
+
+WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def empty_document(uri):
+    doc = {"uri": str(uri)}
+    for lang in LANGUAGES:
+        doc["labels_{}".format(lang)] = []
+        doc["alt_labels_{}".format(lang)] = []
+    return doc
+
+
+def suggest_inputs(label, lang):
+    """
+    @label from the start of each of its words (characters in Chinese),
+    so the completion suggester, which matches prefixes of an input,
+    matches any word
+    """
+    if lang == 'zh':
+        starts = [i for i, ch in enumerate(label) if unicodedata.category(ch)[0] in 'LN']
+    else:
+        starts = [m.start() for m in WORD.finditer(label)]
+    inputs = []
+    for start in starts:
+        rest = label[start:].strip()
+        if rest not in inputs:
+            inputs.append(rest)
+    return inputs
+
+
+def type_name(uri):
+    """
+    local name of the rdf type @uri, after its last # or /, as the
+    aspects are named
+    """
+    return str(uri).replace('#', '/').rsplit('/', 1)[-1]
+
+
+def suggest_field(pref_labels, alt_labels, rdf_types, lang):
+    """
+    completion field value for one language
+    """
+    contexts = {SUGGEST_CONTEXT: rdf_types}
+    entries = []
+    for labels, weight in [(pref_labels, PREF_BOOST), (alt_labels, 1)]:
+        inputs = [i for label in labels for i in suggest_inputs(label, lang)]
+        if inputs:
+            entries.append({"input": inputs, "weight": weight, "contexts": contexts})
+    return entries
+
+
+def build_documents(uris, pref_labels, alt_labels, rdf_types=()):
+    """
+    the documents load_es.py indexes, one per uri in @uris, from
+    (resource, Literal) pairs of preferred and alternative labels and
+    (resource, type) pairs of rdf types
+    """
+    docs = dict((str(uri), empty_document(uri)) for uri in uris)
+    for pairs, field in [(pref_labels, "labels_{}"), (alt_labels, "alt_labels_{}")]:
+        for s, o in pairs:
+            doc = docs.get(str(s))
+            if doc is not None and getattr(o, 'language', None) in LANGUAGES:
+                doc[field.format(o.language)].append(str(o))
+    types = {}
+    for s, o in rdf_types:
+        if str(s) in docs:
+            types.setdefault(str(s), []).append(type_name(o))
+    for uri, doc in docs.items():
+        for lang in LANGUAGES:
+            doc["suggest_{}".format(lang)] = suggest_field(
+                doc["labels_{}".format(lang)], doc["alt_labels_{}".format(lang)], sorted(types.get(uri, [])), lang)
+    return [docs[str(uri)] for uri in uris]
+
+
+def suggest_response(options, prefix):
+    return {"suggest": {SUGGESTION: [{"text": prefix, "options": options}]}}
+
+
+def es_response(hits, took=0):
+    return {
+        "took": took,
+        "timed_out": False,
+        "hits": {
+            "total": len(hits),
+            "max_score": hits[0]["_score"] if hits else None,
+            "hits": hits,
+        }
+    }
+
+
+class ElasticsearchBackend:
+    """
+    multi_match against label and alt label for the language,
+    boosting the preferred label
+    """
+    def __init__(self, es, index_name):
+        self.es = es
+        self.index_name = index_name
+
+    def _body(self, query, lang, size, offset=0, fields=None):
+        body = {
+            "query": {
+                "multi_match": {
+                    "query": query,
+                    "fields": ["labels_{}^{}".format(lang, PREF_BOOST), "alt_labels_{}".format(lang)]
+                }
+            },
+            "from": offset,
+            "size": size,
+        }
+        if fields is not None:
+            body["_source"] = list(fields)
+        return body
+
+    def search(self, query, lang, size, offset=0, fields=None):
+        return self.es.search(index=self.index_name, body=self._body(query, lang, size, offset, fields))
+
+    def msearch(self, searches):
+        """
+        responses to several (query, lang, size, offset, fields)
+        searches in one _msearch round trip
+        """
+        body = []
+        for search in searches:
+            body.append({"index": self.index_name})
+            body.append(self._body(*search))
+        return self._msearch(body)
+
+    def _msearch(self, body):
+        responses = self.es.msearch(body=body)["responses"]
+        for response in responses:
+            if "error" in response:
+                raise RuntimeError("search failed: {}".format(response["error"]))
+        return responses
+
+    def _suggest_body(self, prefix, lang, size, rdf_type=None, fields=None):
+        completion = {"field": "suggest_{}".format(lang), "size": size}
+        if rdf_type:
+            completion["contexts"] = {SUGGEST_CONTEXT: [rdf_type]}
+        body = {"size": 0, "suggest": {SUGGESTION: {"prefix": prefix, "completion": completion}}}
+        if fields is not None:
+            body["_source"] = list(fields)
+        return body
+
+    def msuggest(self, suggestions):
+        """
+        completion suggestions for several (prefix, lang, size,
+        rdf_type, fields) in one _msearch round trip
+        """
+        body = []
+        for suggestion in suggestions:
+            body.append({"index": self.index_name})
+            body.append(self._suggest_body(*suggestion))
+        return self._msearch(body)
+
+
+def tokenize(text, lang):
+    """
+    lower-cased words of @text; Chinese is split into characters
+    """
+    text = unicodedata.normalize('NFKC', text).casefold()
+    if lang == 'zh':
+        return [ch for ch in text if not ch.isspace() and unicodedata.category(ch)[0] in 'LN']
+    return WORD.findall(text)
+
+
+class FieldIndex:
+    """
+    sorted (word, doc) array over one field of one language; a query
+    word matches every document with a word it is a prefix of
+    """
+    def __init__(self, entries, lengths):
+        entries.sort()
+        self.words = [w for w, d in entries]
+        self.docs = [d for w, d in entries]
+        self.lengths = lengths
+
+    def prefix_matches(self, prefix):
+        matched = set()
+        i = bisect_left(self.words, prefix)
+        while i < len(self.words) and self.words[i].startswith(prefix):
+            matched.add(self.docs[i])
+            i += 1
+        return matched
+
+    def scores(self, tokens, total):
+        """
+        {doc: score}: idf of every matched query word, favouring
+        shorter labels
+        """
+        scores = {}
+        for token in tokens:
+            matched = self.prefix_matches(token)
+            if not matched:
+                continue
+            idf = math.log(1 + total / float(len(matched)))
+            for doc in matched:
+                scores[doc] = scores.get(doc, 0.0) + idf
+        return dict((doc, score / math.sqrt(self.lengths[doc])) for doc, score in scores.items())
+
+
+class MemoryBackend:
+    """
+    in-process search over the concept documents
+    """
+    def __init__(self, docs):
+        self.docs = docs
+        self.fields = {}
+        for lang in LANGUAGES:
+            for field in ("labels_{}".format(lang), "alt_labels_{}".format(lang)):
+                entries = []
+                lengths = {}
+                for i, doc in enumerate(docs):
+                    for label in doc[field]:
+                        words = tokenize(label, lang)
+                        entries.extend((w, i) for w in words)
+                        if words:
+                            lengths[i] = min(lengths.get(i, len(words)), len(words))
+                self.fields[field] = FieldIndex(entries, lengths)
+
+        self.suggestions = {}
+        for lang in LANGUAGES:
+            entries = []
+            for i, doc in enumerate(docs):
+                for entry in doc.get("suggest_{}".format(lang), ()):
+                    for text in entry["input"]:
+                        entries.append((" ".join(tokenize(text, lang)), -entry["weight"], i, text))
+            entries.sort()
+            self.suggestions[lang] = entries
+
+    def __len__(self):
+        return len(self.docs)
+
+    def _source(self, doc, fields):
+        if fields is None:
+            return self.docs[doc]
+        return dict((f, self.docs[doc][f]) for f in fields if f in self.docs[doc])
+
+    def msearch(self, searches):
+        return [self.search(*search) for search in searches]
+
+    def msuggest(self, suggestions):
+        return [self.suggest(*suggestion) for suggestion in suggestions]
+
+    def suggest(self, prefix, lang, size, rdf_type=None, fields=None):
+        """
+        the documents with an input of suggest_<lang> starting with
+        @prefix, best weight first, one option per document
+        """
+        key = " ".join(tokenize(prefix, lang))
+        entries = self.suggestions.get(lang, [])
+        best = {}
+        i = bisect_left(entries, (key,))
+        while key and i < len(entries) and entries[i][0].startswith(key):
+            normalized, weight, doc, text = entries[i]
+            i += 1
+            if rdf_type and rdf_type not in self.docs[doc]["suggest_{}".format(lang)][0]["contexts"][SUGGEST_CONTEXT]:
+                continue
+            if doc not in best or (weight, normalized) < best[doc][:2]:
+                best[doc] = (weight, normalized, text)
+        ranked = sorted(best.items(), key=lambda item: (item[1][0], item[1][1], self.docs[item[0]]["uri"]))
+        options = [{"text": text, "_id": self.docs[doc]["uri"], "_score": float(-weight),
+                    "_source": self._source(doc, fields)}
+                   for doc, (weight, normalized, text) in ranked[:size]]
+        return suggest_response(options, prefix)
+
+    def search(self, query, lang, size, offset=0, fields=None):
+        start = time.time()
+        tokens = tokenize(query, lang)
+        pref = self.fields.get("labels_{}".format(lang))
+        alt = self.fields.get("alt_labels_{}".format(lang))
+        if not tokens or pref is None:
+            return es_response([])
+        # best field wins, as in a multi_match best_fields query
+        scores = dict((doc, PREF_BOOST * s) for doc, s in pref.scores(tokens, len(self.docs)).items())
+        for doc, s in alt.scores(tokens, len(self.docs)).items():
+            scores[doc] = max(scores.get(doc, 0.0), s)
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], self.docs[item[0]]["uri"]))
+        hits = [{"_id": self.docs[doc]["uri"], "_score": score, "_source": self._source(doc, fields)}
+                for doc, score in ranked[offset:offset + size]]
+        response = es_response(hits, int((time.time() - start) * 1000))
+        response["hits"]["total"] = len(ranked)
+        return response
+
+
+class Suggestions:
+    """
+    the msuggest() of a backend as its msearch(), so CoalescingSearch
+    caches and batches completion suggestions as it does searches
+    """
+    def __init__(self, backend):
+        self.backend = backend
+
+    def msearch(self, suggestions):
+        return self.backend.msuggest(suggestions)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+
+
+class CoalescingSearch:
+    """
+    Front for a backend that answers repeated searches from @cache,
+    lets concurrent identical searches share one backend call
+    (single-flight), and sends the distinct searches arriving within
+    @window seconds of each other as one msearch.
+    """
+    def __init__(self, backend, cache=None, window=0.005, max_batch=50):
+        self.backend = backend
+        self.cache = cache
+        self.window = window
+        self.max_batch = max_batch
+        self.backend_calls = 0
+        self.searches = 0
+        self.shared = 0
+        self._inflight = {}
+        self._queue = []
+        self._lock = threading.Lock()
+
+    def stats(self):
+        return {
+            'searches': self.searches,
+            'shared': self.shared,
+            'backend_calls': self.backend_calls,
+        }
+
+    def search(self, *search):
+        """
+        the backend's response to @search, the arguments of its msearch
+        entries: (query, lang, size, offset, fields) for a search backend
+        """
+        key = tuple(tuple(arg) if isinstance(arg, list) else arg for arg in search)
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+        with self._lock:
+            self.searches += 1
+            call = self._inflight.get(key)
+            leader = False
+            if call is None:
+                call = self._inflight[key] = _Call()
+                self._queue.append(key)
+                leader = len(self._queue) == 1
+            else:
+                self.shared += 1
+        if leader:
+            # the first search of a batch waits for others to join it
+            if self.window:
+                time.sleep(self.window)
+            self._flush()
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.response
+
+    def _flush(self):
+        while True:
+            with self._lock:
+                batch = self._queue[:self.max_batch]
+                self._queue = self._queue[self.max_batch:]
+                calls = [self._inflight[key] for key in batch]
+                if batch:
+                    self.backend_calls += 1
+            if not batch:
+                return
+            try:
+                responses = self.backend.msearch(batch)
+            except Exception as e:
+                responses = None
+                for call in calls:
+                    call.error = e
+            with self._lock:
+                for i, key in enumerate(batch):
+                    del self._inflight[key]
+                    if responses is not None:
+                        calls[i].response = responses[i]
+                        if self.cache is not None:
+                            self.cache.set(key, responses[i])
+                    calls[i].done.set()
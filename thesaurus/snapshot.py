@@ -0,0 +1,108 @@
+from collections import OrderedDict
+from rdflib import RDF, RDFS, URIRef
+from rdflib.namespace import SKOS
+
+
+class Snapshot:
+    """
+    Read-only, in-memory copy of the thesaurus graph.
+
+    The SQLAlchemy store is scanned once and every triple is kept in
+    subject and object indexes, so lookups are dict accesses instead
+    of SQL round trips.  Only the subset of the rdflib Graph API that
+    the views use is implemented.
+    """
+    def __init__(self, namespaces=None):
+        self.namespaces = dict(namespaces or {})
+        self._terms = {}
+        self._spo = {}
+        self._ops = {}
+        self._count = 0
+
+    @classmethod
+    def from_graph(cls, graph):
+        """
+        build a snapshot with a single pass over all triples in @graph
+        """
+        snapshot = cls(namespaces=graph.namespaces())
+        for triple in graph.triples((None, None, None)):
+            snapshot.add(triple)
+        snapshot.freeze()
+        return snapshot
+
+    def _intern(self, term):
+        return self._terms.setdefault(term, term)
+
+    def add(self, triple):
+        s, p, o = [self._intern(t) for t in triple]
+        self._spo.setdefault(s, {}).setdefault(p, []).append(o)
+        if isinstance(o, URIRef):
+            self._ops.setdefault(o, {}).setdefault(p, []).append(s)
+        self._count += 1
+
+    def freeze(self):
+        """
+        swap the object lists for tuples once loading is done,
+        they are smaller and signal that the snapshot is read-only;
+        a triple added more than once is kept once
+        """
+        for index in (self._spo, self._ops):
+            for key, by_predicate in index.items():
+                index[key] = {p: tuple(OrderedDict.fromkeys(v)) for p, v in by_predicate.items()}
+        self._count = sum(len(v) for by_predicate in self._spo.values() for v in by_predicate.values())
+        self._terms = {}
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, subject):
+        return subject in self._spo
+
+    def ns(self, prefix, default=None):
+        """
+        namespace URI bound to @prefix in the store the snapshot was built from
+        """
+        return self.namespaces.get(prefix, default)
+
+    def objects(self, subject=None, predicate=None):
+        return iter(self._spo.get(subject, {}).get(predicate, ()))
+
+    def subjects(self, predicate=None, object=None):
+        return iter(self._ops.get(object, {}).get(predicate, ()))
+
+    def predicate_objects(self, subject=None):
+        for p, objects in self._spo.get(subject, {}).items():
+            for o in objects:
+                yield p, o
+
+    def triples(self, triple):
+        s, p, o = triple
+        if s is None:
+            raise ValueError("Snapshot.triples needs a bound subject")
+        for pred, obj in self.predicate_objects(s):
+            if (p is None or p == pred) and (o is None or o == obj):
+                yield s, pred, obj
+
+    def value(self, subject=None, predicate=RDF.value, default=None):
+        for o in self.objects(subject, predicate):
+            return o
+        return default
+
+    def preferredLabel(self, subject, lang=None, default=None,
+                       labelProperties=(SKOS.prefLabel, RDFS.label)):
+        """
+        same contract as rdflib.Graph.preferredLabel: a list of
+        (labelProperty, label) tuples, optionally filtered on language
+        """
+        if default is None:
+            default = []
+        for label_prop in labelProperties:
+            labels = self._spo.get(subject, {}).get(label_prop, ())
+            if lang is not None:
+                if lang == '':
+                    labels = [l for l in labels if not l.language]
+                else:
+                    labels = [l for l in labels if l.language == lang]
+            if labels:
+                return [(label_prop, l) for l in labels]
+        return default
@@ -0,0 +1,143 @@
+#!  /usr/bin/env    python
+
+# Utility script to apply a new release of the thesaurus to a loaded
+# database: only the triples that changed are written, in one
+# transaction, and only the concepts whose labels or types changed are
+# re-indexed in Elasticsearch.
+#
+# -dry-run only reports what would change;
+# -summary FILE also writes the changed subjects and concepts as JSON;
+# -no-index leaves Elasticsearch alone (e.g. with SEARCH_BACKEND = 'memory')
+
+import argparse
+import json
+import os.path
+import sys
+import time
+from rdflib import ConjunctiveGraph, Graph, Literal, URIRef, RDF
+from rdflib_sqlalchemy import registerplugins
+from rdflib_sqlalchemy.store import SQLAlchemy
+from flask import Flask
+from elasticsearch import Elasticsearch, helpers
+from rdflib.namespace import SKOS
+from config import DevelopmentConfig
+from dataset import file_version, publish_version, latest_versions
+from delta import diff_store, apply_delta, affected_concepts
+from fast_load import parse_file
+from hierarchy import hierarchy_edges, build_closure, store_closure, Closure
+from mmap_snapshot import snapshot_path, write_snapshot
+from search import build_documents
+from snapshot import Snapshot
+
+registerplugins()
+
+app = Flask(__name__)
+app.config.from_object(DevelopmentConfig)
+# optional file of overrides, e.g. to point the scripts at another database
+app.config.from_envvar('THESAURUS_SETTINGS', silent=True)
+
+parser = argparse.ArgumentParser(description='Apply a new release of the thesaurus')
+parser.add_argument("-f", dest="filename", required=True,
+                    help="the new release", metavar="FILE")
+parser.add_argument("-dry-run", dest="dry_run", action="store_true",
+                    help="report the changes without applying them")
+parser.add_argument("-summary", dest="summary", default=None, metavar="FILE",
+                    help="write the changed subjects and concepts to FILE as JSON")
+parser.add_argument("-no-index", dest="no_index", action="store_true",
+                    help="do not update Elasticsearch")
+
+args = parser.parse_args()
+
+if not os.path.exists(args.filename):
+    print("Invalid file: exiting.")
+    sys.exit(-1)
+
+DB_URI = app.config.get('DB_URI', None)
+IDENTIFIER = app.config.get('IDENTIFIER', None)
+SNAPSHOT_DIR = app.config.get('SNAPSHOT_DIR', None)
+ELASTICSEARCH_URI = app.config.get('ELASTICSEARCH_URI', None)
+INDEX_NAME = app.config.get('INDEX_NAME', None)
+BULK_SIZE = app.config.get('ES_BULK_SIZE', 500)
+
+uri = Literal(DB_URI)
+store = SQLAlchemy(identifier=IDENTIFIER, configuration=uri)
+graph_version = file_version(args.filename)
+
+loaded = latest_versions(store.engine).get('graph')
+if loaded is not None and loaded[0] == graph_version:
+    print("This release is already loaded.")
+    sys.exit(0)
+
+start = time.time()
+new_graph = parse_file(args.filename, IDENTIFIER)
+print("Parsed {} triples in {:.1f}s".format(len(new_graph), time.time() - start))
+
+delta = diff_store(store, new_graph)
+reindex, unindex = affected_concepts(delta, new_graph)
+summary = delta.summary()
+summary.update({
+    'concepts_reindexed': len(reindex),
+    'concepts_unindexed': len(unindex),
+})
+for key in sorted(summary):
+    print("{:>20}: {}".format(key, summary[key]))
+
+if args.summary:
+    details = dict(summary)
+    details.update({
+        'version': graph_version,
+        'subjects_added': [str(s) for s in delta.added_subjects],
+        'subjects_removed': [str(s) for s in delta.removed_subjects],
+        'subjects_changed': [str(s) for s in delta.changed_subjects],
+        'concepts_reindexed': [str(s) for s in reindex],
+        'concepts_unindexed': [str(s) for s in unindex],
+    })
+    with open(args.summary, 'w') as f:
+        json.dump(details, f, indent=2)
+
+if args.dry_run:
+    sys.exit(0)
+
+if delta:
+    for prefix, namespace in new_graph.namespaces():
+        store.bind(prefix, namespace)
+    apply_delta(store, delta, Graph(store=store, identifier=URIRef(IDENTIFIER)))
+    print("Applied {} additions and {} removals".format(len(delta.added), len(delta.removed)))
+    rows = store_closure(store.engine, build_closure(hierarchy_edges(new_graph)))
+    print("Stored {} hierarchy closure rows".format(rows))
+
+if SNAPSHOT_DIR:
+    if not os.path.isdir(SNAPSHOT_DIR):
+        os.makedirs(SNAPSHOT_DIR)
+    path = snapshot_path(SNAPSHOT_DIR, graph_version)
+    write_snapshot(path, Snapshot.from_graph(ConjunctiveGraph(store)), Closure.load(store.engine))
+    print("Wrote snapshot to {}".format(path))
+publish_version(store.engine, 'graph', graph_version)
+
+if args.no_index or not (reindex or unindex):
+    sys.exit(0)
+
+
+def index_actions(docs, removed):
+    for doc in docs:
+        yield {"_index": INDEX_NAME, "_type": "doc", "_id": doc["uri"], "_source": doc}
+    for concept in removed:
+        yield {"_op_type": "delete", "_index": INDEX_NAME, "_type": "doc", "_id": str(concept)}
+
+
+es_con = Elasticsearch(ELASTICSEARCH_URI)
+docs = build_documents(reindex,
+                       ((s, o) for s in reindex for o in new_graph.objects(s, SKOS.prefLabel)),
+                       ((s, o) for s in reindex for o in new_graph.objects(s, SKOS.altLabel)),
+                       ((s, o) for s in reindex for o in new_graph.objects(s, RDF.type)))
+success, errors = helpers.bulk(es_con, index_actions(docs, unindex), chunk_size=BULK_SIZE,
+                               raise_on_error=False)
+# deleting a document that was never indexed is not a failure
+errors = [e for e in errors if e.get('delete', {}).get('status') != 404]
+if errors:
+    print("{} documents failed to index, e.g. {}; rebuild the index with load_es.py".format(
+        len(errors), errors[0]))
+    sys.exit(-1)
+# tell the app the search results changed, so cached pages are dropped
+publish_version(store.engine, 'search', '{}@{}'.format(INDEX_NAME, graph_version[:16]))
+print("Re-indexed {} concepts and removed {} from '{}'".format(len(reindex), len(unindex), INDEX_NAME))